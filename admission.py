@@ -0,0 +1,246 @@
+import asyncio
+import json
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Latency tracker of the request class the current task runs queries for, or
+# None when its statements should not count (exports, analytics scans)
+_measuring = ContextVar("admission_measuring", default=None)
+
+
+# Raised when a request is shed; retry_after is the suggested wait in seconds
+class Rejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# Smoothed database latency of one request class, fed from the query hook.
+# Queries finish on the event loop in async DB mode and on threadpool threads
+# in sync mode, hence the lock.
+class LatencyTracker:
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self.value = None
+
+    def observe(self, seconds):
+        with self._lock:
+            if self.value is None:
+                self.value = seconds
+            else:
+                self.value += self.alpha * (seconds - self.value)
+
+
+# Function for the query hook: counts a statement towards the latency of the
+# request class being served, if that class is measured
+def observe_latency(seconds):
+    latency = _measuring.get()
+    if latency is not None:
+        latency.observe(seconds)
+
+
+# Context manager attributing the statements run inside it to a limiter, for
+# work done outside the request's own task (the group committer's flush)
+@contextmanager
+def measuring(limiter):
+    token = _measuring.set(limiter.latency if limiter is not None else None)
+    try:
+        yield
+    finally:
+        _measuring.reset(token)
+
+
+# Concurrency limit for one class of requests, with a bounded wait queue.
+#
+# Up to limit requests run at once; the next max_queue wait in arrival order,
+# anything beyond that is rejected straight away. A request is also rejected
+# up front when the expected wait (its queue position over the limit, times
+# the smoothed service time) plus its own service time would overrun its
+# deadline, and it gives up when the deadline arrives while still queued.
+#
+# The limit adapts to the database latency of its own class (AIMD): while the
+# smoothed latency is under target and the limit is being used it grows by
+# about one per limit completions, up to max_limit; above target it shrinks by
+# decrease, at most once per cooldown seconds, down to min_limit. As the
+# database slows down fewer requests reach it and the rest are turned away
+# quickly instead of queueing for seconds. With latency None the limit is fixed.
+class AdaptiveLimiter:
+    def __init__(self, name, latency, limit=20, min_limit=2, max_limit=100, max_queue=50,
+                 target=0.05, decrease=0.9, cooldown=0.5):
+        self.name = name
+        self.latency = latency
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.target = target
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._waiters = deque()
+        self._last_decrease = 0.0
+        # Smoothed seconds a request holds its slot
+        self.service_time = None
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = {"queue_full": 0, "deadline": 0, "timeout": 0}
+
+    def current_limit(self):
+        return max(self.min_limit, int(self.limit), 1)
+
+    def expected_wait(self, position):
+        return (self.service_time or 0.0) * position / self.current_limit()
+
+    def retry_after(self):
+        # Time for the current queue to drain, in whole seconds
+        return max(1, math.ceil(self.expected_wait(len(self._waiters) + 1)))
+
+    def reject(self, reason):
+        self.rejected[reason] += 1
+        return Rejected(reason, self.retry_after())
+
+    # Function to wait for a slot; raises Rejected when the request is shed
+    async def acquire(self, deadline):
+        if self.in_flight < self.current_limit() and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise self.reject("queue_full")
+        now = time.monotonic()
+        budget = deadline - now - (self.service_time or 0.0)
+        if self.expected_wait(len(self._waiters) + 1) > budget:
+            raise self.reject("deadline")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.queued += 1
+        try:
+            done, _ = await asyncio.wait([future], timeout=max(budget, 0))
+        except asyncio.CancelledError:
+            self._abandon(future)
+            raise
+        if not done:
+            self._abandon(future)
+            raise self.reject("timeout")
+        # release() handed over its slot, in_flight already counts this request
+        self.admitted += 1
+
+    def _abandon(self, future):
+        if future.done() and not future.cancelled():
+            # The slot arrived just as the wait ended; pass it on
+            self.release()
+            return
+        future.cancel()
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+
+    def release(self, held=None):
+        if held is not None:
+            if self.service_time is None:
+                self.service_time = held
+            else:
+                self.service_time += 0.1 * (held - self.service_time)
+            self._adapt()
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < self.current_limit():
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def _adapt(self):
+        if self.latency is None:
+            return
+        latency = self.latency.value
+        if latency is None:
+            return
+        if latency > self.target:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+        elif self.in_flight >= self.current_limit():
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def stats(self):
+        return {
+            "limit": self.current_limit(),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "max_queue": self.max_queue,
+            "service_ms": round(self.service_time * 1000, 2) if self.service_time is not None else None,
+            "db_latency_ms": (
+                round(self.latency.value * 1000, 2) if self.latency is not None and self.latency.value is not None
+                else None
+            ),
+            "admitted": self.admitted,
+            "waited": self.queued,
+            "rejected": dict(self.rejected),
+        }
+
+
+# ASGI middleware putting every request through the limiter classify(scope)
+# picks for it; classify returns (limiter, measured) or None to let the request
+# through. Only the statements of measured requests feed the limiter's latency.
+# A shed request gets a 503 with Retry-After without reaching the handler.
+#
+# The deadline is timeout seconds from arrival, or what the client asks for in
+# an X-Request-Timeout header (seconds), whichever is shorter.
+class AdmissionMiddleware:
+    def __init__(self, app, classify, timeout=5.0, on_reject=None):
+        self.app = app
+        self.classify = classify
+        self.timeout = timeout
+        self.on_reject = on_reject
+
+    def deadline(self, scope, arrived):
+        timeout = self.timeout
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-timeout":
+                try:
+                    timeout = min(timeout, float(value))
+                except ValueError:
+                    pass
+                break
+        return arrived + timeout
+
+    async def __call__(self, scope, receive, send):
+        chosen = self.classify(scope) if scope["type"] == "http" else None
+        if chosen is None:
+            return await self.app(scope, receive, send)
+        limiter, measured = chosen
+        arrived = time.monotonic()
+        try:
+            await limiter.acquire(self.deadline(scope, arrived))
+        except Rejected as e:
+            if self.on_reject is not None:
+                self.on_reject(limiter.name, e.reason)
+            return await self.send_rejection(send, e)
+        started = time.monotonic()
+        try:
+            with measuring(limiter if measured else None):
+                await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.monotonic() - started)
+
+    async def send_rejection(self, send, rejected):
+        body = json.dumps({"detail": "Server is overloaded, retry later", "reason": rejected.reason}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(rejected.retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,228 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# A request handed to ApiClient. cancel() drops its callbacks; the HTTP call
+# itself cannot be aborted once it has started, its result is just ignored.
+class Call:
+    def __init__(self, key, on_success, on_error):
+        self.key = key
+        self.callbacks = [(on_success, on_error)]
+        self.cancelled = False
+        self.future = None
+
+    def cancel(self):
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+
+
+# HTTP client for the Kivy app.
+#
+# Requests run on a small thread pool over one keep-alive requests.Session,
+# so the UI thread never blocks on the network. Callbacks are handed to
+# dispatch(fn), which must run fn on the UI thread (Clock.schedule_once in the
+# app). on_busy(bool) is dispatched the same way whenever the client goes from
+# idle to busy and back, to drive a loading indicator.
+#
+# An identical GET already in flight is shared rather than sent again. An
+# identical write already in flight (a double-tapped Submit) is dropped.
+class ApiClient:
+    def __init__(self, base_url, dispatch, on_busy=None, timeout=(3.05, 10), workers=4):
+        self.base_url = base_url.rstrip("/")
+        self.dispatch = dispatch
+        self.on_busy = on_busy
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api")
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def get(self, path, on_success, on_error=None, params=None):
+        return self.request("GET", path, on_success, on_error, params=params)
+
+    def post(self, path, on_success, on_error=None, json=None):
+        return self.request("POST", path, on_success, on_error, json=json)
+
+    def put(self, path, on_success, on_error=None, json=None):
+        return self.request("PUT", path, on_success, on_error, json=json)
+
+    def delete(self, path, on_success, on_error=None):
+        return self.request("DELETE", path, on_success, on_error)
+
+    # Start a request; on_success(response) or on_error(exception) runs on
+    # the UI thread. Non-2xx responses are passed to on_success.
+    def request(self, method, path, on_success, on_error=None, params=None, json=None):
+        url = f"{self.base_url}{path}"
+        key = (method, url, _freeze(params), _freeze(json))
+        with self._lock:
+            call = self._in_flight.get(key)
+            if call is not None and not call.cancelled:
+                if method == "GET":
+                    call.callbacks.append((on_success, on_error))
+                return call
+            call = Call(key, on_success, on_error)
+            self._in_flight[key] = call
+            went_busy = len(self._in_flight) == 1
+        if went_busy:
+            self._notify_busy(True)
+        call.future = self._executor.submit(self._send, call, method, url, params, json)
+        call.future.add_done_callback(lambda future: self._finish_cancelled(call, future))
+        return call
+
+    def _send(self, call, method, url, params, body):
+        try:
+            response = self.session.request(method, url, params=params, json=body, timeout=self.timeout)
+            outcome = (0, response)
+        except requests.RequestException as e:
+            outcome = (1, e)
+        self._complete(call, outcome)
+
+    # A call cancelled before it started never runs _send, so it is cleaned up here
+    def _finish_cancelled(self, call, future):
+        if future.cancelled():
+            self._complete(call, None)
+
+    def _complete(self, call, outcome):
+        with self._lock:
+            if self._in_flight.get(call.key) is call:
+                del self._in_flight[call.key]
+            went_idle = not self._in_flight
+            callbacks = [] if call.cancelled or outcome is None else list(call.callbacks)
+        for callback_pair in callbacks:
+            callback = callback_pair[outcome[0]]
+            if callback is not None:
+                self.dispatch(lambda callback=callback: callback(outcome[1]))
+        if went_idle:
+            self._notify_busy(False)
+
+    # Run fn() on the worker pool, for work that should stay off the UI thread
+    # (parsing large responses, disk I/O). on_success(result) or
+    # on_error(exception) runs on the UI thread.
+    def run(self, fn, on_success=None, on_error=None):
+        def work():
+            try:
+                result = fn()
+            except Exception as e:
+                if on_error is None:
+                    print(f"Background task failed: {e}")
+                else:
+                    self.dispatch(lambda error=e: on_error(error))
+                return
+            if on_success is not None:
+                self.dispatch(lambda: on_success(result))
+        return self._executor.submit(work)
+
+    def _notify_busy(self, busy):
+        if self.on_busy is not None:
+            self.dispatch(lambda: self.on_busy(busy))
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+
+# Listens to a Server-Sent Events endpoint on a thread of its own and hands
+# each event (parsed JSON) to on_event on the UI thread via dispatch. Reconnects
+# with backoff; after a reconnect a {"type": "resync"} event is delivered since
+# events may have been missed in between. subscribe() switches to other query
+# params (filters) and unsubscribe() disconnects until the next subscribe().
+class EventStream:
+    def __init__(self, url, dispatch, on_event, params=None, read_timeout=60):
+        self.url = url
+        self.dispatch = dispatch
+        self.on_event = on_event
+        self.params = params
+        self.subscribed = True
+        self.read_timeout = read_timeout
+        self._stopped = threading.Event()
+        # Set to cut a backoff or idle wait short
+        self._wake = threading.Event()
+        self._response = None
+        self._thread = threading.Thread(target=self._run, name="events", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._reconnect()
+
+    def subscribe(self, params):
+        self.params = params
+        self.subscribed = True
+        self._reconnect()
+
+    def unsubscribe(self):
+        self.subscribed = False
+        self._reconnect()
+
+    def _reconnect(self):
+        self._wake.set()
+        response = self._response
+        if response is not None:
+            response.close()
+
+    def _run(self):
+        session = requests.Session()
+        delay = 1
+        connected_before = False
+        while not self._stopped.is_set():
+            self._wake.clear()
+            if not self.subscribed:
+                self._wake.wait()
+                continue
+            try:
+                with session.get(self.url, params=self.params, stream=True,
+                                 timeout=(3.05, self.read_timeout)) as response:
+                    response.raise_for_status()
+                    self._response = response
+                    if self._wake.is_set():
+                        # Resubscribed while connecting, with other params
+                        continue
+                    delay = 1
+                    if connected_before:
+                        self._deliver({"type": "resync"})
+                    connected_before = True
+                    self._read(response)
+            except (requests.RequestException, ValueError):
+                pass
+            finally:
+                self._response = None
+            if self._wake.wait(delay):
+                # Filters changed: reconnect right away
+                delay = 1
+            else:
+                delay = min(delay * 2, 30)
+        session.close()
+
+    def _read(self, response):
+        data = []
+        for line in response.iter_lines(decode_unicode=True):
+            if self._stopped.is_set():
+                return
+            if not line:
+                # A blank line ends an event; comments (keep-alives) carry no data
+                if data:
+                    self._deliver(json.loads("\n".join(data)))
+                    data = []
+            elif line.startswith("data:"):
+                data.append(line[5:].lstrip())
+
+    def _deliver(self, event):
+        self.dispatch(lambda: self.on_event(event))
+
+
+def _freeze(value):
+    if value is None:
+        return None
+    return json.dumps(value, sort_keys=True, default=str)
@@ -4,11 +4,247 @@ from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.label import Label
 from kivy.uix.textinput import TextInput
 from kivy.uix.button import Button
-import requests
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.properties import StringProperty, ObjectProperty
+from kivy.clock import Clock
+from bisect import bisect_left
+import os
+
+from api_client import ApiClient, EventStream
+from local_cache import LocalCache, TABLES
 
 # Backend API URL
 BASE_URL = "http://127.0.0.1:8000"
 
+# Function to run fn on the Kivy UI thread at the next frame
+def on_ui_thread(fn):
+    Clock.schedule_once(lambda dt: fn())
+
+# Shared client: one keep-alive session, requests run on background threads.
+# The loading indicator is hooked up by RoomSchedulerApp.build
+api = ApiClient(BASE_URL, on_ui_thread)
+
+# Function returning an on_error callback that reports network failures in layout
+def show_network_error(layout, action):
+    return lambda e: layout.add_widget(Label(text=f"Failed to {action}: could not reach the server."))
+
+# Local copy of users, rooms and appointments, opened by RoomSchedulerApp.build
+local_cache = None
+
+# Changes requested per GET /changes call
+CHANGES_PAGE_SIZE = 1000
+
+# Pulls GET /changes into the local cache until caught up. Calls made while a
+# sync is running join it and trigger one more round, so they also see writes
+# made just before the call. Started on screen changes, after our own writes and
+# whenever the server pushes a change event for the list on screen.
+class ChangeSync:
+    def __init__(self):
+        self.running = False
+        self.again = False
+        self.waiters = []
+        # {table: {id: record, or None if deleted}} pulled by the current sync
+        self.changed = {}
+        # Tables the cache was cleared for, so lists on them start over
+        self.reset = set()
+        # The list on screen, patched with the rows a sync changed
+        self.watched = None
+        # Server push, set up by RoomSchedulerApp.build; subscribed to the
+        # table of the watched list only
+        self.events = None
+
+    # Show paged_list from the cache and keep it current
+    def watch(self, paged_list):
+        self.watched = paged_list
+        if self.events is not None:
+            self.events.subscribe({"entities": paged_list.table})
+        paged_list.reload()
+        self.start()
+
+    # Called when the watched list leaves the screen
+    def unwatch(self):
+        self.watched = None
+        if self.events is not None:
+            self.events.unsubscribe()
+
+    # on_done(changed table names) runs on the UI thread once the cache is current
+    def start(self, on_done=None):
+        if on_done is not None:
+            self.waiters.append(on_done)
+        if self.running:
+            self.again = True
+            return
+        self.running = True
+        self.fetch()
+
+    def fetch(self):
+        params = {"since": local_cache.token, "limit": CHANGES_PAGE_SIZE}
+        api.get("/changes", self.got_changes, self.failed, params=params)
+
+    def got_changes(self, response):
+        if response.status_code == 410:
+            # The server does not know our token (e.g. its database was reset)
+            self.reset.update(TABLES)
+            api.run(local_cache.clear, lambda result: self.fetch(), self.failed)
+        elif response.status_code != 200:
+            self.finish()
+        else:
+            # Parsing and writing a page of changes stays on the worker thread
+            api.run(lambda: self.apply(response), self.applied, self.failed)
+
+    def apply(self, response):
+        changes = response.json()
+        return local_cache.apply(changes), changes["more"]
+
+    def applied(self, outcome):
+        changed, more = outcome
+        for table, records in changed.items():
+            self.changed.setdefault(table, {}).update(records)
+        if more or self.again:
+            self.again = False
+            self.fetch()
+        else:
+            self.finish()
+
+    def failed(self, error):
+        # Offline: screens keep showing what is cached
+        self.finish()
+
+    def finish(self):
+        waiters, changed, reset = self.waiters, self.changed, self.reset
+        self.running, self.again, self.waiters, self.changed, self.reset = False, False, [], {}, set()
+        if self.watched is not None:
+            if self.watched.table in reset:
+                self.watched.reload()
+            else:
+                self.watched.apply_changes(changed.get(self.watched.table, {}))
+        for on_done in waiters:
+            on_done(reset | set(changed))
+
+change_sync = ChangeSync()
+
+# Rows read per page by the list views
+PAGE_SIZE = 100
+ROW_HEIGHT = 40
+
+# Scrolling list over one table of the local cache. Only widgets for the
+# visible rows are created, and further pages are read as the user nears the
+# bottom.
+#
+# make_row(record) turns a record into the data dict for viewclass.
+class PagedList(RecycleView):
+    def __init__(self, table, make_row, viewclass=Label, **kwargs):
+        super().__init__(**kwargs)
+        self.table = table
+        self.make_row = make_row
+        self.viewclass = viewclass
+        self.row_ids = []
+        self.next_after_id = None
+        self.loading = False
+        # Bumped on reload so pages still being read for the old list are dropped
+        self.generation = 0
+        self.status = Label(text="", size_hint_y=None, height=ROW_HEIGHT)
+
+        rows = RecycleBoxLayout(
+            orientation='vertical',
+            default_size=(None, ROW_HEIGHT),
+            default_size_hint=(1, None),
+            size_hint_y=None,
+        )
+        rows.bind(minimum_height=rows.setter('height'))
+        self.add_widget(rows)
+        self.bind(scroll_y=self.on_scrolled)
+
+    # Start over from the first page
+    def reload(self):
+        self.generation += 1
+        self.data = []
+        # Record id of each row in data, ascending like the pages
+        self.row_ids = []
+        self.next_after_id = None
+        self.fetch_page()
+
+    def fetch_page(self):
+        self.loading = True
+        generation, after_id = self.generation, self.next_after_id
+        api.run(
+            lambda: local_cache.page(self.table, after_id, PAGE_SIZE),
+            lambda records: self.show_page(generation, records),
+            self.page_failed,
+        )
+
+    def show_page(self, generation, records):
+        if generation != self.generation:
+            return
+        self.loading = False
+        self.next_after_id = records[-1]["id"] if len(records) == PAGE_SIZE else None
+        self.row_ids.extend(record["id"] for record in records)
+        self.data.extend(self.make_row(record) for record in records)
+        self.show_count()
+
+    def show_count(self):
+        self.status.text = f"{len(self.data)} shown" + (", scroll for more" if self.next_after_id else "")
+
+    def page_failed(self, error):
+        self.loading = False
+        self.status.text = f"Failed to read the local cache: {error}"
+
+    # scroll_y is 1 at the top and 0 at the bottom
+    def on_scrolled(self, instance, scroll_y):
+        if scroll_y < 0.1 and self.next_after_id is not None and not self.loading:
+            self.fetch_page()
+
+    # Patch the loaded rows with {id: record, or None if deleted} from a sync,
+    # keeping the scroll position. Records past the loaded pages are left for
+    # fetch_page to read.
+    def apply_changes(self, records):
+        if not records:
+            return
+        if self.loading:
+            # The page being read may predate these changes; read it again
+            self.generation += 1
+            self.fetch_page()
+        # Records below this id are loaded; later pages bring the rest
+        loaded_to = float("inf") if self.next_after_id is None and not self.loading else self.next_after_id or 0
+        data, row_ids = list(self.data), list(self.row_ids)
+        for record_id, record in records.items():
+            i = bisect_left(row_ids, record_id)
+            if i < len(row_ids) and row_ids[i] == record_id:
+                if record is None:
+                    del row_ids[i], data[i]
+                else:
+                    data[i] = self.make_row(record)
+            elif record is not None and record_id < loaded_to:
+                row_ids.insert(i, record_id)
+                data.insert(i, self.make_row(record))
+        self.data, self.row_ids = data, row_ids
+        self.show_count()
+
+    def remove(self, record_id):
+        self.apply_changes({record_id: None})
+
+# Recycled row of the room list: description plus Edit and Delete buttons
+class RoomRow(BoxLayout):
+    text = StringProperty("")
+    room = ObjectProperty(None)
+    edit = ObjectProperty(None)
+    delete = ObjectProperty(None)
+
+    def __init__(self, **kwargs):
+        super().__init__(orientation='horizontal', **kwargs)
+        label = Label()
+        self.bind(text=label.setter('text'))
+        self.add_widget(label)
+
+        btn_edit = Button(text="Edit", size_hint_x=0.15)
+        btn_edit.bind(on_press=lambda x: self.edit(self.room))
+        self.add_widget(btn_edit)
+
+        btn_delete = Button(text="Delete", size_hint_x=0.15)
+        btn_delete.bind(on_press=lambda x: self.delete(self.room['id']))
+        self.add_widget(btn_delete)
+
 # Home Screen
 class HomeScreen(Screen):
     def __init__(self, **kwargs):
@@ -44,7 +280,12 @@ class UserScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.layout = BoxLayout(orientation='vertical')
-        
+        self.add_widget(self.layout)
+        self.show_main_screen()
+
+    def show_main_screen(self):
+        change_sync.unwatch()
+        self.layout.clear_widgets()
         self.layout.add_widget(Label(text="Manage Users", font_size=24))
 
         # List Users Button
@@ -61,16 +302,22 @@ class UserScreen(Screen):
         btn_back.bind(on_press=self.go_back_home)
         self.layout.add_widget(btn_back)
 
-        self.add_widget(self.layout)
-
     def list_users(self, instance):
-        response = requests.get(f"{BASE_URL}/users")
-        if response.status_code == 200:
-            users = response.json()
-            for user in users:
-                self.layout.add_widget(Label(text=f"ID: {user['id']} Name: {user['name']} Email: {user['email']}"))
-        else:
-            self.layout.add_widget(Label(text="Failed to fetch users."))
+        self.layout.clear_widgets()
+        self.layout.add_widget(Label(text="User List", font_size=24, size_hint_y=None, height=50))
+
+        user_list = PagedList("users", lambda user: {
+            "text": f"ID: {user['id']} Name: {user['name']} Email: {user['email']}",
+        })
+        self.layout.add_widget(user_list)
+        self.layout.add_widget(user_list.status)
+        # Show the cached copy right away, then pull whatever changed since
+        change_sync.watch(user_list)
+
+        # Back Button
+        btn_back = Button(text="Back", size_hint_y=None, height=50)
+        btn_back.bind(on_press=lambda x: self.show_main_screen())
+        self.layout.add_widget(btn_back)
 
     def add_user(self, instance):
         self.layout.clear_widgets()
@@ -91,15 +338,20 @@ class UserScreen(Screen):
         self.layout.add_widget(btn_back)
 
     def go_back_home(self, instance):
+        change_sync.unwatch()
         self.manager.current = 'home'
 
     def submit_user(self, name, email):
         if not name or not email:
             self.layout.add_widget(Label(text="Please provide both name and email."))
             return
-        response = requests.post(f"{BASE_URL}/users", json={"name": name, "email": email})
+        api.post("/users", self.user_submitted, show_network_error(self.layout, "add user"),
+                 json={"name": name, "email": email})
+
+    def user_submitted(self, response):
         if response.status_code == 200:
             self.layout.add_widget(Label(text="User added successfully!"))
+            change_sync.start()
         else:
             self.layout.add_widget(Label(text="Failed to add user."))
 
@@ -108,6 +360,14 @@ class RoomScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.layout = BoxLayout(orientation='vertical')
+        self.room_list = None
+        self.add_widget(self.layout)
+        self.show_main_screen()
+
+    def show_main_screen(self):
+        change_sync.unwatch()
+        self.layout.clear_widgets()
+        self.room_list = None
         self.layout.add_widget(Label(text="Manage Rooms", font_size=24))
 
         # List Rooms Button
@@ -125,36 +385,22 @@ class RoomScreen(Screen):
         btn_back.bind(on_press=self.go_back_home)
         self.layout.add_widget(btn_back)
 
-        self.add_widget(self.layout)
-
     def list_rooms(self, instance):
         self.layout.clear_widgets()
-        self.layout.add_widget(Label(text="Room List", font_size=24))
-
-        response = requests.get(f"{BASE_URL}/rooms")
-        if response.status_code == 200:
-            rooms = response.json()
-            for room in rooms:
-                room_box = BoxLayout(orientation='horizontal')
-                room_box.add_widget(Label(
-                    text=f"ID: {room['id']}, Name: {room['name']}, Location: {room['location']}, Capacity: {room['capacity']}"
-                ))
-                # Edit Button
-                btn_edit = Button(text="Edit")
-                btn_edit.bind(on_press=lambda x, r=room: self.edit_room(r))
-                room_box.add_widget(btn_edit)
-
-                # Delete Button
-                btn_delete = Button(text="Delete")
-                btn_delete.bind(on_press=lambda x, r=room: self.delete_room(r['id']))
-                room_box.add_widget(btn_delete)
-
-                self.layout.add_widget(room_box)
-        else:
-            self.layout.add_widget(Label(text="Failed to fetch rooms."))
+        self.layout.add_widget(Label(text="Room List", font_size=24, size_hint_y=None, height=50))
+
+        self.room_list = PagedList("rooms", lambda room: {
+            "text": f"ID: {room['id']}, Name: {room['name']}, Location: {room['location']}, Capacity: {room['capacity']}",
+            "room": room,
+            "edit": self.edit_room,
+            "delete": self.delete_room,
+        }, viewclass=RoomRow)
+        self.layout.add_widget(self.room_list)
+        self.layout.add_widget(self.room_list.status)
+        change_sync.watch(self.room_list)
 
         # Back Button
-        btn_back = Button(text="Back")
+        btn_back = Button(text="Back", size_hint_y=None, height=50)
         btn_back.bind(on_press=lambda x: self.show_main_screen())
         self.layout.add_widget(btn_back)
 
@@ -181,6 +427,8 @@ class RoomScreen(Screen):
         self.layout.add_widget(btn_back)
 
     def edit_room(self, room):
+        change_sync.unwatch()
+        self.room_list = None
         self.layout.clear_widgets()
         self.layout.add_widget(Label(text=f"Edit Room ID: {room['id']}", font_size=24))
 
@@ -204,45 +452,53 @@ class RoomScreen(Screen):
 
     def update_room(self, room_id, name, location, capacity):
         try:
-            response = requests.put(f"{BASE_URL}/rooms/{room_id}", json={
-                "name": name,
-                "location": location,
-                "capacity": int(capacity)
-            })
-            if response.status_code == 200:
-                self.layout.add_widget(Label(text="Room updated successfully!"))
-            else:
-                self.layout.add_widget(Label(text="Failed to update room."))
+            room = {"name": name, "location": location, "capacity": int(capacity)}
         except ValueError:
             self.layout.add_widget(Label(text="Invalid capacity value. Please enter a number."))
+            return
+        api.put(f"/rooms/{room_id}", self.room_updated, show_network_error(self.layout, "update room"),
+                json=room)
+
+    def room_updated(self, response):
+        if response.status_code == 200:
+            self.layout.add_widget(Label(text="Room updated successfully!"))
+            change_sync.start()
+        else:
+            self.layout.add_widget(Label(text="Failed to update room."))
 
     def delete_room(self, room_id):
-        response = requests.delete(f"{BASE_URL}/rooms/{room_id}")
+        api.delete(f"/rooms/{room_id}", lambda response: self.room_deleted(room_id, response),
+                   show_network_error(self.layout, "delete room"))
+
+    def room_deleted(self, room_id, response):
         if response.status_code == 200:
-            self.layout.add_widget(Label(text="Room deleted successfully!"))
-            self.list_rooms(None)  # Refresh the room list
+            # Drop the row in place; the sync then only pulls the tombstone
+            if self.room_list is not None:
+                self.room_list.remove(room_id)
+                self.room_list.status.text = "Room deleted successfully!"
+            else:
+                self.layout.add_widget(Label(text="Room deleted successfully!"))
+            change_sync.start()
         else:
             self.layout.add_widget(Label(text="Failed to delete room."))
 
     def submit_room(self, name, location, capacity):
         try:
-            response = requests.post(f"{BASE_URL}/rooms", json={
-                "name": name,
-                "location": location,
-                "capacity": int(capacity)
-            })
-            if response.status_code == 200:
-                self.layout.add_widget(Label(text="Room added successfully!"))
-            else:
-                self.layout.add_widget(Label(text="Failed to add room."))
+            room = {"name": name, "location": location, "capacity": int(capacity)}
         except ValueError:
             self.layout.add_widget(Label(text="Invalid capacity value. Please enter a number."))
+            return
+        api.post("/rooms", self.room_submitted, show_network_error(self.layout, "add room"), json=room)
 
-    def show_main_screen(self):
-        self.layout.clear_widgets()
-        self.__init__()
+    def room_submitted(self, response):
+        if response.status_code == 200:
+            self.layout.add_widget(Label(text="Room added successfully!"))
+            change_sync.start()
+        else:
+            self.layout.add_widget(Label(text="Failed to add room."))
 
     def go_back_home(self, instance):
+        change_sync.unwatch()
         self.manager.current = 'home'
 
 
@@ -251,27 +507,82 @@ class RoomScreen(Screen):
 class AppointmentScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        layout = BoxLayout(orientation='vertical')
-        layout.add_widget(Label(text="Manage Appointments", font_size=24))
+        self.layout = BoxLayout(orientation='vertical')
+        self.add_widget(self.layout)
+        self.show_main_screen()
+
+    def show_main_screen(self):
+        change_sync.unwatch()
+        self.layout.clear_widgets()
+        self.layout.add_widget(Label(text="Manage Appointments", font_size=24))
+
+        # List Appointments Button
+        btn_list = Button(text="List Appointments")
+        btn_list.bind(on_press=self.list_appointments)
+        self.layout.add_widget(btn_list)
 
         btn_back = Button(text="Back to Home")
         btn_back.bind(on_press=self.go_back_home)
-        layout.add_widget(btn_back)
+        self.layout.add_widget(btn_back)
 
-        self.add_widget(layout)
+    def list_appointments(self, instance):
+        self.layout.clear_widgets()
+        self.layout.add_widget(Label(text="Appointment List", font_size=24, size_hint_y=None, height=50))
+
+        appointment_list = PagedList("appointments", lambda a: {
+            "text": f"ID: {a['id']} Room: {a['room_id']} User: {a['user_id']} "
+                    f"{a['start_time']} - {a['end_time']} ({a['status']})",
+        })
+        self.layout.add_widget(appointment_list)
+        self.layout.add_widget(appointment_list.status)
+        change_sync.watch(appointment_list)
+
+        # Back Button
+        btn_back = Button(text="Back", size_hint_y=None, height=50)
+        btn_back.bind(on_press=lambda x: self.show_main_screen())
+        self.layout.add_widget(btn_back)
 
     def go_back_home(self, instance):
+        change_sync.unwatch()
         self.manager.current = 'home'
 
 # Screen Manager
 class RoomSchedulerApp(App):
     def build(self):
+        global local_cache
+        local_cache = LocalCache(os.path.join(self.user_data_dir, "cache.sqlite3"))
+
+        root = BoxLayout(orientation='vertical')
+
+        # Loading indicator, shown while any request is in flight
+        self.loading = Label(text="Loading...", size_hint_y=None, height=0, opacity=0)
+        root.add_widget(self.loading)
+        api.on_busy = self.set_loading
+
+        # Server push: a change event for the list on screen (or a resync after
+        # missed events) pulls the delta instead of re-polling the list. Only
+        # connected while a list is shown, see ChangeSync.watch
+        self.events = EventStream(f"{BASE_URL}/events", on_ui_thread, lambda event: change_sync.start())
+        self.events.unsubscribe()
+        change_sync.events = self.events
+        self.events.start()
+
         sm = ScreenManager()
         sm.add_widget(HomeScreen(name='home'))
         sm.add_widget(UserScreen(name='users'))
         sm.add_widget(RoomScreen(name='rooms'))
         sm.add_widget(AppointmentScreen(name='appointments'))
-        return sm
+        root.add_widget(sm)
+        return root
+
+    def set_loading(self, busy):
+        self.loading.height = 30 if busy else 0
+        self.loading.opacity = 1 if busy else 0
+
+    def on_stop(self):
+        self.events.stop()
+        api.close()
+        local_cache.close()
 
 if __name__ == "__main__":
     RoomSchedulerApp().run()
@@ -0,0 +1,86 @@
+import time
+from bisect import bisect_left, bisect_right
+
+
+# Rooms bucketed by capacity for the availability search.
+#
+# Rooms are kept as a list sorted by (capacity, id), so "capacity >= N" is a
+# bisect followed by a slice. Bookings are not stored here; each candidate is
+# checked against its RoomIntervals in the interval index.
+#
+# Reloaded as a whole in the background and updated in place for writes made
+# by this worker. Writes made between start_reload() and load() are applied
+# again on top of the loaded rooms.
+class RoomCatalog:
+    def __init__(self):
+        self.rooms = {}
+        # Parallel lists sorted by (capacity, id)
+        self._by_capacity = []
+        self._sorted_rooms = []
+        self.loaded_at = None
+        self._pending = None
+
+    def start_reload(self):
+        self._pending = []
+
+    @staticmethod
+    def _key(room):
+        return (room.get("capacity") or 0, room["id"])
+
+    def load(self, rooms):
+        self.rooms = {room["id"]: room for room in rooms}
+        self._sorted_rooms = sorted(self.rooms.values(), key=self._key)
+        self._by_capacity = [self._key(room) for room in self._sorted_rooms]
+        self.loaded_at = time.monotonic()
+        pending, self._pending = self._pending or [], None
+        for change, arg in pending:
+            change(arg)
+
+    def put(self, room):
+        if self._pending is not None:
+            self._pending.append((self.put, room))
+        if self.loaded_at is None:
+            return
+        self._remove(room["id"])
+        self.rooms[room["id"]] = room
+        key = self._key(room)
+        i = bisect_left(self._by_capacity, key)
+        self._by_capacity.insert(i, key)
+        self._sorted_rooms.insert(i, room)
+
+    def discard(self, room_id):
+        if self._pending is not None:
+            self._pending.append((self.discard, room_id))
+        self._remove(room_id)
+
+    def _remove(self, room_id):
+        room = self.rooms.pop(room_id, None)
+        if room is not None:
+            i = bisect_left(self._by_capacity, self._key(room))
+            del self._by_capacity[i]
+            del self._sorted_rooms[i]
+
+    # Rooms with capacity >= min_capacity (and at the given location), smallest first
+    def candidates(self, min_capacity=None, location=None):
+        start = bisect_left(self._by_capacity, (min_capacity, -1)) if min_capacity is not None else 0
+        rooms = self._sorted_rooms[start:]
+        if location is not None:
+            rooms = [room for room in rooms if room.get("location") == location]
+        return rooms
+
+
+# Function returning the rooms from candidates that have no booking overlapping [start, end),
+# including occurrences of the recurring series in series_index when given
+def free_rooms(candidates, interval_index, start, end, limit, series_index=None):
+    result = []
+    by_room = interval_index.rooms
+    for room in candidates:
+        intervals = by_room.get(room["id"])
+        # Inlined RoomIntervals.count_overlapping; this loop is the hot path
+        if intervals is None or bisect_left(intervals.starts, end) - bisect_right(intervals.ends, start) <= 0:
+            if series_index is not None and series_index.conflict(room["id"], start, end):
+                continue
+            result.append(room)
+            if len(result) >= limit:
+                break
+    return result
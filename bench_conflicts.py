@@ -0,0 +1,69 @@
+# Conflict checks per second against one room as its number of bookings grows.
+#
+#   python bench_conflicts.py
+#
+# Compares the RoomIntervals index used by create_appointment with a linear
+# scan over the same bookings (what an in-memory overlap query would do).
+import random
+import time
+from datetime import datetime, timedelta
+
+from interval_index import RoomIntervals
+
+SIZES = [10, 100, 1_000, 10_000, 100_000]
+CHECKS = 20_000
+EPOCH = datetime(2024, 1, 1)
+
+
+# Back-to-back 30/60/90 minute bookings with random gaps, like a busy room
+def make_bookings(n):
+    bookings = []
+    t = EPOCH
+    for i in range(n):
+        t += timedelta(minutes=random.choice((0, 15, 30, 60)))
+        end = t + timedelta(minutes=random.choice((30, 60, 90)))
+        bookings.append((i, t, end))
+        t = end
+    return bookings
+
+
+def make_queries(bookings, count):
+    horizon = (bookings[-1][2] - EPOCH).total_seconds()
+    queries = []
+    for _ in range(count):
+        start = EPOCH + timedelta(seconds=random.uniform(0, horizon))
+        queries.append((start, start + timedelta(minutes=random.choice((30, 60)))))
+    return queries
+
+
+def linear_conflict(bookings, start, end):
+    for appointment_id, s, e in bookings:
+        if s < end and e > start:
+            return appointment_id
+    return None
+
+
+def rate(fn, queries):
+    started = time.perf_counter()
+    for start, end in queries:
+        fn(start, end)
+    return len(queries) / (time.perf_counter() - started)
+
+
+def main():
+    random.seed(42)
+    print(f"{'bookings':>10} {'index checks/s':>16} {'linear checks/s':>16} {'conflicts':>10}")
+    for n in SIZES:
+        bookings = make_bookings(n)
+        room = RoomIntervals(bookings)
+        queries = make_queries(bookings, CHECKS)
+        index_rate = rate(room.find_conflict, queries)
+        # The linear scan gets slow quickly; a smaller sample is enough
+        linear_queries = queries[: max(100, CHECKS * 100 // n)]
+        linear_rate = rate(lambda s, e: linear_conflict(bookings, s, e), linear_queries)
+        conflicts = sum(room.find_conflict(s, e) is not None for s, e in queries) / len(queries)
+        print(f"{n:>10} {index_rate:>16,.0f} {linear_rate:>16,.0f} {conflicts:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Bytes on the wire and encode time per response format for appointment pages.
+#
+#   python bench_formats.py
+#
+# "stock json" is what FastAPI did before content negotiation: jsonable_encoder
+# followed by json.dumps. The other rows go through formats.encode, the path
+# the list and export endpoints use now.
+import json
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+
+import formats
+
+SIZES = [100, 1_000, 10_000]
+EPOCH = datetime(2024, 1, 1, 8)
+PURPOSES = ["Team meeting", "1:1", "Interview", "Planning", "Customer call"]
+
+
+# Rows shaped like DictCursor results from GET /appointments
+def make_rows(n):
+    rows = []
+    for i in range(n):
+        start = EPOCH + timedelta(minutes=30 * i)
+        rows.append({
+            "id": i + 1,
+            "user_id": i % 200 + 1,
+            "room_id": i % 50 + 1,
+            "start_time": start,
+            "end_time": start + timedelta(minutes=60),
+            "purpose": PURPOSES[i % len(PURPOSES)],
+            "status": "scheduled",
+        })
+    return rows
+
+
+def stock_json(rows):
+    return json.dumps(
+        jsonable_encoder(rows), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+ENCODERS = [
+    ("stock json", stock_json),
+    ("json", lambda rows: formats.encode(rows, formats.JSON)),
+    ("json columnar", lambda rows: formats.encode(rows, formats.JSON, True)),
+]
+if formats.msgpack is not None:
+    ENCODERS += [
+        ("msgpack", lambda rows: formats.encode(rows, formats.MSGPACK)),
+        ("msgpack columnar", lambda rows: formats.encode(rows, formats.MSGPACK, True)),
+    ]
+
+
+def timed(encode, rows):
+    repeat = max(3, 20_000 // len(rows))
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = encode(rows)
+        best = min(best, time.perf_counter() - started)
+    return body, best
+
+
+def main():
+    print(f"JSON encoder: {'orjson' if formats.orjson is not None else 'json (stdlib)'}")
+    print(f"{'rows':>7} {'format':>17} {'bytes':>11} {'bytes/row':>10} {'encode ms':>10} {'vs stock':>9}")
+    for n in SIZES:
+        rows = make_rows(n)
+        stock_seconds = None
+        for name, encode in ENCODERS:
+            body, seconds = timed(encode, rows)
+            stock_seconds = stock_seconds or seconds
+            print(f"{n:>7} {name:>17} {len(body):>11,} {len(body) / n:>10.1f} {seconds * 1000:>10.2f} "
+                  f"{stock_seconds / seconds:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
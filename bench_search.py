@@ -0,0 +1,57 @@
+# Latency of GET /users/search lookups against the in-memory text index.
+#
+#   python bench_search.py [users]
+#
+# Builds a TextIndex over synthetic users (100k by default) and times typical
+# type-ahead queries, from selective names to terms most users share.
+import random
+import sys
+import time
+
+from search import TextIndex
+
+FIRST = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "José", "Zoë",
+         "William", "Elizabeth", "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah"]
+LAST = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+        "Hernández", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin"]
+DOMAINS = ["example.com", "mail.example.org", "corp.example.net"]
+QUERIES = ["j", "jo", "jos", "jose", "smith", "mary smi", "smith mary", "john.smith4", "example", "com", "zzz"]
+
+
+def make_users(n):
+    rng = random.Random(1)
+    users = []
+    for i in range(1, n + 1):
+        first, last = rng.choice(FIRST), rng.choice(LAST)
+        email = f"{first.lower()}.{last.lower()}{i}@{rng.choice(DOMAINS)}"
+        users.append({"id": i, "name": f"{first} {last}", "email": email})
+    return users
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    users = make_users(n)
+    started = time.perf_counter()
+    index = TextIndex(("name", "email"), users)
+    print(f"Indexed {n:,} users in {time.perf_counter() - started:.2f}s: {index.stats()}")
+
+    started = time.perf_counter()
+    for i in range(100):
+        index.put({"id": n + i + 1, "name": f"New User {i}", "email": f"new{i}@example.com"})
+        index.discard(n + i + 1)
+    print(f"put + discard: {(time.perf_counter() - started) * 10:.3f} ms each")
+
+    print(f"{'query':>12} {'results':>8} {'ms':>8}  top")
+    for query in QUERIES:
+        results = index.search(query, limit=20)
+        best = float("inf")
+        for _ in range(20):
+            started = time.perf_counter()
+            index.search(query, limit=20)
+            best = min(best, time.perf_counter() - started)
+        top = results[0]["email"] if results else "-"
+        print(f"{query!r:>12} {len(results):>8} {best * 1000:>8.2f}  {top}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+import asyncio
+import time
+from collections import namedtuple
+from contextlib import asynccontextmanager
+
+import pymysql
+from pymysql.constants import SERVER_STATUS
+from starlette.concurrency import run_in_threadpool
+
+from db_pool import PoolExhausted, PoolConnectError
+
+# Result of a statement that does not return rows
+ExecResult = namedtuple("ExecResult", ["rowcount", "lastrowid"])
+
+
+# Optional instrumentation hook, called as hook(sql, execute_seconds, fetch_seconds, rows).
+# For buffered cursors execute includes reading the result set off the wire.
+_query_hook = None
+
+
+def set_query_hook(hook):
+    global _query_hook
+    _query_hook = hook
+
+
+# True when an error means the connection itself can no longer be used
+def is_disconnect(error):
+    return isinstance(error, (pymysql.OperationalError, pymysql.InterfaceError, ConnectionError))
+
+
+# Session over a blocking pymysql connection. Every call is pushed onto the
+# threadpool, so handlers stay `async def` while the driver stays blocking.
+class SyncSession:
+    def __init__(self, connection, owner=None):
+        self.connection = connection
+        # The database the session was checked out from and must be released to
+        self.owner = owner
+        self.broken = False
+
+    def _run(self, sql, args, fetch):
+        with self.connection.cursor() as cursor:
+            started = time.perf_counter()
+            cursor.execute(sql, args)
+            executed = time.perf_counter()
+            if fetch == "one":
+                result = cursor.fetchone()
+                rows = 1 if result else 0
+            elif fetch == "all":
+                result = cursor.fetchall()
+                rows = len(result)
+            else:
+                result = ExecResult(cursor.rowcount, cursor.lastrowid)
+                rows = cursor.rowcount
+            if _query_hook is not None:
+                _query_hook(sql, executed - started, time.perf_counter() - executed, rows)
+            return result
+
+    def _run_many(self, sql, seq_of_args):
+        with self.connection.cursor() as cursor:
+            started = time.perf_counter()
+            cursor.executemany(sql, seq_of_args)
+            if _query_hook is not None:
+                _query_hook(sql, time.perf_counter() - started, 0.0, cursor.rowcount)
+            return ExecResult(cursor.rowcount, cursor.lastrowid)
+
+    async def fetchone(self, sql, args=None):
+        return await run_in_threadpool(self._run, sql, args, "one")
+
+    async def fetchall(self, sql, args=None):
+        return await run_in_threadpool(self._run, sql, args, "all")
+
+    async def execute(self, sql, args=None):
+        return await run_in_threadpool(self._run, sql, args, None)
+
+    async def executemany(self, sql, seq_of_args):
+        return await run_in_threadpool(self._run_many, sql, seq_of_args)
+
+    # Yield rows in lists of up to batch_size from an unbuffered server-side
+    # cursor. A stream abandoned half way leaves unread rows on the wire, so
+    # the connection is marked broken instead of draining them.
+    async def stream(self, sql, args=None, batch_size=1000):
+        cursor = self.connection.cursor(pymysql.cursors.SSDictCursor)
+        finished = False
+        execute_seconds = fetch_seconds = 0.0
+        count = 0
+        try:
+            started = time.perf_counter()
+            await run_in_threadpool(cursor.execute, sql, args)
+            execute_seconds = time.perf_counter() - started
+            while True:
+                started = time.perf_counter()
+                rows = await run_in_threadpool(cursor.fetchmany, batch_size)
+                fetch_seconds += time.perf_counter() - started
+                if not rows:
+                    finished = True
+                    break
+                count += len(rows)
+                yield rows
+        finally:
+            if finished:
+                await run_in_threadpool(cursor.close)
+            else:
+                self.broken = True
+            if _query_hook is not None:
+                _query_hook(sql, execute_seconds, fetch_seconds, count)
+
+    async def begin(self):
+        await run_in_threadpool(self.connection.begin)
+
+    async def commit(self):
+        await run_in_threadpool(self.connection.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.connection.rollback)
+
+
+# Session over an aiomysql connection; runs directly on the event loop
+class AsyncSession:
+    def __init__(self, connection, owner=None):
+        self.connection = connection
+        self.owner = owner
+        self.broken = False
+
+    async def _run(self, sql, args, fetch):
+        async with self.connection.cursor() as cursor:
+            started = time.perf_counter()
+            await cursor.execute(sql, args)
+            executed = time.perf_counter()
+            if fetch == "one":
+                result = await cursor.fetchone()
+                rows = 1 if result else 0
+            elif fetch == "all":
+                result = await cursor.fetchall()
+                rows = len(result)
+            else:
+                result = ExecResult(cursor.rowcount, cursor.lastrowid)
+                rows = cursor.rowcount
+            if _query_hook is not None:
+                _query_hook(sql, executed - started, time.perf_counter() - executed, rows)
+            return result
+
+    async def fetchone(self, sql, args=None):
+        return await self._run(sql, args, "one")
+
+    async def fetchall(self, sql, args=None):
+        return await self._run(sql, args, "all")
+
+    async def execute(self, sql, args=None):
+        return await self._run(sql, args, None)
+
+    async def executemany(self, sql, seq_of_args):
+        async with self.connection.cursor() as cursor:
+            started = time.perf_counter()
+            await cursor.executemany(sql, seq_of_args)
+            if _query_hook is not None:
+                _query_hook(sql, time.perf_counter() - started, 0.0, cursor.rowcount)
+            return ExecResult(cursor.rowcount, cursor.lastrowid)
+
+    # Same contract as SyncSession.stream
+    async def stream(self, sql, args=None, batch_size=1000):
+        import aiomysql
+
+        cursor = await self.connection.cursor(aiomysql.SSDictCursor)
+        finished = False
+        execute_seconds = fetch_seconds = 0.0
+        count = 0
+        try:
+            started = time.perf_counter()
+            await cursor.execute(sql, args)
+            execute_seconds = time.perf_counter() - started
+            while True:
+                started = time.perf_counter()
+                rows = await cursor.fetchmany(batch_size)
+                fetch_seconds += time.perf_counter() - started
+                if not rows:
+                    finished = True
+                    break
+                count += len(rows)
+                yield rows
+        finally:
+            if finished:
+                await cursor.close()
+            else:
+                self.broken = True
+            if _query_hook is not None:
+                _query_hook(sql, execute_seconds, fetch_seconds, count)
+
+    async def begin(self):
+        await self.connection.begin()
+
+    async def commit(self):
+        await self.connection.commit()
+
+    async def rollback(self):
+        await self.connection.rollback()
+
+
+class _Database:
+    mode = None
+
+    # Check out a session for the duration of the block
+    @asynccontextmanager
+    async def session(self):
+        session, _ = await self.acquire()
+        broken = False
+        try:
+            yield session
+        except BaseException as e:
+            broken = is_disconnect(e)
+            raise
+        finally:
+            await self.release(session, broken=broken)
+
+
+# Blocking pymysql driver behind db_pool.ConnectionPool.
+#
+# Requests wait for a free connection on the event loop (a semaphore of
+# max_size permits), not inside pool.acquire: a thread blocked waiting for a
+# connection would hold one of the threadpool's tokens, which the requests
+# holding connections need to run their queries and give them back. Once a
+# permit is held pool.acquire returns without waiting for another request.
+class SyncDatabase(_Database):
+    mode = "sync"
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._slots = asyncio.Semaphore(pool.max_size)
+        self.timeouts = 0
+
+    async def start(self):
+        await run_in_threadpool(self.pool.fill)
+
+    async def close(self):
+        await run_in_threadpool(self.pool.close)
+
+    async def acquire(self):
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.pool.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise PoolExhausted(
+                f"No database connection available within {self.pool.timeout:.1f}s "
+                f"({self.pool.max_size} in use)"
+            )
+        try:
+            connection, _ = await run_in_threadpool(self.pool.acquire)
+        except BaseException:
+            self._slots.release()
+            raise
+        return SyncSession(connection, self), time.monotonic() - started
+
+    async def release(self, session, broken=False):
+        connection = session.connection
+        broken = broken or session.broken
+        try:
+            if broken or not connection.open or connection.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                # Rollback or close talks to the server, keep it off the event loop
+                await run_in_threadpool(self.pool.release, connection, broken)
+            else:
+                # Only takes the pool's lock; no need to wait for a thread
+                self.pool.release(connection)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        stats = dict(self.pool.stats(), mode=self.mode)
+        stats["timeouts"] += self.timeouts
+        return stats
+
+
+# aiomysql driver and pool. aiomysql is only needed when this mode is selected.
+class AsyncDatabase(_Database):
+    mode = "async"
+
+    def __init__(self, host, user, password, db, min_size=2, max_size=20,
+                 timeout=5.0, max_age=1800.0, ping_after=30.0, port=3306):
+        self._connect_kwargs = {"host": host, "port": port, "user": user, "password": password, "db": db}
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.ping_after = ping_after
+        self._pool = None
+        self._pool_lock = asyncio.Lock()
+        self._last_used = {}
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.failed_health_checks = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # Also called from acquire, so a server that was down at startup is picked
+    # up once it comes back rather than leaving the pool unusable
+    async def start(self):
+        import aiomysql
+
+        async with self._pool_lock:
+            if self._pool is not None:
+                return
+            try:
+                self._pool = await aiomysql.create_pool(
+                    minsize=self.min_size,
+                    maxsize=self.max_size,
+                    pool_recycle=int(self.max_age),
+                    cursorclass=aiomysql.DictCursor,
+                    autocommit=False,
+                    **self._connect_kwargs
+                )
+            except (pymysql.MySQLError, OSError) as e:
+                raise PoolConnectError(f"Error connecting to MySQL database: {e}") from e
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+
+    async def acquire(self):
+        if self._pool is None:
+            await self.start()
+        started = time.monotonic()
+        while True:
+            remaining = self.timeout - (time.monotonic() - started)
+            try:
+                connection = await asyncio.wait_for(self._pool.acquire(), max(remaining, 0))
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise PoolExhausted(
+                    f"No database connection available within {self.timeout:.1f}s "
+                    f"({self.max_size} in use)"
+                )
+            except pymysql.MySQLError as e:
+                raise PoolConnectError(f"Error connecting to MySQL database: {e}") from e
+
+            last_used = self._last_used.get(id(connection), started)
+            if time.monotonic() - last_used > self.ping_after:
+                try:
+                    await connection.ping(reconnect=False)
+                except Exception:
+                    self.failed_health_checks += 1
+                    self._last_used.pop(id(connection), None)
+                    connection.close()
+                    self._pool.release(connection)
+                    continue
+
+            waited = time.monotonic() - started
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            return AsyncSession(connection, self), waited
+
+    async def release(self, session, broken=False):
+        connection = session.connection
+        broken = broken or session.broken
+        if not broken and not connection.closed and connection.get_transaction_status():
+            try:
+                await connection.rollback()
+            except pymysql.MySQLError:
+                broken = True
+        if broken:
+            self._last_used.pop(id(connection), None)
+            connection.close()
+        else:
+            self._last_used[id(connection)] = time.monotonic()
+        self._pool.release(connection)
+
+    def stats(self):
+        pool = self._pool
+        return {
+            "mode": self.mode,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "size": pool.size if pool else 0,
+            "idle": pool.freesize if pool else 0,
+            "in_use": (pool.size - pool.freesize) if pool else 0,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "failed_health_checks": self.failed_health_checks,
+            "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+        }
@@ -0,0 +1,224 @@
+import threading
+import time
+from collections import deque
+
+import pymysql
+from pymysql.constants import SERVER_STATUS
+
+
+# Raised when no connection could be handed out within the checkout timeout
+class PoolExhausted(Exception):
+    pass
+
+
+# Raised when a new connection could not be opened
+class PoolConnectError(Exception):
+    pass
+
+
+class _PooledConnection:
+    __slots__ = ("connection", "created_at", "last_used")
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+# Thread-safe pool of pymysql connections.
+#
+# connect is a zero-argument callable returning a new connection. Idle
+# connections are checked out LIFO so the hot ones stay warm, pinged when they
+# have been idle longer than ping_after seconds and recycled once they are
+# older than max_age seconds.
+class ConnectionPool:
+    def __init__(self, connect, min_size=2, max_size=20, timeout=5.0,
+                 max_age=1800.0, ping_after=30.0, on_connect=None):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("invalid pool size")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.ping_after = ping_after
+        # Optional callback receiving the seconds each new connection took to open
+        self.on_connect = on_connect
+
+        self._idle = deque()
+        self._in_use = {}
+        self._opening = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # Statistics
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.recycled = 0
+        self.failed_health_checks = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def size(self):
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    # Open connections until min_size is reached
+    def fill(self):
+        while True:
+            with self._cond:
+                if self._closed or self.size >= self.min_size:
+                    return
+                self._opening += 1
+            try:
+                entry = self._open()
+            except PoolConnectError:
+                with self._cond:
+                    self._opening -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._opening -= 1
+                self._idle.append(entry)
+                self._cond.notify()
+
+    def _open(self):
+        started = time.monotonic()
+        try:
+            connection = self._connect()
+        except pymysql.MySQLError as e:
+            raise PoolConnectError(f"Error connecting to MySQL database: {e}") from e
+        self.connects += 1
+        if self.on_connect is not None:
+            self.on_connect(time.monotonic() - started)
+        return _PooledConnection(connection)
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    # Returns False when an idle connection must not be handed out again
+    def _healthy(self, entry, now):
+        if now - entry.created_at > self.max_age:
+            self.recycled += 1
+            return False
+        if now - entry.last_used > self.ping_after:
+            try:
+                entry.connection.ping(reconnect=False)
+            except Exception:
+                self.failed_health_checks += 1
+                return False
+        return True
+
+    # Check out a connection, returning (connection, seconds spent waiting)
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolExhausted("Connection pool is closed")
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self.size < self.max_size:
+                        self._opening += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolExhausted(
+                            f"No database connection available within {timeout:.1f}s "
+                            f"({self.max_size} in use)"
+                        )
+                    self._cond.wait(remaining)
+                if entry is not None:
+                    # Hold the slot while the health check runs outside the lock
+                    self._in_use[id(entry.connection)] = entry
+
+            if entry is None:
+                try:
+                    entry = self._open()
+                finally:
+                    with self._cond:
+                        self._opening -= 1
+                        if entry is not None:
+                            self._in_use[id(entry.connection)] = entry
+                        else:
+                            self._cond.notify()
+            elif not self._healthy(entry, time.monotonic()):
+                self._discard(entry)
+                continue
+
+            waited = time.monotonic() - started
+            with self._cond:
+                self.checkouts += 1
+                self.wait_total += waited
+                if waited > self.wait_max:
+                    self.wait_max = waited
+            return entry.connection, waited
+
+    def _discard(self, entry):
+        with self._cond:
+            self._in_use.pop(id(entry.connection), None)
+            self._cond.notify()
+        self._close_quietly(entry.connection)
+
+    # Return a connection to the pool; broken connections are closed instead
+    def release(self, connection, broken=False):
+        with self._cond:
+            entry = self._in_use.get(id(connection))
+        if entry is None:
+            self._close_quietly(connection)
+            return
+        if not broken and connection.open:
+            # End any transaction left open by the request, otherwise the next
+            # user of this connection would read from a stale snapshot
+            if connection.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                try:
+                    connection.rollback()
+                except pymysql.MySQLError:
+                    broken = True
+        else:
+            broken = True
+        if broken or self._closed:
+            self._discard(entry)
+            return
+        entry.last_used = time.monotonic()
+        with self._cond:
+            del self._in_use[id(connection)]
+            self._idle.append(entry)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for entry in idle:
+            self._close_quietly(entry.connection)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self.size,
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "recycled": self.recycled,
+                "failed_health_checks": self.failed_health_checks,
+                "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
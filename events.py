@@ -0,0 +1,171 @@
+import asyncio
+import json
+from collections import deque
+
+# Sent in place of events a subscriber had to drop: re-read GET /changes
+RESYNC = {"type": "resync"}
+
+
+# One push subscriber with its filters and a bounded queue.
+#
+# A subscriber that falls max_queue events behind does not hold the backlog:
+# its queue is dropped and collapsed into a single resync event, after which it
+# catches up through GET /changes. Only used from the event loop, so no locking.
+class Subscription:
+    def __init__(self, entities=None, room_ids=None, user_ids=None, max_queue=100):
+        self.entities = set(entities) if entities else None
+        self.room_ids = set(room_ids) if room_ids else None
+        self.user_ids = set(user_ids) if user_ids else None
+        self.max_queue = max_queue
+        self._queue = deque()
+        self._ready = asyncio.Event()
+        self.overflowed = False
+        self.dropped = 0
+
+    def matches(self, event):
+        if event.get("type") != "change":
+            return True
+        if self.entities is not None and event["entity"] not in self.entities:
+            return False
+        if self.room_ids is not None and self.room_ids.isdisjoint(event["room_ids"]):
+            return False
+        if self.user_ids is not None and self.user_ids.isdisjoint(event["user_ids"]):
+            return False
+        return True
+
+    def put(self, event):
+        if self.overflowed:
+            self.dropped += 1
+        elif len(self._queue) >= self.max_queue:
+            self.dropped += len(self._queue) + 1
+            self._queue.clear()
+            self.overflowed = True
+        else:
+            self._queue.append(event)
+        self._ready.set()
+
+    # Next event, or None if nothing arrived within timeout seconds
+    async def get(self, timeout):
+        if not self._ready.is_set():
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        if self.overflowed:
+            self.overflowed = False
+            event = RESYNC
+        else:
+            event = self._queue.popleft()
+        if not self._queue:
+            self._ready.clear()
+        return event
+
+
+# Delivers events straight to the subscribers of this process. Enough for a
+# single worker.
+class LocalBackend:
+    async def start(self, deliver):
+        self._deliver = deliver
+
+    def publish(self, event):
+        self._deliver(event)
+
+    async def close(self):
+        pass
+
+
+# Fans events out across workers through a Redis pub/sub channel; every
+# worker, including the publisher, delivers what it receives to its own
+# subscribers. redis is only needed when this backend is selected.
+class RedisBackend:
+    def __init__(self, url, channel="room_scheduler_events"):
+        self.url = url
+        self.channel = channel
+        self._outgoing = asyncio.Queue()
+        self._tasks = []
+
+    async def start(self, deliver):
+        import redis.asyncio as redis
+
+        self._deliver = deliver
+        self._client = redis.from_url(self.url)
+        self._tasks = [asyncio.create_task(self._send()), asyncio.create_task(self._listen())]
+
+    # Handlers never wait on Redis: events are queued and sent by a background task
+    def publish(self, event):
+        self._outgoing.put_nowait(json.dumps(event))
+
+    async def _send(self):
+        while True:
+            message = await self._outgoing.get()
+            try:
+                await self._client.publish(self.channel, message)
+            except Exception as e:
+                print(f"Error publishing event: {e}")
+
+    async def _listen(self):
+        while True:
+            try:
+                async with self._client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    # Anything published while we were not listening is lost
+                    self._deliver(RESYNC)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self._deliver(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Event channel error, reconnecting: {e}")
+                await asyncio.sleep(1)
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._client.aclose()
+
+
+# In-process hub between the write handlers and the push subscribers
+class Broker:
+    def __init__(self, backend=None, max_queue=100):
+        self.backend = backend or LocalBackend()
+        self.max_queue = max_queue
+        self._subscriptions = set()
+        self.published = 0
+        self.delivered = 0
+        self._dropped_by_closed = 0
+
+    async def start(self):
+        await self.backend.start(self.deliver)
+
+    async def close(self):
+        await self.backend.close()
+
+    def subscribe(self, entities=None, room_ids=None, user_ids=None):
+        subscription = Subscription(entities, room_ids, user_ids, self.max_queue)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+            self._dropped_by_closed += subscription.dropped
+
+    def publish(self, event):
+        self.published += 1
+        self.backend.publish(event)
+
+    def deliver(self, event):
+        for subscription in self._subscriptions:
+            if subscription.matches(event):
+                subscription.put(event)
+                self.delivered += 1
+
+    def stats(self):
+        return {
+            "subscribers": len(self._subscriptions),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self._dropped_by_closed + sum(s.dropped for s in self._subscriptions),
+        }
@@ -0,0 +1,112 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+# Both encoders are optional: without orjson JSON falls back to the standard
+# library, without msgpack MessagePack is simply not offered
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+NDJSON = "application/x-ndjson"
+CSV = "text/csv"
+
+_ALIASES = {"application/x-msgpack": MSGPACK}
+
+
+# Function to serialize values the encoders can't handle, the way FastAPI does
+def encode_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, bytes):
+        return value.decode()
+    return str(value)
+
+
+# Parse an Accept header into (media type, params) pairs, best first
+def parse_accept(header):
+    ranges = []
+    for position, item in enumerate((header or "").split(",")):
+        parts = [p.strip() for p in item.split(";")]
+        if not parts[0]:
+            continue
+        params = {}
+        for part in parts[1:]:
+            key, _, value = part.partition("=")
+            params[key.strip().lower()] = value.strip().strip('"')
+        try:
+            quality = float(params.pop("q", 1))
+        except ValueError:
+            quality = 0.0
+        if quality > 0:
+            ranges.append((-quality, position, parts[0].lower(), params))
+    ranges.sort()
+    return [(media_type, params) for _, _, media_type, params in ranges]
+
+
+# Pick the response format for an Accept header out of offered media types.
+# Returns (media type, columnar) or None when nothing offered is acceptable.
+# A missing header, */* and application/* get the first offer. shape=columnar
+# asks for {"columns": [...], "rows": [[...], ...]} instead of a list of objects.
+def negotiate(header, offered=(JSON, MSGPACK)):
+    offered = [m for m in offered if m != MSGPACK or msgpack is not None]
+    if not offered:
+        return None
+    accepted = parse_accept(header)
+    if not accepted:
+        return offered[0], False
+    for media_type, params in accepted:
+        media_type = _ALIASES.get(media_type, media_type)
+        if media_type == "*/*":
+            match = offered[0]
+        elif media_type.endswith("/*"):
+            match = next((m for m in offered if m.startswith(media_type[:-1])), None)
+        else:
+            match = media_type if media_type in offered else None
+        if match is not None:
+            return match, params.get("shape") == "columnar"
+    return None
+
+
+# Function to turn a list of row dicts into the columnar shape. Rows of a page
+# normally come from one SELECT and share a key order; when some carry extra
+# keys (expanded occurrences do) the columns are the union, missing values null.
+def columnar(rows):
+    if not rows:
+        return {"columns": [], "rows": []}
+    columns = list(rows[0])
+    if all(len(row) == len(columns) for row in rows):
+        return {"columns": columns, "rows": [list(row.values()) for row in rows]}
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    return {"columns": columns, "rows": [[row.get(c) for c in columns] for row in rows]}
+
+
+def dumps_json(data):
+    if orjson is not None:
+        return orjson.dumps(data, default=encode_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        data, default=encode_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def dumps_msgpack(data):
+    return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+# Function to encode a response body. Only top-level lists are reshaped when
+# columnar is set; objects such as single rows are encoded as they are.
+def encode(data, media_type=JSON, shape_columnar=False):
+    if shape_columnar and isinstance(data, list):
+        data = columnar(data)
+    if media_type == MSGPACK:
+        return dumps_msgpack(data)
+    return dumps_json(data)
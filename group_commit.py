@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+
+# Coalesces concurrent writes into batches that commit together.
+#
+# submit(item) queues an item and waits for its result. A single background
+# task takes the first queued item, keeps collecting until max_batch items are
+# in hand or max_delay seconds have passed, and hands the batch to
+# flush(items). flush returns one entry per item, either a result or an
+# exception; an exception is raised to that item's caller only. While one
+# batch is being written the next one fills up, so under load batches grow
+# and the number of commits (and fsyncs) per write drops.
+#
+# on_batch(size, queued_seconds) is called for every batch, queued_seconds
+# being how long its oldest item waited.
+class GroupCommitter:
+    def __init__(self, flush, max_batch=32, max_delay=0.005, on_batch=None):
+        self.flush = flush
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.on_batch = on_batch
+        self._queue = None
+        self._task = None
+        self.batches = 0
+        self.items = 0
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future, time.monotonic()))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # Callers that went away (client disconnects) are not written
+            batch = [entry for entry in batch if not entry[1].done()]
+            if not batch:
+                continue
+            if self.on_batch is not None:
+                self.on_batch(len(batch), time.monotonic() - batch[0][2])
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = await self.flush([item for item, _, _ in batch])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, future, _), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
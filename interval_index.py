@@ -0,0 +1,149 @@
+import asyncio
+import time
+from bisect import bisect_left, bisect_right, insort
+
+
+# Function to make datetimes comparable with the naive values MySQL returns
+def naive(value):
+    return value.replace(tzinfo=None) if value.tzinfo is not None else value
+
+
+# Bookings of one room kept as sorted arrays.
+#
+# The number of bookings overlapping [start, end) is
+#     #(bookings starting before end) - #(bookings ending at or before start)
+# because every booking that ends by start also starts before end. Both counts
+# are a bisect, so a check is O(log n) and stays correct even when legacy data
+# already contains overlapping bookings.
+class RoomIntervals:
+    __slots__ = ("starts", "ends", "by_start", "by_id")
+
+    def __init__(self, bookings=()):
+        self.by_id = {}
+        for appointment_id, start, end in bookings:
+            self.by_id[appointment_id] = (naive(start), naive(end))
+        self.by_start = sorted((s, e, i) for i, (s, e) in self.by_id.items())
+        self.starts = [b[0] for b in self.by_start]
+        self.ends = sorted(b[1] for b in self.by_start)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def add(self, appointment_id, start, end):
+        if appointment_id in self.by_id:
+            self.remove(appointment_id)
+        start, end = naive(start), naive(end)
+        self.by_id[appointment_id] = (start, end)
+        insort(self.by_start, (start, end, appointment_id))
+        insort(self.starts, start)
+        insort(self.ends, end)
+
+    def remove(self, appointment_id):
+        interval = self.by_id.pop(appointment_id, None)
+        if interval is None:
+            return
+        start, end = interval
+        del self.by_start[bisect_left(self.by_start, (start, end, appointment_id))]
+        del self.starts[bisect_left(self.starts, start)]
+        del self.ends[bisect_left(self.ends, end)]
+
+    def count_overlapping(self, start, end):
+        return bisect_left(self.starts, end) - bisect_right(self.ends, start)
+
+    def is_free(self, start, end, ignore_id=None):
+        start, end = naive(start), naive(end)
+        count = self.count_overlapping(start, end)
+        if ignore_id is not None and ignore_id in self.by_id:
+            own_start, own_end = self.by_id[ignore_id]
+            if own_start < end and own_end > start:
+                count -= 1
+        return count <= 0
+
+    # Return the id of a booking overlapping [start, end), or None
+    def find_conflict(self, start, end, ignore_id=None):
+        start, end = naive(start), naive(end)
+        if self.is_free(start, end, ignore_id):
+            return None
+        # Walk back from the last booking starting before end
+        for i in range(bisect_left(self.starts, end) - 1, -1, -1):
+            s, e, appointment_id = self.by_start[i]
+            if e > start and appointment_id != ignore_id:
+                return appointment_id
+        return None
+
+
+# Per-room RoomIntervals for the whole process, loaded lazily.
+#
+# loader(db, room_id) returns (id, start, end) rows for one room. Rooms are
+# reloaded after ttl seconds so bookings made by other workers are picked up;
+# the database check done while booking is what keeps workers consistent.
+class IntervalIndex:
+    def __init__(self, loader, ttl=60.0):
+        self._loader = loader
+        self.ttl = ttl
+        self._rooms = {}
+        self._loaded_at = {}
+        self._locks = {}
+        # Changes made since start_reload(), replayed by load_all
+        self._pending = None
+
+    # Lock serializing bookings of one room inside this process
+    def lock(self, room_id):
+        lock = self._locks.get(room_id)
+        if lock is None:
+            lock = self._locks[room_id] = asyncio.Lock()
+        return lock
+
+    async def get(self, db, room_id):
+        loaded_at = self._loaded_at.get(room_id)
+        if loaded_at is None or time.monotonic() - loaded_at > self.ttl:
+            await self.reload(db, room_id)
+        return self._rooms[room_id]
+
+    async def reload(self, db, room_id):
+        rows = await self._loader(db, room_id)
+        self._rooms[room_id] = RoomIntervals(rows)
+        self._loaded_at[room_id] = time.monotonic()
+
+    # Call before reading the snapshot for load_all: bookings this process
+    # writes while it is being read are then kept rather than lost in the swap
+    def start_reload(self):
+        self._pending = []
+
+    # Replace every room at once; bookings maps room_id -> [(id, start, end)].
+    # Changes made since start_reload() are applied on top, in order.
+    def load_all(self, room_ids, bookings):
+        now = time.monotonic()
+        self._rooms = {room_id: RoomIntervals(bookings.get(room_id, ())) for room_id in room_ids}
+        self._loaded_at = dict.fromkeys(self._rooms, now)
+        pending, self._pending = self._pending or [], None
+        for change, args in pending:
+            change(*args)
+
+    # room_id -> RoomIntervals for every loaded room
+    @property
+    def rooms(self):
+        return self._rooms
+
+    def peek(self, room_id):
+        return self._rooms.get(room_id)
+
+    def add(self, room_id, appointment_id, start, end):
+        if self._pending is not None:
+            self._pending.append((self.add, (room_id, appointment_id, start, end)))
+        room = self._rooms.get(room_id)
+        if room is not None:
+            room.add(appointment_id, start, end)
+
+    def remove(self, room_id, appointment_id):
+        if self._pending is not None:
+            self._pending.append((self.remove, (room_id, appointment_id)))
+        room = self._rooms.get(room_id)
+        if room is not None:
+            room.remove(appointment_id)
+
+    def forget(self, room_id):
+        if self._pending is not None:
+            self._pending.append((self.forget, (room_id,)))
+        self._rooms.pop(room_id, None)
+        self._loaded_at.pop(room_id, None)
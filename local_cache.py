@@ -0,0 +1,68 @@
+import json
+import sqlite3
+import threading
+
+TABLES = ("users", "rooms", "appointments", "recurring_appointments")
+
+
+# On-disk copy of the server's users, rooms and appointments for the Kivy client,
+# kept current from GET /changes. Screens read from it, so they open without a
+# round trip and only deltas go over the wire.
+#
+# Used from the UI thread and the ApiClient worker threads, so one connection
+# is shared behind a lock.
+class LocalCache:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            for table in TABLES:
+                self._db.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            row = self._db.execute("SELECT value FROM sync_state WHERE key = 'token'").fetchone()
+        # Version of the last change applied; 0 means nothing synced yet
+        self.token = int(row[0]) if row else 0
+
+    # Function to read one keyset page of cached records, ordered by id
+    def page(self, table, after_id, limit):
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT data FROM {table} WHERE id > ? ORDER BY id LIMIT ?", (after_id or 0, limit)
+            ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    # Apply one GET /changes response in a single transaction, returning
+    # {table: {id: record, or None if deleted}} for the tables that changed
+    def apply(self, changes):
+        changed = {}
+        with self._lock, self._db:
+            for table in TABLES:
+                rows = changes.get(table) or []
+                if rows:
+                    self._db.executemany(
+                        f"INSERT OR REPLACE INTO {table} (id, data) VALUES (?, ?)",
+                        [(row["id"], json.dumps(row)) for row in rows],
+                    )
+                    changed.setdefault(table, {}).update((row["id"], row) for row in rows)
+                deleted = changes.get("deleted", {}).get(table) or []
+                if deleted:
+                    self._db.executemany(f"DELETE FROM {table} WHERE id = ?", [(i,) for i in deleted])
+                    changed.setdefault(table, {}).update(dict.fromkeys(deleted))
+            self._db.execute(
+                "INSERT OR REPLACE INTO sync_state (key, value) VALUES ('token', ?)", (str(changes["token"]),)
+            )
+            self.token = changes["token"]
+        return changed
+
+    # Forget everything, e.g. when the server no longer knows our token
+    def clear(self):
+        with self._lock, self._db:
+            for table in TABLES:
+                self._db.execute(f"DELETE FROM {table}")
+            self._db.execute("DELETE FROM sync_state")
+            self.token = 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
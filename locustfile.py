@@ -1,9 +1,427 @@
-from locust import HttpUser, task, between
-
-class MyUser(HttpUser):
-    wait_time = between(1,2)
-    
-    @task
-    def get_all_rooms(self):
-        """GET request to fetch all rooms."""
-        self.client.get("/rooms")
\ No newline at end of file
+# Load-test suite for the room scheduler API.
+#
+# Benchmark the sync and async data-access paths by starting the API with
+#   DB_MODE=sync uvicorn main:app   or   DB_MODE=async uvicorn main:app
+# and running the same profile against each, e.g.
+#   locust -f locustfile.py --headless -u 200 -r 20 -t 2m \
+#       --host http://127.0.0.1:8000 --load-profile booking-burst --results-file results/burst.json
+#
+# Profiles (--load-profile): mixed, read-heavy, booking-burst, export. Each sets the
+# task weights and the p95/p99/error-rate thresholds; a run that misses a
+# threshold exits non-zero. Results are written as JSON to --results-file.
+#
+# Before the first user starts the database is seeded through the batch
+# endpoints (--seed-users/--seed-rooms/--seed-appointments, 0 to skip).
+# locust must be imported first so gevent patches ssl/sockets before requests loads them
+from locust import HttpUser, between, events
+from locust.runners import WorkerRunner
+
+import json
+import os
+import random
+import subprocess
+import time
+from datetime import datetime, timedelta
+
+import requests
+
+SEED = 1234
+BATCH_SIZE = 500
+LOCATIONS = [f"Building {b} / Floor {f}" for b in "ABC" for f in range(1, 6)]
+# Most rooms are small huddle rooms, a few are large
+CAPACITIES = [2, 4, 6, 8, 12, 20, 50]
+CAPACITY_WEIGHTS = [20, 30, 20, 12, 10, 6, 2]
+DURATIONS = [30, 60, 90, 120]
+DURATION_WEIGHTS = [40, 40, 10, 10]
+PURPOSES = ["Standup", "1:1", "Planning", "Review", "Interview", "Workshop", "All hands"]
+
+PROFILES = {
+    "mixed": {
+        "tasks": {
+            "list_rooms": 20, "get_room": 10, "available_rooms": 8, "list_users": 5, "get_user": 5,
+            "list_appointments": 10, "get_appointment": 5, "create_appointment": 8,
+            "update_appointment": 3, "delete_appointment": 3, "create_user": 1, "update_user": 1,
+            "delete_user": 1, "create_room": 1, "update_room": 1, "delete_room": 1,
+            "batch_appointments": 1, "update_appointments_batch": 1, "delete_appointments_batch": 1,
+            "export_appointments": 1, "stats": 1,
+        },
+        "thresholds": {"p95_ms": 500, "p99_ms": 1500, "error_rate": 0.01},
+    },
+    "read-heavy": {
+        "tasks": {
+            "list_rooms": 40, "get_room": 20, "available_rooms": 10, "list_users": 10, "get_user": 10,
+            "list_appointments": 15, "get_appointment": 10, "create_appointment": 1,
+        },
+        "thresholds": {"p95_ms": 200, "p99_ms": 800, "error_rate": 0.005},
+    },
+    "booking-burst": {
+        "tasks": {
+            "create_appointment": 50, "update_appointment": 10, "delete_appointment": 10,
+            "available_rooms": 15, "batch_appointments": 2, "update_appointments_batch": 2,
+            "delete_appointments_batch": 2, "list_rooms": 5,
+            "list_appointments": 5,
+        },
+        "thresholds": {"p95_ms": 1000, "p99_ms": 3000, "error_rate": 0.02},
+    },
+    "export": {
+        "tasks": {"export_appointments": 5, "list_appointments": 10, "list_rooms": 10, "get_room": 5},
+        "thresholds": {"p95_ms": 30000, "p99_ms": 60000, "error_rate": 0.01},
+    },
+}
+
+
+@events.init_command_line_parser.add_listener
+def add_arguments(parser):
+    parser.add_argument("--load-profile", choices=sorted(PROFILES), default="mixed", help="Traffic profile")
+    parser.add_argument("--seed-users", type=int, default=1000, help="Users to create before the run")
+    parser.add_argument("--seed-rooms", type=int, default=200, help="Rooms to create before the run")
+    parser.add_argument("--seed-appointments", type=int, default=20000, help="Appointments to create before the run")
+    parser.add_argument("--results-file", default="locust-results.json", help="Where to write the JSON results")
+    parser.add_argument("--max-p95", type=float, default=None, help="Override the profile's p95 threshold (ms)")
+    parser.add_argument("--max-p99", type=float, default=None, help="Override the profile's p99 threshold (ms)")
+    parser.add_argument("--max-error-rate", type=float, default=None, help="Override the profile's error rate threshold")
+
+
+# Ids known to this process. Filled by seeding, or fetched from the API on
+# workers of a distributed run.
+known = {"users": [], "rooms": [], "appointments": []}
+
+
+# Rooms are not booked evenly: a handful of popular rooms take most bookings
+def popular_room(rng=random):
+    rooms = known["rooms"]
+    rank = min(int(rng.paretovariate(1.2)) - 1, len(rooms) - 1)
+    return rooms[rank]
+
+
+def random_slot(rng=random, days=14):
+    day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=rng.randrange(days))
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    start = day + timedelta(hours=rng.randint(8, 17), minutes=rng.choice((0, 15, 30, 45)))
+    end = start + timedelta(minutes=rng.choices(DURATIONS, DURATION_WEIGHTS)[0])
+    return start.isoformat(), end.isoformat()
+
+
+def appointment_payload(rng=random):
+    start, end = random_slot(rng)
+    return {
+        "user_id": rng.choice(known["users"]),
+        "room_id": popular_room(rng),
+        "start_time": start,
+        "end_time": end,
+        "purpose": rng.choice(PURPOSES),
+    }
+
+
+def post_batches(host, path, items):
+    ids = []
+    for i in range(0, len(items), BATCH_SIZE):
+        response = requests.post(f"{host}{path}?atomic=false", json=items[i:i + BATCH_SIZE], timeout=120)
+        response.raise_for_status()
+        ids += [r["id"] for r in response.json()["results"] if r["status"] == "created"]
+    return ids
+
+
+def seed(environment):
+    options = environment.parsed_options
+    host = environment.host
+    rng = random.Random(SEED)
+    started = time.time()
+
+    users = [{"name": f"User {i}", "email": f"user{i}@example.com"} for i in range(options.seed_users)]
+    known["users"] = post_batches(host, "/users/batch", users)
+
+    rooms = [
+        {
+            "name": f"Room {i}",
+            "location": rng.choice(LOCATIONS),
+            "capacity": rng.choices(CAPACITIES, CAPACITY_WEIGHTS)[0],
+        }
+        for i in range(options.seed_rooms)
+    ]
+    known["rooms"] = post_batches(host, "/rooms/batch", rooms)
+
+    if known["users"] and known["rooms"]:
+        appointments = [appointment_payload(rng) for _ in range(options.seed_appointments)]
+        # Overlapping bookings are rejected as conflicts, like in real traffic
+        known["appointments"] = post_batches(host, "/appointments/batch", appointments)
+
+    print(f"Seeded {len(known['users'])} users, {len(known['rooms'])} rooms and "
+          f"{len(known['appointments'])} appointments in {time.time() - started:.1f}s")
+
+
+# Function to fill `known` from the API when this process did not seed
+def load_known_ids(host):
+    for name, path in (("users", "/users"), ("rooms", "/rooms"), ("appointments", "/appointments")):
+        response = requests.get(f"{host}{path}", params={"fields": "id", "limit": 1000}, timeout=30)
+        if response.ok:
+            known[name] = [row["id"] for row in response.json()]
+
+
+@events.test_start.add_listener
+def on_test_start(environment, **kwargs):
+    if isinstance(environment.runner, WorkerRunner):
+        return
+    options = environment.parsed_options
+    if options.seed_users or options.seed_rooms or options.seed_appointments:
+        seed(environment)
+
+
+# TASKS
+# Each task takes the running SchedulerUser; names group id URLs in the stats.
+
+def list_rooms(user):
+    # Clients revalidate with the ETag they already have
+    headers = {"If-None-Match": user.etags["rooms"]} if "rooms" in user.etags else {}
+    with user.client.get("/rooms", headers=headers, catch_response=True) as response:
+        if response.status_code in (200, 304):
+            if "ETag" in response.headers:
+                user.etags["rooms"] = response.headers["ETag"]
+            response.success()
+
+
+def get_room(user):
+    user.client.get(f"/rooms/{random.choice(known['rooms'])}", name="/rooms/[id]")
+
+
+def available_rooms(user):
+    start, end = random_slot()
+    params = {"start": start, "end": end, "min_capacity": random.choice(CAPACITIES[:5])}
+    user.client.get("/rooms/available", params=params)
+
+
+def list_users(user):
+    user.client.get("/users", params={"limit": 50})
+
+
+def get_user(user):
+    user.client.get(f"/users/{random.choice(known['users'])}", name="/users/[id]")
+
+
+def create_user(user):
+    n = random.randrange(10 ** 9)
+    response = user.client.post("/users", json={"name": f"Load user {n}", "email": f"load{n}@example.com"})
+    if response.ok:
+        user.created["users"].append(response.json()["id"])
+
+
+def update_user(user):
+    if user.created["users"]:
+        user_id = random.choice(user.created["users"])
+        user.client.put(f"/users/{user_id}", json={"name": f"Renamed {user_id}", "email": f"renamed{user_id}@example.com"},
+                        name="/users/[id]")
+
+
+def delete_user(user):
+    if user.created["users"]:
+        user.client.delete(f"/users/{user.created['users'].pop()}", name="/users/[id]")
+
+
+def create_room(user):
+    body = {"name": f"Load room {random.randrange(10 ** 6)}", "location": random.choice(LOCATIONS),
+            "capacity": random.choices(CAPACITIES, CAPACITY_WEIGHTS)[0]}
+    response = user.client.post("/rooms", json=body)
+    if response.ok:
+        user.created["rooms"].append(response.json()["id"])
+
+
+def update_room(user):
+    if user.created["rooms"]:
+        room_id = random.choice(user.created["rooms"])
+        body = {"name": f"Room {room_id}", "location": random.choice(LOCATIONS), "capacity": random.choice(CAPACITIES)}
+        user.client.put(f"/rooms/{room_id}", json=body, name="/rooms/[id]")
+
+
+def delete_room(user):
+    if user.created["rooms"]:
+        user.client.delete(f"/rooms/{user.created['rooms'].pop()}", name="/rooms/[id]")
+
+
+def list_appointments(user):
+    start, _ = random_slot()
+    end = (datetime.fromisoformat(start) + timedelta(days=1)).isoformat()
+    params = {"room_id": popular_room(), "start": start, "end": end}
+    user.client.get("/appointments", params=params, name="/appointments?room_id&window")
+
+
+def get_appointment(user):
+    pool = known["appointments"] or user.created["appointments"]
+    if pool:
+        user.client.get(f"/appointments/{random.choice(pool)}", name="/appointments/[id]")
+
+
+# A 409 for an already booked slot is an expected outcome under contention
+def create_appointment(user):
+    with user.client.post("/appointments", json=appointment_payload(), catch_response=True) as response:
+        if response.status_code == 200:
+            user.created["appointments"].append(response.json()["id"])
+            response.success()
+        elif response.status_code == 409:
+            response.success()
+
+
+def update_appointment(user):
+    if user.created["appointments"]:
+        appointment_id = random.choice(user.created["appointments"])
+        with user.client.put(f"/appointments/{appointment_id}", json=appointment_payload(),
+                             name="/appointments/[id]", catch_response=True) as response:
+            if response.status_code in (200, 409):
+                response.success()
+
+
+def delete_appointment(user):
+    if user.created["appointments"]:
+        user.client.delete(f"/appointments/{user.created['appointments'].pop()}", name="/appointments/[id]")
+
+
+def batch_appointments(user):
+    body = [appointment_payload() for _ in range(20)]
+    response = user.client.post("/appointments/batch?atomic=false", json=body)
+    if response.ok:
+        user.created["appointments"] += [r["id"] for r in response.json()["results"] if r["status"] == "created"]
+
+
+# Moves up to 20 of this user's bookings in one request; conflicts are
+# expected under contention and reported per item
+def update_appointments_batch(user):
+    ids = random.sample(user.created["appointments"], min(20, len(user.created["appointments"])))
+    if ids:
+        body = [dict(appointment_payload(), id=appointment_id) for appointment_id in ids]
+        user.client.patch("/appointments/batch?atomic=false", json=body)
+
+
+# Frees up to 20 slots this user booked in one request
+def delete_appointments_batch(user):
+    ids = user.created["appointments"][-20:]
+    if ids:
+        del user.created["appointments"][-len(ids):]
+        user.client.delete("/appointments/batch?atomic=false", json=ids)
+
+
+def export_appointments(user):
+    since = (datetime.now() - timedelta(days=random.choice((1, 7, 30)))).isoformat()
+    fmt = random.choice(("ndjson", "csv"))
+    with user.client.get("/appointments/export", params={"format": fmt, "since": since}, stream=True,
+                         name=f"/appointments/export?format={fmt}", catch_response=True) as response:
+        for _ in response.iter_content(chunk_size=65536):
+            pass
+
+
+def stats(user):
+    user.client.get("/pool/stats")
+    user.client.get("/cache/stats")
+
+
+TASKS = {fn.__name__: fn for fn in (
+    list_rooms, get_room, available_rooms, list_users, get_user, create_user, update_user, delete_user,
+    create_room, update_room, delete_room, list_appointments, get_appointment, create_appointment,
+    update_appointment, delete_appointment, batch_appointments, update_appointments_batch,
+    delete_appointments_batch, export_appointments, stats,
+)}
+
+
+class SchedulerUser(HttpUser):
+    wait_time = between(1, 2)
+    # Replaced by the selected profile's weighted tasks in on_init
+    tasks = [list_rooms]
+
+    def on_start(self):
+        self.etags = {}
+        self.created = {"users": [], "rooms": [], "appointments": []}
+        if not known["rooms"] or not known["users"]:
+            load_known_ids(self.host)
+        if not known["rooms"] or not known["users"]:
+            raise RuntimeError("No rooms or users to work with; seed the database first")
+
+
+@events.init.add_listener
+def on_init(environment, **kwargs):
+    options = environment.parsed_options
+    if options is None:
+        return
+    weights = PROFILES[options.load_profile]["tasks"]
+    SchedulerUser.tasks = [TASKS[name] for name, weight in weights.items() for _ in range(weight)]
+
+
+def thresholds(options):
+    limits = dict(PROFILES[options.load_profile]["thresholds"])
+    if options.max_p95 is not None:
+        limits["p95_ms"] = options.max_p95
+    if options.max_p99 is not None:
+        limits["p99_ms"] = options.max_p99
+    if options.max_error_rate is not None:
+        limits["error_rate"] = options.max_error_rate
+    return limits
+
+
+def entry_stats(entry):
+    return {
+        "method": entry.method,
+        "name": entry.name,
+        "requests": entry.num_requests,
+        "failures": entry.num_failures,
+        "rps": round(entry.total_rps, 3),
+        "avg_ms": round(entry.avg_response_time, 2),
+        "p50_ms": entry.get_response_time_percentile(0.5),
+        "p95_ms": entry.get_response_time_percentile(0.95),
+        "p99_ms": entry.get_response_time_percentile(0.99),
+        "max_ms": entry.max_response_time,
+        "avg_bytes": round(entry.avg_content_length, 1),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Check thresholds and write the results file once the run ends
+@events.quitting.add_listener
+def on_quitting(environment, **kwargs):
+    if isinstance(environment.runner, WorkerRunner):
+        return
+    options = environment.parsed_options
+    total = environment.stats.total
+    limits = thresholds(options)
+    measured = {
+        "p95_ms": total.get_response_time_percentile(0.95) or 0,
+        "p99_ms": total.get_response_time_percentile(0.99) or 0,
+        "error_rate": total.fail_ratio,
+    }
+    failed = [name for name, limit in limits.items() if measured[name] > limit]
+    if not total.num_requests:
+        failed.append("requests")
+        measured["requests"] = 0
+        limits["requests"] = "> 0"
+
+    results = {
+        "profile": options.load_profile,
+        "host": environment.host,
+        "revision": git_revision(),
+        "db_mode": os.environ.get("DB_MODE"),
+        "finished_at": datetime.now().isoformat(timespec="seconds"),
+        "users": environment.runner.user_count if environment.runner else None,
+        "thresholds": limits,
+        "measured": measured,
+        "passed": not failed,
+        "total": entry_stats(total),
+        "endpoints": [entry_stats(e) for e in sorted(environment.stats.entries.values(), key=lambda e: (e.name, e.method))],
+        "errors": [
+            {"method": e.method, "name": e.name, "error": str(e.error), "occurrences": e.occurrences}
+            for e in environment.stats.errors.values()
+        ],
+    }
+    directory = os.path.dirname(options.results_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(options.results_file, "w") as f:
+        json.dump(results, f, indent=2)
+
+    for name in failed:
+        print(f"Threshold failed: {name} = {measured[name]} (limit {limits[name]})")
+    if failed:
+        environment.process_exit_code = 1
@@ -1,10 +1,81 @@
-from fastapi import FastAPI, HTTPException
-from typing import List
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, Query, Body
+from fastapi.responses import StreamingResponse, JSONResponse
+from typing import List, Optional
 from pydantic import BaseModel
 import pymysql
-from datetime import datetime
+import os
+import io
+import asyncio
+import csv
+import json
+import hashlib
+import logging
+import re
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import datetime, date, timedelta
+from itertools import islice
+import heapq
+import numpy as np
 
-app = FastAPI()
+from starlette.concurrency import run_in_threadpool
+
+from db_pool import ConnectionPool, PoolExhausted, PoolConnectError
+from database import SyncDatabase, AsyncDatabase, is_disconnect, set_query_hook
+from interval_index import IntervalIndex, RoomIntervals, naive
+from availability import RoomCatalog, free_rooms
+from search import TextIndex
+from recurrence import Series, SeriesIndex, series_conflict
+from cache import TTLCache
+from group_commit import GroupCommitter
+from admission import AdaptiveLimiter, AdmissionMiddleware, LatencyTracker, measuring, observe_latency
+from replicas import Replica, ReplicaSet, ReadYourWritesMiddleware, capture_writes, note_write
+import formats
+from utilization import BUCKETS, align, bucket_count, room_utilization
+from events import Broker, LocalBackend, RedisBackend
+from metrics import Registry, MetricsMiddleware, SIZE_BUCKETS
+import migrations
+
+# METRICS
+# Exposed in Prometheus text format at GET /metrics
+registry = Registry()
+http_requests_total = registry.counter(
+    "http_requests_total", "HTTP requests by method, route and status", ("method", "route", "status"))
+http_request_seconds = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by method and route", ("method", "route"))
+http_requests_in_flight = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being served", ("method",))
+http_response_render_seconds = registry.histogram(
+    "http_response_render_seconds", "Time spent serializing JSON response bodies")
+db_pool_wait_seconds = registry.histogram(
+    "db_pool_wait_seconds", "Time spent waiting to check out a database connection")
+db_connect_seconds = registry.histogram(
+    "db_connect_seconds", "Time spent opening new database connections")
+db_query_seconds = registry.histogram(
+    "db_query_seconds", "Query time by statement, table and phase (execute or fetch)",
+    ("statement", "table", "phase"))
+db_query_rows = registry.histogram(
+    "db_query_rows", "Rows returned or affected per query", ("statement", "table"), buckets=SIZE_BUCKETS)
+db_slow_queries_total = registry.counter(
+    "db_slow_queries_total", "Queries slower than SLOW_QUERY_MS", ("statement", "table"))
+group_commit_batch_size = registry.histogram(
+    "group_commit_batch_size", "Appointment writes per group commit", buckets=SIZE_BUCKETS)
+group_commit_queue_seconds = registry.histogram(
+    "group_commit_queue_seconds", "Time the oldest write of a group commit waited in the queue")
+group_commit_fallbacks_total = registry.counter(
+    "group_commit_fallbacks_total", "Group commits rolled back and retried one write at a time")
+admission_rejected_total = registry.counter(
+    "admission_rejected_total", "Requests shed with a 503 by admission control", ("class", "reason"))
+
+# JSON response class that records how long rendering the body takes
+class TimedJSONResponse(JSONResponse):
+    def render(self, content):
+        started = time.perf_counter()
+        body = super().render(content)
+        http_response_render_seconds.observe(time.perf_counter() - started)
+        return body
+
+app = FastAPI(default_response_class=TimedJSONResponse)
 
 # Database credentials
 DB_HOST = "localhost"
@@ -12,89 +83,502 @@ DB_USER = "root"
 DB_PASSWORD = ""
 DB_NAME = "room_scheduler_db"
 
-# Function to connect to MySQL server (without a specific database)
-def dbconnect_to_server():
-    try:
-        connection = pymysql.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD
+# Read replicas as a comma-separated list of host[:port], e.g.
+# "127.0.0.1:3307,127.0.0.1:3308". GET requests are spread over the healthy
+# ones; everything else goes to DB_HOST.
+DB_REPLICAS = [r.strip() for r in os.environ.get("DB_REPLICAS", "").split(",") if r.strip()]
+REPLICA_MAX_LAG = float(os.environ.get("REPLICA_MAX_LAG", 5))                # seconds behind before leaving rotation
+REPLICA_CHECK_INTERVAL = float(os.environ.get("REPLICA_CHECK_INTERVAL", 2))  # seconds between health checks
+READ_YOUR_WRITES_WINDOW = float(os.environ.get("READ_YOUR_WRITES_WINDOW", 10))  # seconds a writer's reads stay consistent
+
+# Data-access mode: "sync" runs the blocking pymysql driver on the threadpool,
+# "async" uses aiomysql directly on the event loop
+DB_MODE = os.environ.get("DB_MODE", "sync")
+
+# List endpoints return at most this many rows per page
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", 1000))
+
+# Rows fetched from the server-side cursor per streamed chunk
+EXPORT_BATCH_SIZE = 1000
+
+# Seconds before a room's in-process booking index is reloaded from the database
+INTERVAL_INDEX_TTL = float(os.environ.get("INTERVAL_INDEX_TTL", 60))
+
+# Seconds between full reloads of the availability structures (changes made
+# through this worker are applied incrementally in between)
+AVAILABILITY_REFRESH = float(os.environ.get("AVAILABILITY_REFRESH", 300))
+
+# Read-through cache for room and user reads
+CACHE_TTL = float(os.environ.get("CACHE_TTL", 30))
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 1024))
+
+# Room utilization reports: seconds they stay cached (writes through this worker
+# drop the affected windows sooner) and the largest rooms x buckets grid served
+UTILIZATION_CACHE_TTL = float(os.environ.get("UTILIZATION_CACHE_TTL", 300))
+UTILIZATION_MAX_CELLS = int(os.environ.get("UTILIZATION_MAX_CELLS", 500_000))
+
+# Push notifications: "local" serves subscribers of this process only, "redis"
+# fans events out across workers through EVENTS_REDIS_URL
+EVENTS_BACKEND = os.environ.get("EVENTS_BACKEND", "local")
+EVENTS_REDIS_URL = os.environ.get("EVENTS_REDIS_URL", "redis://localhost:6379/0")
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", 100))      # events buffered per subscriber
+EVENTS_HEARTBEAT = float(os.environ.get("EVENTS_HEARTBEAT", 15))       # seconds between keep-alive comments
+
+# Default and largest number of rows per source returned by GET /changes
+CHANGES_PAGE_SIZE = int(os.environ.get("CHANGES_PAGE_SIZE", 1000))
+
+# Open-ended recurring series are checked for conflicts this many days ahead
+RECURRENCE_CHECK_DAYS = int(os.environ.get("RECURRENCE_CHECK_DAYS", 730))
+
+# Group commit: with GROUP_COMMIT=1 single appointment creates, updates and
+# cancels are queued and written GROUP_COMMIT_MAX_BATCH at a time in one
+# transaction. A write waits at most GROUP_COMMIT_MAX_DELAY_MS for others to join.
+GROUP_COMMIT = os.environ.get("GROUP_COMMIT", "0") == "1"
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get("GROUP_COMMIT_MAX_BATCH", 32))
+GROUP_COMMIT_MAX_DELAY_MS = float(os.environ.get("GROUP_COMMIT_MAX_DELAY_MS", 5))
+
+# Admission control: reads, writes and exports each get a concurrency limit
+# and a wait queue of ADMISSION_MAX_QUEUE. The read and write limits start at
+# their ADMISSION_*_LIMIT (below the pool settings), shrink towards
+# ADMISSION_MIN_LIMIT while their own smoothed query latency is above
+# ADMISSION_TARGET_DB_MS and grow back afterwards; the export limit is fixed.
+# Requests that can't start within ADMISSION_TIMEOUT seconds get a 503 with
+# Retry-After. ADMISSION=0 turns it off.
+ADMISSION = os.environ.get("ADMISSION", "1") == "1"
+ADMISSION_MIN_LIMIT = int(os.environ.get("ADMISSION_MIN_LIMIT", 4))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", 64))
+ADMISSION_TIMEOUT = float(os.environ.get("ADMISSION_TIMEOUT", 5))
+ADMISSION_TARGET_DB_MS = float(os.environ.get("ADMISSION_TARGET_DB_MS", 50))
+
+# Search results per request (GET /users/search, /rooms/search), and how often
+# at most the search indexes pull in writes made through other workers
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = int(os.environ.get("SEARCH_MAX_LIMIT", 100))
+SEARCH_SYNC_INTERVAL = float(os.environ.get("SEARCH_SYNC_INTERVAL", 1))
+
+# Largest accepted batch. Also keeps an executemany INSERT inside a single
+# statement, which the id numbering of batch results relies on.
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 1000))
+
+# Connection pool settings
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 20))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 5))         # seconds to wait for a free connection
+DB_POOL_MAX_AGE = float(os.environ.get("DB_POOL_MAX_AGE", 1800))      # recycle connections older than this
+DB_POOL_PING_AFTER = float(os.environ.get("DB_POOL_PING_AFTER", 30))  # ping connections idle longer than this
+
+# Admission limits, which are also their upper bounds. Together they never
+# exceed ADMISSION_CAPACITY: the pool size, and in sync mode no more than the
+# threadpool's 40 threads, so admitted requests don't wait on either.
+ADMISSION_CAPACITY = DB_POOL_MAX_SIZE if DB_MODE == "async" else min(DB_POOL_MAX_SIZE, 40)
+ADMISSION_EXPORT_LIMIT = int(os.environ.get("ADMISSION_EXPORT_LIMIT", min(2, max(1, ADMISSION_CAPACITY // 4))))
+ADMISSION_WRITE_LIMIT = int(os.environ.get("ADMISSION_WRITE_LIMIT", max(1, ADMISSION_CAPACITY // 3)))
+ADMISSION_READ_LIMIT = int(os.environ.get(
+    "ADMISSION_READ_LIMIT", max(1, ADMISSION_CAPACITY - ADMISSION_WRITE_LIMIT - ADMISSION_EXPORT_LIMIT)
+))
+
+# Queries taking longer than this many milliseconds are logged to the slow_query logger
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 200))
+slow_query_log = logging.getLogger("room_scheduler.slow_query")
+
+# Metric labels (statement, table) per SQL string. The labels themselves are
+# few, but the SQL text varies with the length of IN lists and with which
+# optional filters a request uses, so IN lists are folded to "IN (...)" before
+# the lookup and the memo stops growing at QUERY_LABELS_MAX strings.
+QUERY_LABELS_MAX = 1000
+query_labels = {}
+TABLE_PATTERN = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+`?(\w+)", re.IGNORECASE)
+IN_LIST_PATTERN = re.compile(r"\bIN\s*\((?:\s*%s\s*,)*\s*%s\s*\)", re.IGNORECASE)
+
+def sql_labels(sql):
+    key = IN_LIST_PATTERN.sub("IN (...)", sql)
+    labels = query_labels.get(key)
+    if labels is None:
+        words = sql.split(None, 1)
+        statement = words[0].upper() if words else "-"
+        table = TABLE_PATTERN.search(sql)
+        labels = (statement, table.group(1).lower() if table else "-")
+        if len(query_labels) < QUERY_LABELS_MAX:
+            query_labels[key] = labels
+    return labels
+
+# Function called by the database layer after every query
+def observe_query(sql, execute_seconds, fetch_seconds, rows):
+    statement, table = sql_labels(sql)
+    db_query_seconds.observe(execute_seconds, statement, table, "execute")
+    db_query_seconds.observe(fetch_seconds, statement, table, "fetch")
+    db_query_rows.observe(max(rows, 0), statement, table)
+    # What the admission limits adapt to. Fetch time is left out, it grows
+    # with result size rather than with load.
+    observe_latency(execute_seconds)
+    elapsed_ms = (execute_seconds + fetch_seconds) * 1000
+    if elapsed_ms >= SLOW_QUERY_MS:
+        db_slow_queries_total.inc(statement, table)
+        slow_query_log.warning(
+            "Slow query (%.1f ms execute, %.1f ms fetch, %d rows): %s",
+            execute_seconds * 1000, fetch_seconds * 1000, rows, " ".join(sql.split()),
         )
-        return connection
-    except pymysql.MySQLError as e:
-        print(f"Error connecting to MySQL server: {e}")
-        return None
 
-# Function to connect to the specific database
-def dbconnect():
-    try:
-        connection = pymysql.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME,
-            cursorclass=pymysql.cursors.DictCursor
+set_query_hook(observe_query)
+
+# Function to open a new pooled connection (raises on failure)
+def open_pooled_connection(host=DB_HOST, port=3306):
+    return pymysql.connect(
+        host=host,
+        port=port,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME,
+        cursorclass=pymysql.cursors.DictCursor
+    )
+
+# Function to create the pooled database for one server in the configured DB_MODE
+def make_database(host=DB_HOST, port=3306):
+    if DB_MODE == "async":
+        return AsyncDatabase(
+            host, DB_USER, DB_PASSWORD, DB_NAME,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            timeout=DB_POOL_TIMEOUT,
+            max_age=DB_POOL_MAX_AGE,
+            ping_after=DB_POOL_PING_AFTER,
+            port=port,
         )
-        return connection
+    if DB_MODE == "sync":
+        return SyncDatabase(ConnectionPool(
+            lambda: open_pooled_connection(host, port),
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            timeout=DB_POOL_TIMEOUT,
+            max_age=DB_POOL_MAX_AGE,
+            ping_after=DB_POOL_PING_AFTER,
+            on_connect=db_connect_seconds.observe,
+        ))
+    raise RuntimeError(f"Unknown DB_MODE {DB_MODE!r}, expected 'sync' or 'async'")
+
+def make_replica(address):
+    host, _, port = address.partition(":")
+    return Replica(address, make_database(host, int(port or 3306)))
+
+database = make_database()
+replica_set = ReplicaSet(
+    [make_replica(address) for address in DB_REPLICAS],
+    max_lag=REPLICA_MAX_LAG,
+    check_interval=REPLICA_CHECK_INTERVAL,
+)
+
+# Function to check out a session, turning pool errors into 503 responses.
+# read=True sessions come from a healthy replica that has applied min_version
+# when there is one, and from the primary otherwise.
+async def acquire_session(response=None, read=False, min_version=0):
+    replica = replica_set.choose(min_version) if read else None
+    if replica is not None:
+        try:
+            session, waited = await replica.database.acquire()
+        except PoolExhausted:
+            # Only busy: this read goes to the primary, the replica stays in rotation
+            replica = None
+        except PoolConnectError as e:
+            # Unreachable: take it out of rotation now rather than at the next health check
+            replica_set.mark_failed(replica, e)
+            replica = None
+    try:
+        if replica is None:
+            session, waited = await database.acquire()
+    except PoolExhausted as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except PoolConnectError as e:
+        print(e)
+        raise HTTPException(status_code=503, detail="Database connection failed")
+    # Change version the session is known to have applied, for the response cache
+    session.applied_version = replica.version if replica is not None else primary_version(min_version)
+    db_pool_wait_seconds.observe(waited)
+    if response is not None:
+        response.headers["X-DB-Pool-Wait-Ms"] = f"{waited * 1000:.2f}"
+        if replica_set.replicas:
+            response.headers["X-DB-Node"] = replica.name if replica is not None else "primary"
+    return session
+
+# Lowest change version the primary is known to have applied: the version a
+# read asked for (its writer committed it) or any version a replica has applied
+def primary_version(min_version=0):
+    return max([min_version] + [replica.version for replica in replica_set.replicas])
+
+async def release_session(session, broken=False):
+    await session.owner.release(session, broken=broken)
+
+# Session for the duration of a block, for handlers that only sometimes need the database
+@asynccontextmanager
+async def db_session(response=None, read=False, min_version=0):
+    session = await acquire_session(response, read, min_version)
+    broken = False
+    try:
+        yield session
     except pymysql.MySQLError as e:
-        print(f"Error connecting to MySQL database: {e}")
-        return None
+        broken = is_disconnect(e)
+        print(f"Database error: {e}")
+        raise HTTPException(status_code=500, detail="Database error")
+    finally:
+        await release_session(session, broken=broken)
+
+# READ-YOUR-WRITES
+# Writes leave a cookie with the change version they committed (see
+# next_versions). A read carrying it only goes to a replica that has applied
+# that version, so a client sees its own writes. The cookie expires after
+# READ_YOUR_WRITES_WINDOW seconds.
+RYW_COOKIE = "ryw_version"
+
+def read_min_version(request):
+    try:
+        return int(request.cookies.get(RYW_COOKIE, 0))
+    except ValueError:
+        return 0
 
-# Function to create the database if it doesn't exist
-def create_database():
-    connection = dbconnect_to_server()
-    if connection:
-        with connection.cursor() as cursor:
-            cursor.execute(f"CREATE DATABASE IF NOT EXISTS {DB_NAME};")
-            connection.commit()
-        connection.close()
-
-# Function to create the necessary tables for the application
-def create_tables():
-    connection = dbconnect()
-    if connection:
-        with connection.cursor() as cursor:
-            # Create 'rooms' table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS rooms (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL,
-                    location VARCHAR(255),
-                    capacity INT
-                );
-            """)
-
-            # Create 'users' table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL,
-                    email VARCHAR(255)
-                );
-            """)
-
-            # Create 'appointments' table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS appointments (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id INT,
-                    room_id INT,
-                    start_time DATETIME,
-                    end_time DATETIME,
-                    purpose VARCHAR(255),
-                    status VARCHAR(50) DEFAULT 'scheduled',
-                    FOREIGN KEY (user_id) REFERENCES users(id),
-                    FOREIGN KEY (room_id) REFERENCES rooms(id)
-                );
-            """)
-            connection.commit()
-        connection.close()
+# FastAPI dependency handing out a pooled session for the duration of a request.
+# GET and HEAD requests read from a replica, everything else uses the primary.
+async def get_db(request: Request, response: Response):
+    read = request.method in ("GET", "HEAD")
+    async with db_session(response, read, read_min_version(request) if read else 0) as session:
+        yield session
+
+# Long-running tasks started at startup and cancelled at shutdown
+background_tasks = []
 
 # Run this code when the application starts
 @app.on_event("startup")
 async def startup_event():
-    create_database()  # Automatically create the database if not exists
-    create_tables()    # Automatically create the necessary tables
+    # Bring the schema up to date; a single query when nothing is pending.
+    # Migrations use a blocking connection, keep them off the event loop
+    try:
+        await run_in_threadpool(migrations.migrate, DB_HOST, DB_USER, DB_PASSWORD, DB_NAME)
+    except (pymysql.MySQLError, migrations.MigrationLockTimeout) as e:
+        print(f"Error migrating database schema: {e}")
+    try:
+        await database.start()    # Open the minimum number of pooled connections up front
+    except PoolConnectError as e:
+        print(e)
+    await replica_set.start()
+    await broker.start()
+    background_tasks.append(asyncio.create_task(refresh_availability_forever()))
+    background_tasks.append(asyncio.create_task(build_search_indexes()))
+    if GROUP_COMMIT:
+        await group_committer.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await group_committer.close()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await broker.close()
+    await replica_set.close()
+    await database.close()
+
+@app.get("/pool/stats")
+async def get_pool_stats():
+    stats = database.stats()
+    if replica_set.replicas:
+        stats["replicas"] = replica_set.stats()
+    return stats
+
+# CONTENT NEGOTIATION
+# Reads can be served as JSON (the default), in the columnar shape through
+# "Accept: application/json; shape=columnar", or as MessagePack through
+# "Accept: application/msgpack". Bodies are encoded directly from the rows,
+# skipping jsonable_encoder.
+
+# Function to pick the response format from the Accept header, or fail with 406
+def response_format(request, offered=(formats.JSON, formats.MSGPACK)):
+    chosen = formats.negotiate(request.headers.get("accept"), offered)
+    if chosen is None:
+        raise HTTPException(status_code=406, detail=f"Acceptable formats: {', '.join(offered)}")
+    return chosen
+
+def render_body(data, fmt):
+    started = time.perf_counter()
+    body = formats.encode(data, *fmt)
+    http_response_render_seconds.observe(time.perf_counter() - started)
+    return body
+
+# Function to build a negotiated response; headers set on response (such as
+# X-Next-After-Id) are carried over
+def negotiated(request, data, response=None):
+    fmt = response_format(request)
+    headers = {"Vary": "Accept"}
+    if response is not None:
+        headers.update((k, v) for k, v in response.headers.items() if k.lower().startswith("x-"))
+    return Response(content=render_body(data, fmt), media_type=fmt[0], headers=headers)
+
+# RESPONSE CACHE
+# Entries are (body, etag, headers, version) keyed by ("item", id) or ("list",
+# query), plus the negotiated format as the last element. version is the change
+# version the database node the entry was read from had applied.
+rooms_cache = TTLCache(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+users_cache = TTLCache(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+# Keyed by ("window", start, end, bucket, room_id)
+utilization_cache = TTLCache(max_entries=64, ttl=UTILIZATION_CACHE_TTL)
+
+def etag_matches(request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+# Function serving a read from cache in the negotiated format; load(db, response)
+# runs only on a miss, so a hit or a 304 never checks out a database connection.
+# An entry read from a node older than the client's read-your-writes version
+# counts as a miss, so a writer never gets back what it just overwrote.
+async def cached_json(request, cache, key, load):
+    fmt = response_format(request)
+    key = key + (fmt,)
+    min_version = read_min_version(request)
+    entry = cache.get(key, accept=lambda entry: entry[3] >= min_version)
+    if entry is None:
+        response = Response()
+        async with db_session(response, read=True, min_version=min_version) as db:
+            data = await load(db, response)
+            version = db.applied_version
+        body = render_body(data, fmt)
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        headers = {k: v for k, v in response.headers.items() if k.lower() == "x-next-after-id"}
+        entry = (body, etag, headers, version)
+        cache.set(key, entry)
+    body, etag, headers, _ = entry
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept"})
+    return Response(content=body, media_type=fmt[0], headers={"ETag": etag, "Vary": "Accept", **headers})
+
+def list_cache_key(request):
+    return ("list", tuple(sorted(request.query_params.multi_items())))
+
+def invalidate_cached(cache, item_id=None):
+    cache.invalidate_where(lambda key: key[0] == "list" or (item_id is not None and key[:2] == ("item", item_id)))
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return {"rooms": rooms_cache.stats(), "users": users_cache.stats(), "utilization": utilization_cache.stats()}
+
+# Pool and cache statistics are kept by their owners and sampled at scrape time
+def pool_gauge(key):
+    return lambda: {(): database.stats().get(key, 0)}
+
+def cache_counter(key):
+    return lambda: {
+        ("rooms",): rooms_cache.stats()[key],
+        ("users",): users_cache.stats()[key],
+        ("utilization",): utilization_cache.stats()[key],
+    }
+
+registry.gauge("db_pool_size", "Open database connections", collect=pool_gauge("size"))
+registry.gauge("db_pool_in_use", "Database connections checked out", collect=pool_gauge("in_use"))
+registry.gauge("db_pool_idle", "Idle database connections", collect=pool_gauge("idle"))
+registry.counter("db_pool_timeouts_total", "Checkouts that timed out", collect=pool_gauge("timeouts"))
+registry.counter("cache_hits_total", "Response cache hits", ("cache",), collect=cache_counter("hits"))
+registry.counter("cache_misses_total", "Response cache misses", ("cache",), collect=cache_counter("misses"))
+registry.counter("cache_evictions_total", "Response cache evictions", ("cache",), collect=cache_counter("evictions"))
+registry.gauge("events_subscribers", "Open /events streams", collect=lambda: {(): broker.stats()["subscribers"]})
+registry.counter("events_dropped_total", "Events dropped for slow subscribers", collect=lambda: {(): broker.stats()["dropped"]})
+registry.gauge("db_replica_healthy", "1 while a read replica is in rotation", ("replica",),
+               collect=lambda: {(r.name,): int(r.healthy) for r in replica_set.replicas})
+registry.gauge("db_replica_lag_seconds", "Replication lag seen by the last health check", ("replica",),
+               collect=lambda: {(r.name,): r.lag for r in replica_set.replicas if r.lag is not None})
+registry.counter("db_replica_reads_total", "Sessions handed out per read replica", ("replica",),
+                 collect=lambda: {(r.name,): r.reads for r in replica_set.replicas})
+
+# ADMISSION CONTROL
+# Every request holds a slot of its class's limiter from before the handler
+# runs until its response is sent, so a streamed export holds one throughout.
+# Each class adapts to the latency of its own statements only, so lock waits
+# of a booking burst don't shrink the read limit.
+def admission_limits():
+    limits = {"read": ADMISSION_READ_LIMIT, "write": ADMISSION_WRITE_LIMIT, "export": ADMISSION_EXPORT_LIMIT}
+    total = sum(limits.values())
+    if total > ADMISSION_CAPACITY:
+        print(f"Admission limits add up to {total}, more than the {ADMISSION_CAPACITY} connections "
+              f"available; scaling them down")
+        limits = {name: max(1, limit * ADMISSION_CAPACITY // total) for name, limit in limits.items()}
+    return limits
+
+def make_limiter(name, limit, adaptive=True):
+    return AdaptiveLimiter(
+        name, LatencyTracker() if adaptive else None,
+        limit=limit,
+        min_limit=min(ADMISSION_MIN_LIMIT, limit),
+        max_limit=limit,
+        max_queue=ADMISSION_MAX_QUEUE,
+        target=ADMISSION_TARGET_DB_MS / 1000,
+    )
+
+limiters = {
+    name: make_limiter(name, limit, adaptive=name != "export") for name, limit in admission_limits().items()
+}
+# Reads whose statements are long scans by design; they are admitted as reads
+# but left out of the read latency
+ADMISSION_UNMEASURED_PATHS = {"/changes", "/rooms/utilization"}
+# Endpoints that never touch the database, and /events, whose streams stay open
+ADMISSION_EXEMPT_PATHS = {
+    "/metrics", "/events", "/events/stats", "/pool/stats", "/cache/stats", "/admission/stats",
+    "/appointments/group-commit/stats", "/docs", "/redoc", "/openapi.json",
+}
+
+# Function to pick (limiter, measured) for a request from its method and path
+def admission_class(scope):
+    path = scope["path"]
+    if path in ADMISSION_EXEMPT_PATHS:
+        return None
+    if path == "/appointments/export":
+        return limiters["export"], False
+    if scope["method"] in ("GET", "HEAD"):
+        return limiters["read"], path not in ADMISSION_UNMEASURED_PATHS
+    if scope["method"] == "OPTIONS":
+        return None
+    return limiters["write"], True
+
+@app.get("/admission/stats")
+async def get_admission_stats():
+    return {
+        "enabled": ADMISSION,
+        "capacity": ADMISSION_CAPACITY,
+        "target_db_ms": ADMISSION_TARGET_DB_MS,
+        "classes": {name: limiter.stats() for name, limiter in limiters.items()},
+    }
+
+def limiter_gauge(key):
+    return lambda: {(name,): limiter.stats()[key] for name, limiter in limiters.items()}
+
+registry.gauge("admission_limit", "Current concurrency limit per request class", ("class",),
+               collect=limiter_gauge("limit"))
+registry.gauge("admission_in_flight", "Admitted requests running per request class", ("class",),
+               collect=limiter_gauge("in_flight"))
+registry.gauge("admission_queued", "Requests waiting for admission per request class", ("class",),
+               collect=limiter_gauge("queued"))
+
+if replica_set.replicas:
+    app.add_middleware(ReadYourWritesMiddleware, cookie=RYW_COOKIE, window=READ_YOUR_WRITES_WINDOW)
+
+if ADMISSION:
+    app.add_middleware(
+        AdmissionMiddleware,
+        classify=admission_class,
+        timeout=ADMISSION_TIMEOUT,
+        on_reject=admission_rejected_total.inc,
+    )
+
+# Added last so it is outermost and also counts requests shed by admission control
+app.add_middleware(
+    MetricsMiddleware,
+    requests_total=http_requests_total,
+    request_seconds=http_request_seconds,
+    in_flight=http_requests_in_flight,
+    # /events responses stay open for as long as the client listens
+    excluded_paths=("/metrics", "/events"),
+)
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4")
 
 # Models
 class User(BaseModel):
@@ -113,182 +597,1776 @@ class Appointment(BaseModel):
     end_time: datetime
     purpose: str
 
-# USER FUNCTIONS
-@app.post("/users")
-def create_user(user: User):
+# One item of PATCH /appointments/batch: the appointment to overwrite and its new fields
+class AppointmentUpdate(Appointment):
+    id: int
+
+# A repeating appointment: start_time/end_time give the first occurrence,
+# until and count (either, both or neither) bound the series
+class RecurringAppointment(Appointment):
+    freq: str
+    interval: int = 1
+    until: Optional[datetime] = None
+    count: Optional[int] = None
+    exdates: List[datetime] = []
+
+class OccurrenceOverride(BaseModel):
+    start_time: datetime
+    end_time: datetime
+    purpose: Optional[str] = None
+
+# Columns clients may request with ?fields=
+USER_COLUMNS = ("id", "name", "email")
+ROOM_COLUMNS = ("id", "name", "location", "capacity")
+APPOINTMENT_COLUMNS = ("id", "user_id", "room_id", "start_time", "end_time", "purpose", "status")
+RECURRING_COLUMNS = (
+    "id", "user_id", "room_id", "start_time", "end_time", "purpose",
+    "freq", "interval_count", "until_time", "occurrence_count", "series_end", "status",
+)
+
+# Function to turn ?fields=a,b into a column list; id is always included for paging
+def select_columns(fields, allowed):
+    if not fields:
+        return allowed
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown field(s): {', '.join(unknown)}")
+    return ("id",) + tuple(f for f in allowed if f in requested and f != "id")
+
+# Function to fetch one keyset page; filters are (sql condition, value) pairs,
+# conditions whose value is None are skipped
+async def fetch_page(db, response, table, columns, filters, after_id, limit):
+    limit = min(limit, MAX_PAGE_SIZE)
+    where = []
+    args = []
+    for condition, value in filters:
+        if value is not None:
+            where.append(condition)
+            args.append(value)
+    if after_id is not None:
+        where.append("id > %s")
+        args.append(after_id)
+    sql = f"SELECT {', '.join(columns)} FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id LIMIT %s"
+    args.append(limit)
+    rows = await db.fetchall(sql, args)
+    if len(rows) == limit:
+        response.headers["X-Next-After-Id"] = str(rows[-1]["id"])
+    return rows
+
+# RELATED DATA
+# ?expand=user,room embeds the related user and room in appointment reads.
+# Each relation is one IN query over the ids on the page, however many rows.
+EXPANSIONS = {
+    "user": ("user_id", "users", USER_COLUMNS),
+    "room": ("room_id", "rooms", ROOM_COLUMNS),
+}
+
+def parse_expand(value):
+    if not value:
+        return []
+    requested = list(dict.fromkeys(e.strip() for e in value.split(",") if e.strip()))
+    unknown = [e for e in requested if e not in EXPANSIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown expansion(s): {', '.join(unknown)}")
+    return requested
+
+# Function to make sure the foreign keys an expansion needs are selected
+def expand_columns(columns, expand):
+    missing = tuple(EXPANSIONS[e][0] for e in expand if EXPANSIONS[e][0] not in columns)
+    return columns + missing
+
+# Function to load rows of table by id in one query, as {id: row}
+async def load_related(db, table, columns, ids):
+    ids = sorted({i for i in ids if i is not None})
+    if not ids:
+        return {}
+    placeholders = ", ".join(["%s"] * len(ids))
+    rows = await db.fetchall(f"SELECT {', '.join(columns)} FROM {table} WHERE id IN ({placeholders})", ids)
+    return {row["id"]: row for row in rows}
+
+# Function to embed related records under the expansion name; a dangling
+# reference embeds null
+async def expand_related(db, rows, expand):
+    for name in expand:
+        key, table, columns = EXPANSIONS[name]
+        related = await load_related(db, table, columns, [row[key] for row in rows])
+        for row in rows:
+            row[name] = related.get(row[key])
+    return rows
+
+# BATCH HELPERS
+def check_batch_size(items):
+    if not items:
+        raise HTTPException(status_code=400, detail="Batch is empty")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch larger than {BATCH_MAX_ITEMS} items")
+
+def batch_item_error(index, status, error):
+    return {"index": index, "status": status, "error": error}
+
+# Function to build the response of a batch, or fail the whole batch in atomic mode
+def batch_response(results, atomic):
+    failed = [r for r in results if r["status"] not in ("created", "updated", "deleted")]
+    if atomic and failed:
+        statuses = {r["status"] for r in failed}
+        status_code = 409 if "conflict" in statuses else 404 if "not_found" in statuses else 400
+        raise HTTPException(
+            status_code=status_code,
+            detail={"message": "Batch rejected, nothing was written", "results": failed},
+        )
+    return {"succeeded": len(results) - len(failed), "failed": len(failed), "results": results}
+
+# Function to insert rows of table with one executemany inside the current
+# transaction. Returns (id, error) per row. The ids are read back rather than
+# derived from lastrowid: with innodb_autoinc_lock_mode=2 (the MySQL 8 default)
+# concurrent inserts interleave their auto-increment values, and executemany
+# may split a large batch over several statements. The read-back is a
+# consistent read, which under REPEATABLE READ sees only the rows committed
+# before the transaction's snapshot (all at or below `before`) and its own. If
+# the count does not add up (another isolation level) or the statement fails
+# and atomic is False, the rows go in one by one under savepoints instead, so
+# a bad row only fails itself.
+async def insert_rows(db, table, sql, rows, atomic):
+    if not rows:
+        return []
+    before = (await db.fetchone(f"SELECT COALESCE(MAX(id), 0) AS id FROM {table}"))["id"]
+    await db.execute("SAVEPOINT batch_insert")
     try:
-        connection = dbconnect()
-        if not connection:
-            raise HTTPException(status_code=500, detail="Database connection failed")
-        with connection.cursor() as cursor:
-            sql = "INSERT INTO users (username, email) VALUES (%s, %s)"
-            cursor.execute(sql, (user.name, user.email))
-            connection.commit()
-        connection.close()
-        return {"message": "User created successfully"}
+        await db.executemany(sql, rows)
     except pymysql.MySQLError as e:
-        print(f"Database error: {e}")
-        raise HTTPException(status_code=500, detail="Failed to create user")
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-        raise HTTPException(status_code=500, detail="An unexpected error occurred")
+        if is_disconnect(e):
+            raise
+        if atomic:
+            raise HTTPException(status_code=400, detail=f"Batch rejected, nothing was written: {e.args[-1]}")
+        await db.execute("ROLLBACK TO SAVEPOINT batch_insert")
+        return await insert_rows_one_by_one(db, sql, rows)
+    ids = await db.fetchall(f"SELECT id FROM {table} WHERE id > %s ORDER BY id", (before,))
+    if len(ids) == len(rows):
+        return [(row["id"], None) for row in ids]
+    await db.execute("ROLLBACK TO SAVEPOINT batch_insert")
+    inserted = await insert_rows_one_by_one(db, sql, rows)
+    errors = [error for _, error in inserted if error is not None]
+    if atomic and errors:
+        raise HTTPException(status_code=400, detail=f"Batch rejected, nothing was written: {errors[0]}")
+    return inserted
+
+async def insert_rows_one_by_one(db, sql, rows):
+    results = []
+    for row in rows:
+        await db.execute("SAVEPOINT batch_item")
+        try:
+            result = await db.execute(sql, row)
+            results.append((result.lastrowid, None))
+        except pymysql.MySQLError as e:
+            if is_disconnect(e):
+                raise
+            await db.execute("ROLLBACK TO SAVEPOINT batch_item")
+            results.append((None, str(e.args[-1])))
+    return results
+
+# Function to run an UPDATE once per row with one executemany inside the
+# current transaction. Returns the error of each row, None where it succeeded,
+# retrying row by row like insert_rows when the statement fails and atomic is False.
+async def update_rows(db, sql, rows, atomic):
+    if not rows:
+        return []
+    try:
+        await db.executemany(sql, rows)
+    except pymysql.MySQLError as e:
+        if is_disconnect(e):
+            raise
+        if atomic:
+            raise HTTPException(status_code=400, detail=f"Batch rejected, nothing was written: {e.args[-1]}")
+        return [error for _, error in await insert_rows_one_by_one(db, sql, rows)]
+    return [None] * len(rows)
+
+def insert_results(inserted):
+    return [
+        {"index": i, "status": "created", "id": new_id} if error is None else batch_item_error(i, "error", error)
+        for i, (new_id, error) in enumerate(inserted)
+    ]
+
+def inserted_ids(inserted):
+    return [new_id for new_id, error in inserted if error is None]
+
+# CHANGE TRACKING
+# Every write stamps the rows it touches with a version from the single-row
+# change_seq table, and deletes leave a tombstone with theirs. The change_seq row
+# stays locked until commit, so versions become visible in increasing order and
+# GET /changes can hand out the highest version it saw as the next token.
+# That lock serializes every writer, whatever the table, from its stamp to its
+# commit. Versions are reserved after a write's own statements, which keeps
+# that window short and has every transaction take its row locks before the
+# sequence lock.
+
+# Function reserving count consecutive versions, returning the first one. Not
+# an auto-increment: the UPDATE adds count under the change_seq row lock, and
+# LAST_INSERT_ID(expr) hands this connection back exactly the value it wrote.
+async def next_versions(db, count=1):
+    result = await db.execute(
+        "UPDATE change_seq SET version = LAST_INSERT_ID(version + %s) WHERE id = 1", (count,)
+    )
+    # Read-your-writes: this client's next reads need a replica at least this far
+    note_write(result.lastrowid)
+    return result.lastrowid - count + 1
+
+# Function to give rows new versions. Near consecutive ids (single rows, a
+# batch insert) get them by id offset in one statement; scattered ids, as in a
+# group commit, get one version each.
+async def stamp_versions(db, table, ids):
+    if not ids:
+        return
+    ids = sorted(set(ids))
+    low, high = ids[0], ids[-1]
+    if high - low < 2 * len(ids):
+        first = await next_versions(db, high - low + 1)
+        placeholders = ", ".join(["%s"] * len(ids))
+        await db.execute(f"UPDATE {table} SET version = %s + id WHERE id IN ({placeholders})", [first - low, *ids])
+    else:
+        first = await next_versions(db, len(ids))
+        await db.executemany(
+            f"UPDATE {table} SET version = %s WHERE id = %s", [(first + i, row_id) for i, row_id in enumerate(ids)]
+        )
+
+async def record_deletes(db, table, ids):
+    if not ids:
+        return
+    first = await next_versions(db, len(ids))
+    await db.executemany(
+        "INSERT INTO tombstones (version, entity, entity_id) VALUES (%s, %s, %s)",
+        [(first + i, table, entity_id) for i, entity_id in enumerate(ids)],
+    )
+
+# CHANGE EVENTS
+if EVENTS_BACKEND == "redis":
+    broker = Broker(RedisBackend(EVENTS_REDIS_URL), max_queue=EVENTS_QUEUE_SIZE)
+elif EVENTS_BACKEND == "local":
+    broker = Broker(LocalBackend(), max_queue=EVENTS_QUEUE_SIZE)
+else:
+    raise RuntimeError(f"Unknown EVENTS_BACKEND {EVENTS_BACKEND!r}, expected 'local' or 'redis'")
+
+# Function to announce committed writes to push subscribers. One event per
+# request; room_ids and user_ids are what subscription filters match on.
+def publish_change(entity, action, ids, room_ids=(), user_ids=()):
+    if not ids:
+        return
+    if entity == "rooms":
+        room_ids = ids
+    elif entity == "users":
+        user_ids = ids
+    broker.publish({
+        "type": "change",
+        "entity": entity,
+        "action": action,
+        "ids": list(ids),
+        "room_ids": sorted({i for i in room_ids if i is not None}),
+        "user_ids": sorted({i for i in user_ids if i is not None}),
+    })
+
+def parse_ids(value, name):
+    if not value:
+        return None
+    try:
+        return {int(v) for v in value.split(",") if v.strip()}
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be a comma-separated list of ids")
+
+async def event_stream(subscription):
+    try:
+        # Clients reconnect after 3s and should then catch up through GET /changes
+        yield "retry: 3000\n\n"
+        while True:
+            event = await subscription.get(EVENTS_HEARTBEAT)
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+# Server-Sent Events stream of committed changes, optionally filtered with
+# ?entities=rooms,appointments&rooms=1,2&users=3. Events only say what changed;
+# clients fetch the data through GET /changes. A "resync" event means events
+# were dropped because the client fell behind.
+@app.get("/events")
+async def stream_events(entities: Optional[str] = None, rooms: Optional[str] = None, users: Optional[str] = None):
+    entity_names = {e.strip() for e in entities.split(",") if e.strip()} if entities else None
+    unknown = (entity_names or set()) - set(CHANGE_COLUMNS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown entities: {', '.join(sorted(unknown))}")
+    subscription = broker.subscribe(entity_names, parse_ids(rooms, "rooms"), parse_ids(users, "users"))
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(event_stream(subscription), media_type="text/event-stream", headers=headers)
+
+@app.get("/events/stats")
+async def get_event_stats():
+    return broker.stats()
+
+# Columns returned per table by GET /changes
+CHANGE_COLUMNS = {
+    "users": USER_COLUMNS + ("version",),
+    "rooms": ROOM_COLUMNS + ("version",),
+    "appointments": APPOINTMENT_COLUMNS + ("version",),
+    "recurring_appointments": RECURRING_COLUMNS + ("version",),
+}
+
+# Everything that changed after version `since`: current rows of the tracked tables
+# plus the ids deleted from them. Pass the returned token as `since` next time,
+# and keep going while `more` is true. since=0 returns every row.
+@app.get("/changes")
+async def get_changes(
+    request: Request,
+    response: Response,
+    since: int = Query(0, ge=0),
+    limit: int = Query(CHANGES_PAGE_SIZE, ge=1),
+):
+    limit = min(limit, CHANGES_PAGE_SIZE)
+    # A replica that has not applied `since` yet would answer 410, so only ones
+    # that have are used
+    min_version = max(since, read_min_version(request))
+    async with db_session(response, read=True, min_version=min_version) as db:
+        # All reads below share one snapshot, so the sequence and the rows agree
+        latest = (await db.fetchone("SELECT version FROM change_seq WHERE id = 1"))["version"]
+        if since > latest:
+            raise HTTPException(status_code=410, detail="Unknown sync token, sync again from 0")
+
+        sources = {}
+        for table, columns in CHANGE_COLUMNS.items():
+            sources[table] = await db.fetchall(
+                f"SELECT {', '.join(columns)} FROM {table} WHERE version > %s ORDER BY version LIMIT %s",
+                (since, limit),
+            )
+        tombstones = await db.fetchall(
+            "SELECT version, entity, entity_id FROM tombstones WHERE version > %s ORDER BY version LIMIT %s",
+            (since, limit),
+        )
+
+        # A full page may have more behind it, so only versions up to the lowest
+        # last version among full pages are complete
+        full = [rows[-1]["version"] for rows in [*sources.values(), tombstones] if len(rows) == limit]
+        token = min(full) if full else latest
+
+        changes = {table: [row for row in rows if row["version"] <= token] for table, rows in sources.items()}
+        deleted = {table: [] for table in CHANGE_COLUMNS}
+        for row in tombstones:
+            if row["version"] <= token and row["entity"] in deleted:
+                deleted[row["entity"]].append(row["entity_id"])
+        return negotiated(request, {"token": token, "more": bool(full), **changes, "deleted": deleted})
+
+# SEARCH
+# Type-ahead search over users and rooms, served from in-memory text indexes
+# (see search.TextIndex). The indexes are built in the background at startup,
+# the rows read in one query and the index built off the event loop after the
+# connection has been given back. An index then follows this worker's own
+# writes directly, and at most every SEARCH_SYNC_INTERVAL seconds pulls rows
+# and tombstones with a newer change version, which brings in writes made
+# through other workers.
+SEARCH_SOURCES = {
+    "users": (USER_COLUMNS, ("name", "email")),
+    "rooms": (ROOM_COLUMNS, ("name", "location")),
+}
+SEARCH_BUILD_RETRY = 5    # seconds between attempts while the database is unreachable
+# Changes of more records than this are applied on the threadpool
+SEARCH_INLINE_CHANGES = 1
+search_indexes = {}
+# Held by the catch-up, so only one request runs it at a time
+search_locks = {table: asyncio.Lock() for table in SEARCH_SOURCES}
+# Held while an index changes; searches wait rather than read it half updated
+search_write_locks = {table: asyncio.Lock() for table in SEARCH_SOURCES}
+
+def search_stale(table):
+    index = search_indexes.get(table)
+    return index is not None and time.monotonic() - index.synced_at >= SEARCH_SYNC_INTERVAL
+
+# Function to build the search index of a table from scratch
+async def build_search_index(table):
+    columns, fields = SEARCH_SOURCES[table]
+    async with db_session() as db:
+        # Read first: anything committed while the rows are read is fetched again by the next sync
+        latest = (await db.fetchone("SELECT version FROM change_seq WHERE id = 1"))["version"]
+        rows = await db.fetchall(f"SELECT {', '.join(columns)} FROM {table}")
+    search_indexes[table] = await run_in_threadpool(TextIndex, fields, rows, latest)
+
+# Background task building every index, retrying until the database answers
+async def build_search_indexes():
+    for table in SEARCH_SOURCES:
+        while table not in search_indexes:
+            try:
+                await build_search_index(table)
+            except HTTPException as e:
+                print(f"Error building the {table} search index: {e.detail}")
+                await asyncio.sleep(SEARCH_BUILD_RETRY)
+
+# Function to catch up the search index of a table with newer changes
+async def sync_search_index(request, table):
+    async with search_locks[table]:
+        if not search_stale(table):
+            return
+        index = search_indexes[table]
+        columns, _ = SEARCH_SOURCES[table]
+        async with db_session(read=True, min_version=read_min_version(request)) as db:
+            latest = (await db.fetchone("SELECT version FROM change_seq WHERE id = 1"))["version"]
+            rows = await db.fetchall(
+                f"SELECT {', '.join(columns)} FROM {table} WHERE version > %s", (index.version,)
+            )
+            deleted = await db.fetchall(
+                "SELECT entity_id FROM tombstones WHERE entity = %s AND version > %s", (table, index.version)
+            )
+        await search_apply(table, rows, [row["entity_id"] for row in deleted])
+        index.version = latest
+        index.synced_at = time.monotonic()
+
+# Function to run a search. A catch-up that is due runs first, unless another
+# request is already doing it; then the index is served as it is.
+async def search_table(request, table, q, limit, where=None):
+    if table not in search_indexes:
+        raise HTTPException(status_code=503, detail="Search index is still being built", headers={"Retry-After": "5"})
+    if search_stale(table) and not search_locks[table].locked():
+        await sync_search_index(request, table)
+    async with search_write_locks[table]:
+        results = search_indexes[table].search(q, min(limit, SEARCH_MAX_LIMIT), where)
+    return negotiated(request, results)
+
+# Function for write paths and the catch-up to keep a built index current.
+# A put costs about a millisecond on a large index, so anything beyond a single
+# record is applied in one call on the threadpool instead of on the event loop.
+async def search_apply(table, records=(), deleted=()):
+    index = search_indexes.get(table)
+    if index is None:
+        return
+    records, deleted = list(records), list(deleted)
+    async with search_write_locks[table]:
+        if len(records) + len(deleted) > SEARCH_INLINE_CHANGES:
+            await run_in_threadpool(index.update, records, deleted)
+        else:
+            index.update(records, deleted)
+
+registry.gauge("search_index_records", "Records held by the in-memory search indexes", ("table",),
+               collect=lambda: {(table,): len(index) for table, index in search_indexes.items()})
+
+# USER FUNCTIONS
+@app.post("/users")
+async def create_user(user: User, db=Depends(get_db)):
+    sql = "INSERT INTO users (name, email) VALUES (%s, %s)"
+    result = await db.execute(sql, (user.name, user.email))
+    await stamp_versions(db, "users", [result.lastrowid])
+    await db.commit()
+    await search_apply("users", [{"id": result.lastrowid, "name": user.name, "email": user.email}])
+    invalidate_cached(users_cache)
+    publish_change("users", "created", [result.lastrowid])
+    return {"message": "User created successfully", "id": result.lastrowid}
+
+@app.post("/users/batch")
+async def create_users_batch(users: List[User], atomic: bool = True, db=Depends(get_db)):
+    check_batch_size(users)
+    await db.begin()
+    sql = "INSERT INTO users (name, email) VALUES (%s, %s)"
+    inserted = await insert_rows(db, "users", sql, [(u.name, u.email) for u in users], atomic)
+    await stamp_versions(db, "users", inserted_ids(inserted))
+    await db.commit()
+    await search_apply("users", [
+        {"id": new_id, "name": user.name, "email": user.email}
+        for user, (new_id, error) in zip(users, inserted) if error is None
+    ])
+    invalidate_cached(users_cache)
+    publish_change("users", "created", inserted_ids(inserted))
+    return batch_response(insert_results(inserted), atomic)
 
 @app.get("/users")
-def get_all_users():
-    connection = dbconnect()
-    if connection:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT * FROM users")
-            users = cursor.fetchall()
-        connection.close()
-        return users
+async def get_all_users(
+    request: Request,
+    after_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1),
+    fields: Optional[str] = None,
+):
+    columns = select_columns(fields, USER_COLUMNS)
+
+    async def load(db, response):
+        return await fetch_page(db, response, "users", columns, [], after_id, limit)
+
+    return await cached_json(request, users_cache, list_cache_key(request), load)
+
+# Users whose name or email contains every word of q, best matches first
+@app.get("/users/search")
+async def search_users(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1),
+):
+    return await search_table(request, "users", q, limit)
 
 @app.get("/users/{user_id}")
-def get_user_by_id(user_id: int):
-    connection = dbconnect()
-    if connection:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-            user = cursor.fetchone()
-        connection.close()
+async def get_user_by_id(user_id: int, request: Request):
+    async def load(db, response):
+        user = await db.fetchone(f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE id = %s", (user_id,))
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         return user
 
+    return await cached_json(request, users_cache, ("item", user_id), load)
+
 @app.put("/users/{user_id}")
-def update_user(user_id: int, user: User):
-    connection = dbconnect()
-    if connection:
-        with connection.cursor() as cursor:
-            sql = "UPDATE users SET name = %s, email = %s WHERE id = %s"
-            cursor.execute(sql, (user.name, user.email, user_id))
-            connection.commit()
-        connection.close()
+async def update_user(user_id: int, user: User, db=Depends(get_db)):
+    await db.begin()
+    # rowcount is 0 for an unchanged row too, so check that the user exists
+    if not await db.fetchone("SELECT id FROM users WHERE id = %s FOR UPDATE", (user_id,)):
+        raise HTTPException(status_code=404, detail="User not found")
+    sql = "UPDATE users SET name = %s, email = %s WHERE id = %s"
+    await db.execute(sql, (user.name, user.email, user_id))
+    await stamp_versions(db, "users", [user_id])
+    await db.commit()
+    await search_apply("users", [{"id": user_id, "name": user.name, "email": user.email}])
+    invalidate_cached(users_cache, user_id)
+    publish_change("users", "updated", [user_id])
     return {"message": "User updated successfully"}
 
 @app.delete("/users/{user_id}")
-def delete_user(user_id: int):
-    connection = dbconnect()
-    if connection:
-        with connection.cursor() as cursor:
-            cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
-            connection.commit()
-        connection.close()
+async def delete_user(user_id: int, db=Depends(get_db)):
+    result = await db.execute("DELETE FROM users WHERE id = %s", (user_id,))
+    if result.rowcount:
+        await record_deletes(db, "users", [user_id])
+    await db.commit()
+    await search_apply("users", deleted=[user_id])
+    invalidate_cached(users_cache, user_id)
+    if result.rowcount:
+        publish_change("users", "deleted", [user_id])
     return {"message": "User deleted successfully"}
 
 # ROOM FUNCTIONS
 @app.post("/rooms")
-def create_room(room: Room):
-    connection = dbconnect()
-    if connection:
-        with connection.cursor() as cursor:
-            sql = "INSERT INTO rooms (name, location, capacity) VALUES (%s, %s, %s)"
-            cursor.execute(sql, (room.name, room.location, room.capacity))
-            connection.commit()
-        connection.close()
-    return {"message": "Room created successfully"}
+async def create_room(room: Room, db=Depends(get_db)):
+    sql = "INSERT INTO rooms (name, location, capacity) VALUES (%s, %s, %s)"
+    result = await db.execute(sql, (room.name, room.location, room.capacity))
+    await stamp_versions(db, "rooms", [result.lastrowid])
+    await db.commit()
+    record = {"id": result.lastrowid, "name": room.name, "location": room.location, "capacity": room.capacity}
+    room_catalog.put(record)
+    await search_apply("rooms", [record])
+    invalidate_cached(rooms_cache)
+    publish_change("rooms", "created", [result.lastrowid])
+    return {"message": "Room created successfully", "id": result.lastrowid}
+
+@app.post("/rooms/batch")
+async def create_rooms_batch(rooms: List[Room], atomic: bool = True, db=Depends(get_db)):
+    check_batch_size(rooms)
+    await db.begin()
+    sql = "INSERT INTO rooms (name, location, capacity) VALUES (%s, %s, %s)"
+    inserted = await insert_rows(db, "rooms", sql, [(r.name, r.location, r.capacity) for r in rooms], atomic)
+    await stamp_versions(db, "rooms", inserted_ids(inserted))
+    await db.commit()
+    records = [
+        {"id": new_id, "name": room.name, "location": room.location, "capacity": room.capacity}
+        for room, (new_id, error) in zip(rooms, inserted) if error is None
+    ]
+    for record in records:
+        room_catalog.put(record)
+    await search_apply("rooms", records)
+    invalidate_cached(rooms_cache)
+    publish_change("rooms", "created", inserted_ids(inserted))
+    return batch_response(insert_results(inserted), atomic)
 
 @app.get("/rooms")
-def get_all_rooms():
-    connection = dbconnect()
-    if connection:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT * FROM rooms")
-            rooms = cursor.fetchall()
-        connection.close()
-        return rooms
+async def get_all_rooms(
+    request: Request,
+    after_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1),
+    min_capacity: Optional[int] = None,
+    location: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    columns = select_columns(fields, ROOM_COLUMNS)
+    filters = [
+        ("capacity >= %s", min_capacity),
+        ("location = %s", location),
+    ]
+
+    async def load(db, response):
+        return await fetch_page(db, response, "rooms", columns, filters, after_id, limit)
+
+    return await cached_json(request, rooms_cache, list_cache_key(request), load)
+
+# Rooms by capacity for the availability search, bookings come from interval_index
+room_catalog = RoomCatalog()
+
+# Function to (re)load every room and its bookings in two queries. Bookings
+# that have already ended can't conflict with anything bookable, so they are
+# left out. This replaces the rooms of the interval index that the booking
+# conflict check uses, so db must be a primary session. Bookings this worker
+# writes while the queries run are replayed on top by load_all.
+async def refresh_availability(db):
+    interval_index.start_reload()
+    room_catalog.start_reload()
+    rooms = await db.fetchall("SELECT id, name, location, capacity FROM rooms")
+    rows = await db.fetchall(
+        "SELECT id, room_id, start_time, end_time FROM appointments "
+        "WHERE status <> 'cancelled' AND end_time > NOW()"
+    )
+    bookings = {}
+    for row in rows:
+        bookings.setdefault(row["room_id"], []).append((row["id"], row["start_time"], row["end_time"]))
+    interval_index.load_all([room["id"] for room in rooms], bookings)
+    room_catalog.load(rooms)
+
+# Active recurring series per room, for the availability search
+series_index = SeriesIndex()
+
+async def refresh_series_index(db):
+    series_index.start_reload()
+    series_index.load(await load_series(
+        db, "status <> 'cancelled' AND (series_end IS NULL OR series_end > %s)", (datetime.now(),)
+    ))
+
+AVAILABILITY_RETRY = 5    # seconds between attempts while the database is unreachable
+
+# Background task reloading rooms, bookings and series every AVAILABILITY_REFRESH
+# seconds, off the request path and from the primary, so a lagging replica never
+# overwrites what the conflict check relies on
+async def refresh_availability_forever():
+    while True:
+        try:
+            async with db_session() as db:
+                await refresh_availability(db)
+                await refresh_series_index(db)
+        except Exception as e:
+            # Also a bad row or an unexpected driver error: log it and keep the task alive
+            print(f"Error refreshing availability: {e.detail if isinstance(e, HTTPException) else e!r}")
+            await asyncio.sleep(AVAILABILITY_RETRY)
+            continue
+        await asyncio.sleep(AVAILABILITY_REFRESH)
+
+# Which rooms with capacity >= min_capacity are free for the whole [start, end) window
+@app.get("/rooms/available")
+async def get_available_rooms(
+    start: datetime,
+    end: datetime,
+    min_capacity: Optional[int] = None,
+    location: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1),
+):
+    start, end = naive(start), naive(end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    # Never loaded yet (startup); once loaded a late refresh just serves older data
+    if room_catalog.loaded_at is None or series_index.loaded_at is None:
+        raise HTTPException(status_code=503, detail="Availability is still loading", headers={"Retry-After": "5"})
+    candidates = room_catalog.candidates(min_capacity, location)
+    return free_rooms(candidates, interval_index, start, end, min(limit, MAX_PAGE_SIZE), series_index)
+
+# Rooms whose name or location contains every word of q, best matches first
+@app.get("/rooms/search")
+async def search_rooms(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    min_capacity: Optional[int] = None,
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1),
+):
+    where = None
+    if min_capacity is not None:
+        where = lambda room: (room["capacity"] or 0) >= min_capacity
+    return await search_table(request, "rooms", q, limit, where)
+
+# Function to drop cached utilization reports whose window overlaps [start, end);
+# end None means open-ended
+def invalidate_utilization(start, end=None):
+    start = naive(start)
+    utilization_cache.invalidate_where(
+        lambda key: key[2] > start and (end is None or key[1] < naive(end))
+    )
+
+# Load the bookings overlapping [start, end) as NumPy columns: room ids and
+# start/end in seconds from start. Rows are streamed so a large window never
+# holds more than one batch of row dicts.
+async def load_booking_columns(db, start, end, room_id):
+    sql = """
+        SELECT room_id, TIMESTAMPDIFF(SECOND, %s, start_time) AS s, TIMESTAMPDIFF(SECOND, %s, end_time) AS e
+        FROM appointments
+        WHERE start_time < %s AND end_time > %s AND status <> 'cancelled'
+    """
+    args = [start, start, end, start]
+    if room_id is not None:
+        sql += " AND room_id = %s"
+        args.append(room_id)
+    rooms, starts, ends = [], [], []
+    async for rows in db.stream(sql, args, EXPORT_BATCH_SIZE):
+        rooms.append(np.fromiter((row["room_id"] for row in rows), dtype=np.int64, count=len(rows)))
+        starts.append(np.fromiter((row["s"] for row in rows), dtype=np.int64, count=len(rows)))
+        ends.append(np.fromiter((row["e"] for row in rows), dtype=np.int64, count=len(rows)))
+    # Recurring occurrences are expanded into the same columns
+    where = "status <> 'cancelled' AND start_time < %s AND (series_end IS NULL OR series_end > %s)"
+    args = [end, start]
+    if room_id is not None:
+        where += " AND room_id = %s"
+        args.append(room_id)
+    occurrences = [
+        (series.room_id, int((o_start - start).total_seconds()), int((o_end - start).total_seconds()))
+        for series in await load_series(db, where, args)
+        for o_start, o_end, _ in series.occurrences(start, end)
+    ]
+    if occurrences:
+        rooms.append(np.array([o[0] for o in occurrences], dtype=np.int64))
+        starts.append(np.array([o[1] for o in occurrences], dtype=np.int64))
+        ends.append(np.array([o[2] for o in occurrences], dtype=np.int64))
+    if not rooms:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(rooms), np.concatenate(starts), np.concatenate(ends)
+
+# Share of time rooms are booked over [from, to): per room and bucket
+# (occupancy), by weekday and hour of day, and the peak number of rooms in use.
+# from is moved down to a bucket boundary. Reports are cached per window.
+@app.get("/rooms/utilization")
+async def get_room_utilization(
+    request: Request,
+    start: datetime = Query(..., alias="from"),
+    end: datetime = Query(..., alias="to"),
+    bucket: str = Query("1h", pattern="^(15m|30m|1h|1d)$"),
+    room_id: Optional[int] = None,
+):
+    bucket_seconds = BUCKETS[bucket]
+    start, end = align(naive(start), bucket_seconds), naive(end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="to must be after from")
+
+    async def load(db, response):
+        if room_id is None:
+            room_ids = [row["id"] for row in await db.fetchall("SELECT id FROM rooms")]
+        elif await db.fetchone("SELECT id FROM rooms WHERE id = %s", (room_id,)):
+            room_ids = [room_id]
+        else:
+            raise HTTPException(status_code=404, detail="Room not found")
+        cells = len(room_ids) * bucket_count(int((end - start).total_seconds()), bucket_seconds)
+        if cells > UTILIZATION_MAX_CELLS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Report too large ({cells} room buckets, max {UTILIZATION_MAX_CELLS}): "
+                       "use a shorter window, a larger bucket or room_id",
+            )
+        columns = await load_booking_columns(db, start, end, room_id)
+        return await run_in_threadpool(room_utilization, room_ids, *columns, start, end, bucket_seconds)
+
+    return await cached_json(request, utilization_cache, ("window", start, end, bucket, room_id), load)
 
 @app.get("/rooms/{room_id}")
-def get_room_by_id(room_id: int):
-    connection = dbconnect()
-    if connection:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT * FROM rooms WHERE id = %s", (room_id,))
-            room = cursor.fetchone()
-        connection.close()
+async def get_room_by_id(room_id: int, request: Request):
+    async def load(db, response):
+        room = await db.fetchone(f"SELECT {', '.join(ROOM_COLUMNS)} FROM rooms WHERE id = %s", (room_id,))
         if not room:
             raise HTTPException(status_code=404, detail="Room not found")
         return room
 
+    return await cached_json(request, rooms_cache, ("item", room_id), load)
+
+# One day of a room's bookings, one-off and recurring, in start order with
+# the name of who booked each
+@app.get("/rooms/{room_id}/schedule")
+async def get_room_schedule(
+    room_id: int,
+    request: Request,
+    response: Response,
+    day: Optional[date] = None,
+    db=Depends(get_db),
+):
+    day = day or date.today()
+    start = datetime.combine(day, datetime.min.time())
+    end = start + timedelta(days=1)
+    room = await db.fetchone(f"SELECT {', '.join(ROOM_COLUMNS)} FROM rooms WHERE id = %s", (room_id,))
+    if not room:
+        raise HTTPException(status_code=404, detail="Room not found")
+    bookings = await db.fetchall(
+        "SELECT a.id, a.user_id, u.name AS user_name, a.start_time, a.end_time, a.purpose, a.status "
+        "FROM appointments a LEFT JOIN users u ON u.id = a.user_id "
+        "WHERE a.room_id = %s AND a.status <> 'cancelled' AND a.end_time > %s AND a.start_time < %s "
+        "ORDER BY a.start_time, a.id",
+        (room_id, start, end),
+    )
+    occurrences = await expand_occurrences(
+        db, response, ("id", "user_id", "start_time", "end_time", "purpose", "status"),
+        room_id, None, None, start, end, MAX_PAGE_SIZE,
+    )
+    if occurrences:
+        users = await load_related(db, "users", ("id", "name"), [o["user_id"] for o in occurrences])
+        for occurrence in occurrences:
+            user = users.get(occurrence["user_id"])
+            occurrence["user_name"] = user["name"] if user else None
+        bookings = sorted(bookings + occurrences, key=lambda b: (b["start_time"], b["end_time"]))
+    return negotiated(request, {"room": room, "day": day, "bookings": bookings}, response)
+
 @app.put("/rooms/{room_id}")
-def update_room(room_id: int, room: Room):
-    connection = dbconnect()
-    if connection:
-        with connection.cursor() as cursor:
-            sql = "UPDATE rooms SET name = %s, location = %s, capacity = %s WHERE id = %s"
-            cursor.execute(sql, (room.name, room.location, room.capacity, room_id))
-            connection.commit()
-        connection.close()
+async def update_room(room_id: int, room: Room, db=Depends(get_db)):
+    await db.begin()
+    # rowcount is 0 for an unchanged row too, so check that the room exists
+    if not await db.fetchone("SELECT id FROM rooms WHERE id = %s FOR UPDATE", (room_id,)):
+        raise HTTPException(status_code=404, detail="Room not found")
+    sql = "UPDATE rooms SET name = %s, location = %s, capacity = %s WHERE id = %s"
+    await db.execute(sql, (room.name, room.location, room.capacity, room_id))
+    await stamp_versions(db, "rooms", [room_id])
+    await db.commit()
+    record = {"id": room_id, "name": room.name, "location": room.location, "capacity": room.capacity}
+    room_catalog.put(record)
+    await search_apply("rooms", [record])
+    invalidate_cached(rooms_cache, room_id)
+    publish_change("rooms", "updated", [room_id])
     return {"message": "Room updated successfully"}
 
 @app.delete("/rooms/{room_id}")
-def delete_room(room_id: int):
-    connection = dbconnect()
-    if connection:
-        with connection.cursor() as cursor:
-            cursor.execute("DELETE FROM rooms WHERE id = %s", (room_id,))
-            connection.commit()
-        connection.close()
+async def delete_room(room_id: int, db=Depends(get_db)):
+    result = await db.execute("DELETE FROM rooms WHERE id = %s", (room_id,))
+    if result.rowcount:
+        await record_deletes(db, "rooms", [room_id])
+    await db.commit()
+    interval_index.forget(room_id)
+    room_catalog.discard(room_id)
+    await search_apply("rooms", deleted=[room_id])
+    invalidate_cached(rooms_cache, room_id)
+    if result.rowcount:
+        publish_change("rooms", "deleted", [room_id])
     return {"message": "Room deleted successfully"}
 
+# BOOKING CONFLICTS
+# Function to load the active bookings of one room into the interval index
+async def load_room_bookings(db, room_id):
+    rows = await db.fetchall(
+        "SELECT id, start_time, end_time FROM appointments "
+        "WHERE room_id = %s AND status <> 'cancelled' AND end_time > NOW()",
+        (room_id,),
+    )
+    return [(row["id"], row["start_time"], row["end_time"]) for row in rows]
+
+interval_index = IntervalIndex(load_room_bookings, ttl=INTERVAL_INDEX_TTL)
+
+# Function to validate and normalize the booking window of an appointment
+def booking_window(appointment):
+    start, end = naive(appointment.start_time), naive(appointment.end_time)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end_time must be after start_time")
+    return start, end
+
+def booking_conflict(appointment_id):
+    return HTTPException(
+        status_code=409,
+        detail=f"Room is already booked for this time (appointment {appointment_id})",
+    )
+
+# Function to reject an obvious conflict from the in-process index before
+# touching any locks. Hits are confirmed by primary key because another worker
+# may have moved or deleted that booking since the room was loaded.
+async def check_index(db, room_id, start, end, ignore_id=None):
+    room = await interval_index.get(db, room_id)
+    while True:
+        hit = room.find_conflict(start, end, ignore_id)
+        if hit is None:
+            return
+        row = await db.fetchone(
+            "SELECT room_id, start_time, end_time, status FROM appointments WHERE id = %s", (hit,)
+        )
+        if (row and row["room_id"] == room_id and row["status"] != "cancelled"
+                and row["start_time"] < end and row["end_time"] > start):
+            raise booking_conflict(hit)
+        room.remove(hit)
+
+# Function to lock room rows in id order; serializes bookings of a room across workers
+async def lock_rooms(db, room_ids):
+    for room_id in sorted(room_ids):
+        if not await db.fetchone("SELECT id FROM rooms WHERE id = %s FOR UPDATE", (room_id,)):
+            raise HTTPException(status_code=404, detail="Room not found")
+
+# Function to load recurring series matching a WHERE clause, with their exceptions
+async def load_series(db, where, args, lock=""):
+    rows = await db.fetchall(f"SELECT {', '.join(RECURRING_COLUMNS)} FROM recurring_appointments WHERE {where}{lock}", args)
+    if not rows:
+        return []
+    placeholders = ", ".join(["%s"] * len(rows))
+    exceptions = {}
+    for row in await db.fetchall(
+        f"""
+        SELECT series_id, occurrence_start, cancelled, start_time, end_time, purpose
+        FROM recurrence_exceptions WHERE series_id IN ({placeholders}){lock}
+        """,
+        [row["id"] for row in rows],
+    ):
+        override = None if row["cancelled"] else (row["start_time"], row["end_time"], row["purpose"])
+        exceptions.setdefault(row["series_id"], {})[row["occurrence_start"]] = override
+    return [
+        Series(
+            row["id"], row["room_id"], row["user_id"], row["start_time"], row["end_time"], row["purpose"],
+            row["freq"], row["interval_count"], row["until_time"], row["occurrence_count"], row["status"],
+            exceptions.get(row["id"]),
+        )
+        for row in rows
+    ]
+
+# Active series of a room that may have occurrences in [start, end)
+async def room_series(db, room_id, start, end, lock=""):
+    where = "room_id = %s AND status <> 'cancelled' AND start_time < %s AND (series_end IS NULL OR series_end > %s)"
+    return await load_series(db, where, (room_id, end, start), lock)
+
+def series_booking_conflict(series_id, occurrence_start):
+    return HTTPException(
+        status_code=409,
+        detail=f"Room is already booked for this time (recurring appointment {series_id} "
+               f"at {occurrence_start.isoformat()})",
+    )
+
+# Function doing the authoritative overlap check inside the booking transaction,
+# served by idx_room_time and idx_room_span. Must run after lock_rooms.
+# ignore_slot is the (series id, slot) of a recurring occurrence being moved.
+async def check_database(db, room_id, start, end, ignore_id=None, ignore_slot=None):
+    sql = """
+        SELECT id, start_time, end_time FROM appointments
+        WHERE room_id = %s AND start_time < %s AND end_time > %s AND status <> 'cancelled' AND id <> %s
+        LIMIT 1 LOCK IN SHARE MODE
+    """
+    row = await db.fetchone(sql, (room_id, end, start, ignore_id or 0))
+    if row:
+        # Booked by another worker; teach the index about it
+        interval_index.add(room_id, row["id"], row["start_time"], row["end_time"])
+        raise booking_conflict(row["id"])
+    # Recurring occurrences are expanded over just this window
+    hit = series_conflict(await room_series(db, room_id, start, end, " LOCK IN SHARE MODE"), start, end, ignore_slot)
+    if hit:
+        raise series_booking_conflict(*hit)
+
+# APPOINTMENT WRITES
+# Single appointment creates, updates and cancels run either one transaction
+# per request or, with GROUP_COMMIT on, batched into shared transactions. The
+# statements are the same either way: apply_write runs them with the rooms
+# already locked and collects what has to happen around the commit in
+# WriteEffects, so a batch can stamp all versions last and apply the in-process
+# updates only once everything is durable.
+
+# One queued appointment write; kind is "create", "update" or "delete"
+class AppointmentWrite:
+    def __init__(self, kind, appointment_id=None, appointment=None):
+        self.kind = kind
+        self.appointment_id = appointment_id
+        self.appointment = appointment
+        self.start = self.end = None
+        if appointment is not None:
+            self.start, self.end = booking_window(appointment)
+
+class WriteEffects:
+    def __init__(self):
+        self.stamped = []    # appointment ids needing a new version
+        self.deleted = []    # appointment ids needing a tombstone
+        self.after = []      # callables to run once committed
+
+    def extend(self, other):
+        self.stamped += other.stamped
+        self.deleted += other.deleted
+        self.after += other.after
+
+# Function to reserve versions (taking the change_seq lock last), commit and
+# then apply the in-process effects
+async def commit_writes(db, effects):
+    await stamp_versions(db, "appointments", effects.stamped)
+    await record_deletes(db, "appointments", effects.deleted)
+    await db.commit()
+    for action in effects.after:
+        action()
+
+def after_create(appointment_id, appointment, start, end):
+    interval_index.add(appointment.room_id, appointment_id, start, end)
+    invalidate_utilization(start, end)
+    publish_change("appointments", "created", [appointment_id], [appointment.room_id], [appointment.user_id])
+
+def after_update(appointment_id, current, appointment, start, end):
+    interval_index.remove(current["room_id"], appointment_id)
+    interval_index.add(appointment.room_id, appointment_id, start, end)
+    invalidate_utilization(current["start_time"], current["end_time"])
+    invalidate_utilization(start, end)
+    publish_change(
+        "appointments", "updated", [appointment_id],
+        [current["room_id"], appointment.room_id], [current["user_id"], appointment.user_id],
+    )
+
+def after_delete(appointment_id, current):
+    interval_index.remove(current["room_id"], appointment_id)
+    invalidate_utilization(current["start_time"], current["end_time"])
+    publish_change("appointments", "deleted", [appointment_id], [current["room_id"]], [current["user_id"]])
+
+# Function running the statements of one write inside the current transaction.
+# The rooms it books must be locked by the caller.
+async def apply_write(db, write, effects):
+    appointment, start, end = write.appointment, write.start, write.end
+    if write.kind == "create":
+        await check_database(db, appointment.room_id, start, end)
+        sql = """
+            INSERT INTO appointments (user_id, room_id, start_time, end_time, purpose) 
+            VALUES (%s, %s, %s, %s, %s)
+        """
+        result = await db.execute(sql, (appointment.user_id, appointment.room_id, start, end, appointment.purpose))
+        effects.stamped.append(result.lastrowid)
+        effects.after.append(lambda: after_create(result.lastrowid, appointment, start, end))
+        return {"message": "Appointment created successfully", "id": result.lastrowid}
+
+    appointment_id = write.appointment_id
+    current = await db.fetchone(
+        "SELECT room_id, user_id, start_time, end_time FROM appointments WHERE id = %s FOR UPDATE",
+        (appointment_id,),
+    )
+    if write.kind == "update":
+        if not current:
+            raise HTTPException(status_code=404, detail="Appointment not found")
+        await check_database(db, appointment.room_id, start, end, ignore_id=appointment_id)
+        sql = """
+            UPDATE appointments 
+            SET user_id = %s, room_id = %s, start_time = %s, end_time = %s, purpose = %s 
+            WHERE id = %s
+        """
+        await db.execute(sql, (appointment.user_id, appointment.room_id, start, end, appointment.purpose, appointment_id))
+        effects.stamped.append(appointment_id)
+        effects.after.append(lambda: after_update(appointment_id, current, appointment, start, end))
+        return {"message": "Appointment updated successfully"}
+
+    result = await db.execute("DELETE FROM appointments WHERE id = %s", (appointment_id,))
+    if result.rowcount and current:
+        effects.deleted.append(appointment_id)
+        effects.after.append(lambda: after_delete(appointment_id, current))
+    return {"message": "Appointment cancelled"}
+
+# Function to run one write in a transaction of its own
+async def write_alone(write):
+    async with db_session() as db:
+        rooms = set()
+        if write.kind == "update":
+            # Moving between rooms locks both, always in the same order
+            current = await db.fetchone("SELECT room_id FROM appointments WHERE id = %s", (write.appointment_id,))
+            if not current:
+                raise HTTPException(status_code=404, detail="Appointment not found")
+            rooms.add(current["room_id"])
+        if write.appointment is not None:
+            rooms.add(write.appointment.room_id)
+        rooms.discard(None)
+        async with AsyncExitStack() as stack:
+            for room_id in sorted(rooms):
+                await stack.enter_async_context(interval_index.lock(room_id))
+            if write.appointment is not None:
+                await check_index(db, write.appointment.room_id, write.start, write.end, write.appointment_id)
+            await db.begin()
+            await lock_rooms(db, rooms)
+            effects = WriteEffects()
+            result = await apply_write(db, write, effects)
+            await commit_writes(db, effects)
+    return result
+
+# Errors after which InnoDB has rolled back the whole transaction
+RETRYABLE_ERRORS = (1205, 1213)    # lock wait timeout, deadlock
+
+# Function to write a batch in one transaction. Every write runs under its own
+# savepoint, so a conflict or bad value only fails that write. Rooms and then
+# appointment rows are locked up front in id order, the same order the other
+# write paths use, and versions are reserved last.
+async def apply_write_batch(writes):
+    results = [None] * len(writes)
+    session = await acquire_session()
+    broken = False
+    try:
+        db = session
+        ids = sorted({w.appointment_id for w in writes if w.appointment_id is not None})
+        id_list = ", ".join(["%s"] * len(ids))
+        current = {}
+        if ids:
+            rows = await db.fetchall(f"SELECT id, room_id FROM appointments WHERE id IN ({id_list})", ids)
+            current = {row["id"]: row["room_id"] for row in rows}
+        rooms = {w.appointment.room_id for w in writes if w.appointment is not None}
+        rooms |= {current[w.appointment_id] for w in writes if w.kind == "update" and w.appointment_id in current}
+        rooms = sorted(r for r in rooms if r is not None)
+        async with AsyncExitStack() as stack:
+            for room_id in rooms:
+                await stack.enter_async_context(interval_index.lock(room_id))
+            await db.begin()
+            existing = set()
+            if rooms:
+                placeholders = ", ".join(["%s"] * len(rooms))
+                rows = await db.fetchall(
+                    f"SELECT id FROM rooms WHERE id IN ({placeholders}) ORDER BY id FOR UPDATE", rooms
+                )
+                existing = {row["id"] for row in rows}
+            if ids:
+                await db.fetchall(f"SELECT id FROM appointments WHERE id IN ({id_list}) ORDER BY id FOR UPDATE", ids)
+
+            effects = WriteEffects()
+            for i, write in enumerate(writes):
+                item = WriteEffects()
+                await db.execute("SAVEPOINT group_item")
+                try:
+                    if write.appointment is not None:
+                        if write.appointment.room_id not in existing:
+                            raise HTTPException(status_code=404, detail="Room not found")
+                        await check_index(db, write.appointment.room_id, write.start, write.end, write.appointment_id)
+                    results[i] = await apply_write(db, write, item)
+                except HTTPException as e:
+                    results[i] = e
+                except pymysql.MySQLError as e:
+                    if is_disconnect(e) or (e.args and e.args[0] in RETRYABLE_ERRORS):
+                        raise
+                    results[i] = HTTPException(status_code=400, detail=str(e.args[-1]))
+                if isinstance(results[i], HTTPException):
+                    await db.execute("ROLLBACK TO SAVEPOINT group_item")
+                else:
+                    effects.extend(item)
+            await commit_writes(db, effects)
+    except pymysql.MySQLError as e:
+        broken = is_disconnect(e)
+        raise
+    finally:
+        await release_session(session, broken=broken)
+    return results
+
+# Function to write a batch, falling back to one transaction per write when
+# the batch transaction was rolled back
+async def write_batch(writes):
+    try:
+        return await apply_write_batch(writes)
+    except pymysql.MySQLError as e:
+        if not (e.args and e.args[0] in RETRYABLE_ERRORS):
+            print(f"Database error: {e}")
+            return [HTTPException(status_code=500, detail="Database error")] * len(writes)
+    # The batch was rolled back as a whole; give every write its own transaction
+    group_commit_fallbacks_total.inc()
+    results = []
+    for write in writes:
+        try:
+            results.append(await write_alone(write))
+        except HTTPException as e:
+            results.append(e)
+    return results
+
+# Flush callback of the group committer. It runs in the committer's task, where
+# note_write has no request to report to, so each successful result goes back
+# paired with the change version the batch committed.
+async def flush_appointment_writes(writes):
+    # Its statements count towards the write latency like those of write_alone
+    with capture_writes() as written, measuring(limiters["write"]):
+        results = await write_batch(writes)
+    return [r if isinstance(r, BaseException) else (r, written[0]) for r in results]
+
+def observe_group_commit(size, queued_seconds):
+    group_commit_batch_size.observe(size)
+    group_commit_queue_seconds.observe(queued_seconds)
+
+group_committer = GroupCommitter(
+    flush_appointment_writes,
+    max_batch=GROUP_COMMIT_MAX_BATCH,
+    max_delay=GROUP_COMMIT_MAX_DELAY_MS / 1000,
+    on_batch=observe_group_commit,
+)
+
+async def submit_write(write):
+    if GROUP_COMMIT:
+        result, version = await group_committer.submit(write)
+        # Back in the request's context: the read-your-writes cookie sees it
+        note_write(version)
+        return result
+    return await write_alone(write)
+
+@app.get("/appointments/group-commit/stats")
+async def get_group_commit_stats():
+    return dict(group_committer.stats(), enabled=GROUP_COMMIT)
+
 # APPOINTMENT FUNCTIONS
 @app.post("/appointments")
-def create_appointment(appointment: Appointment):
-    connection = dbconnect()
-    if connection:
-        with connection.cursor() as cursor:
-            sql = """
-                INSERT INTO appointments (user_id, room_id, start_time, end_time, purpose) 
-                VALUES (%s, %s, %s, %s, %s)
+async def create_appointment(appointment: Appointment):
+    return await submit_write(AppointmentWrite("create", appointment=appointment))
+
+# Create many appointments in one transaction. Conflicts are checked against the
+# locked rooms' bookings and against earlier items of the same batch.
+@app.post("/appointments/batch")
+async def create_appointments_batch(appointments: List[Appointment], atomic: bool = True, db=Depends(get_db)):
+    check_batch_size(appointments)
+    results = [None] * len(appointments)
+    windows = {}
+    for i, appointment in enumerate(appointments):
+        start, end = naive(appointment.start_time), naive(appointment.end_time)
+        if end <= start:
+            results[i] = batch_item_error(i, "invalid", "end_time must be after start_time")
+        else:
+            windows[i] = (start, end)
+
+    room_ids = sorted({appointments[i].room_id for i in windows})
+    async with AsyncExitStack() as stack:
+        for room_id in room_ids:
+            await stack.enter_async_context(interval_index.lock(room_id))
+        await db.begin()
+        placeholders = ", ".join(["%s"] * len(room_ids)) or "NULL"
+        rows = await db.fetchall(
+            f"SELECT id FROM rooms WHERE id IN ({placeholders}) ORDER BY id FOR UPDATE", room_ids
+        )
+        existing_rooms = {row["id"] for row in rows}
+
+        # Bookings of the locked rooms within the batch's overall window
+        booked = {room_id: RoomIntervals() for room_id in existing_rooms}
+        series_by_room = {}
+        if windows and existing_rooms:
+            sql = f"""
+                SELECT id, room_id, start_time, end_time FROM appointments
+                WHERE room_id IN ({placeholders}) AND start_time < %s AND end_time > %s AND status <> 'cancelled'
+                LOCK IN SHARE MODE
             """
-            cursor.execute(sql, (appointment.user_id, appointment.room_id, appointment.start_time, appointment.end_time, appointment.purpose))
-            connection.commit()
-        connection.close()
-    return {"message": "Appointment created successfully"}
+            first_start = min(start for start, _ in windows.values())
+            last_end = max(end for _, end in windows.values())
+            for row in await db.fetchall(sql, room_ids + [last_end, first_start]):
+                booked[row["room_id"]].add(row["id"], row["start_time"], row["end_time"])
+            where = (
+                f"room_id IN ({placeholders}) AND status <> 'cancelled' "
+                "AND start_time < %s AND (series_end IS NULL OR series_end > %s)"
+            )
+            for series in await load_series(db, where, room_ids + [last_end, first_start], " LOCK IN SHARE MODE"):
+                series_by_room.setdefault(series.room_id, []).append(series)
+
+        pending = []
+        for i, (start, end) in windows.items():
+            room_id = appointments[i].room_id
+            if room_id not in existing_rooms:
+                results[i] = batch_item_error(i, "not_found", "Room not found")
+                continue
+            hit = booked[room_id].find_conflict(start, end)
+            if hit is not None:
+                # Negative ids are earlier items of this batch
+                other = f"batch item {-hit - 1}" if hit < 0 else f"appointment {hit}"
+                results[i] = batch_item_error(i, "conflict", f"Room is already booked for this time ({other})")
+                continue
+            hit = series_conflict(series_by_room.get(room_id, ()), start, end)
+            if hit is not None:
+                results[i] = batch_item_error(i, "conflict", series_booking_conflict(*hit).detail)
+                continue
+            booked[room_id].add(-i - 1, start, end)
+            pending.append(i)
+
+        if atomic and any(results):
+            batch_response([r for r in results if r], atomic)
+
+        sql = """
+            INSERT INTO appointments (user_id, room_id, start_time, end_time, purpose)
+            VALUES (%s, %s, %s, %s, %s)
+        """
+        rows = [
+            (appointments[i].user_id, appointments[i].room_id, *windows[i], appointments[i].purpose)
+            for i in pending
+        ]
+        inserted = await insert_rows(db, "appointments", sql, rows, atomic)
+        await stamp_versions(db, "appointments", inserted_ids(inserted))
+        await db.commit()
+        for i, (new_id, error) in zip(pending, inserted):
+            if error is None:
+                results[i] = {"index": i, "status": "created", "id": new_id}
+                interval_index.add(appointments[i].room_id, new_id, *windows[i])
+            else:
+                results[i] = batch_item_error(i, "error", error)
+    created = [i for i, (new_id, error) in zip(pending, inserted) if error is None]
+    if created:
+        invalidate_utilization(min(windows[i][0] for i in created), max(windows[i][1] for i in created))
+    publish_change(
+        "appointments", "created", inserted_ids(inserted),
+        [appointments[i].room_id for i in created], [appointments[i].user_id for i in created],
+    )
+    return batch_response(results, atomic)
+
+# Delete many appointments with a single statement in one transaction
+@app.delete("/appointments/batch")
+async def delete_appointments_batch(ids: List[int] = Body(...), atomic: bool = True, db=Depends(get_db)):
+    check_batch_size(ids)
+    unique_ids = sorted(set(ids))
+    placeholders = ", ".join(["%s"] * len(unique_ids))
+    await db.begin()
+    rows = await db.fetchall(
+        f"SELECT id, room_id, user_id, start_time, end_time FROM appointments WHERE id IN ({placeholders}) FOR UPDATE",
+        unique_ids,
+    )
+    found = {row["id"]: row["room_id"] for row in rows}
+    results = [
+        {"index": i, "status": "deleted", "id": appointment_id} if appointment_id in found
+        else batch_item_error(i, "not_found", f"Appointment {appointment_id} not found")
+        for i, appointment_id in enumerate(ids)
+    ]
+    if atomic and len(found) < len(unique_ids):
+        batch_response(results, atomic)
+    if found:
+        placeholders = ", ".join(["%s"] * len(found))
+        await db.execute(f"DELETE FROM appointments WHERE id IN ({placeholders})", list(found))
+        await record_deletes(db, "appointments", list(found))
+    await db.commit()
+    for appointment_id, room_id in found.items():
+        interval_index.remove(room_id, appointment_id)
+    if found:
+        invalidate_utilization(min(row["start_time"] for row in rows), max(row["end_time"] for row in rows))
+    publish_change("appointments", "deleted", list(found), found.values(), [row["user_id"] for row in rows])
+    return batch_response(results, atomic)
+
+# Update many appointments in one transaction. Items are checked in order, each
+# against the locked rooms' bookings as earlier items of the batch left them.
+@app.patch("/appointments/batch")
+async def update_appointments_batch(updates: List[AppointmentUpdate], atomic: bool = True, db=Depends(get_db)):
+    check_batch_size(updates)
+    results = [None] * len(updates)
+    windows = {}
+    seen = set()
+    for i, update in enumerate(updates):
+        start, end = naive(update.start_time), naive(update.end_time)
+        if end <= start:
+            results[i] = batch_item_error(i, "invalid", "end_time must be after start_time")
+        elif update.id in seen:
+            results[i] = batch_item_error(i, "invalid", f"Appointment {update.id} is listed more than once")
+        else:
+            windows[i] = (start, end)
+        seen.add(update.id)
+
+    ids = sorted({updates[i].id for i in windows})
+    id_list = ", ".join(["%s"] * len(ids)) or "NULL"
+    # Moving between rooms locks both, always in the same order
+    rows = await db.fetchall(f"SELECT id, room_id FROM appointments WHERE id IN ({id_list})", ids)
+    room_ids = sorted({updates[i].room_id for i in windows} | {row["room_id"] for row in rows})
+    async with AsyncExitStack() as stack:
+        for room_id in room_ids:
+            await stack.enter_async_context(interval_index.lock(room_id))
+        await db.begin()
+        placeholders = ", ".join(["%s"] * len(room_ids)) or "NULL"
+        rows = await db.fetchall(
+            f"SELECT id FROM rooms WHERE id IN ({placeholders}) ORDER BY id FOR UPDATE", room_ids
+        )
+        existing_rooms = {row["id"] for row in rows}
+        rows = await db.fetchall(
+            f"SELECT id, room_id, user_id, start_time, end_time FROM appointments WHERE id IN ({id_list}) "
+            "ORDER BY id FOR UPDATE",
+            ids,
+        )
+        current = {row["id"]: row for row in rows}
+
+        # Bookings of the locked rooms within the batch's overall window
+        booked = {room_id: RoomIntervals() for room_id in existing_rooms}
+        series_by_room = {}
+        if windows and existing_rooms:
+            sql = f"""
+                SELECT id, room_id, start_time, end_time FROM appointments
+                WHERE room_id IN ({placeholders}) AND start_time < %s AND end_time > %s AND status <> 'cancelled'
+                LOCK IN SHARE MODE
+            """
+            first_start = min(start for start, _ in windows.values())
+            last_end = max(end for _, end in windows.values())
+            for row in await db.fetchall(sql, room_ids + [last_end, first_start]):
+                booked[row["room_id"]].add(row["id"], row["start_time"], row["end_time"])
+            where = (
+                f"room_id IN ({placeholders}) AND status <> 'cancelled' "
+                "AND start_time < %s AND (series_end IS NULL OR series_end > %s)"
+            )
+            for series in await load_series(db, where, room_ids + [last_end, first_start], " LOCK IN SHARE MODE"):
+                series_by_room.setdefault(series.room_id, []).append(series)
+
+        pending = []
+        for i, (start, end) in windows.items():
+            update = updates[i]
+            if update.id not in current:
+                results[i] = batch_item_error(i, "not_found", f"Appointment {update.id} not found")
+                continue
+            if update.room_id not in existing_rooms:
+                results[i] = batch_item_error(i, "not_found", "Room not found")
+                continue
+            hit = booked[update.room_id].find_conflict(start, end, ignore_id=update.id)
+            if hit is not None:
+                results[i] = batch_item_error(i, "conflict", f"Room is already booked for this time (appointment {hit})")
+                continue
+            hit = series_conflict(series_by_room.get(update.room_id, ()), start, end)
+            if hit is not None:
+                results[i] = batch_item_error(i, "conflict", series_booking_conflict(*hit).detail)
+                continue
+            old_room = current[update.id]["room_id"]
+            if old_room in booked:
+                booked[old_room].remove(update.id)
+            booked[update.room_id].add(update.id, start, end)
+            pending.append(i)
+
+        if atomic and any(results):
+            batch_response([r for r in results if r], atomic)
+
+        sql = """
+            UPDATE appointments
+            SET user_id = %s, room_id = %s, start_time = %s, end_time = %s, purpose = %s
+            WHERE id = %s
+        """
+        rows = [
+            (updates[i].user_id, updates[i].room_id, *windows[i], updates[i].purpose, updates[i].id)
+            for i in pending
+        ]
+        errors = await update_rows(db, sql, rows, atomic)
+        updated = [i for i, error in zip(pending, errors) if error is None]
+        await stamp_versions(db, "appointments", [updates[i].id for i in updated])
+        await db.commit()
+        for i, error in zip(pending, errors):
+            if error is None:
+                results[i] = {"index": i, "status": "updated", "id": updates[i].id}
+                interval_index.remove(current[updates[i].id]["room_id"], updates[i].id)
+                interval_index.add(updates[i].room_id, updates[i].id, *windows[i])
+            else:
+                results[i] = batch_item_error(i, "error", error)
+    if updated:
+        before = [current[updates[i].id] for i in updated]
+        invalidate_utilization(
+            min([row["start_time"] for row in before] + [windows[i][0] for i in updated]),
+            max([row["end_time"] for row in before] + [windows[i][1] for i in updated]),
+        )
+    publish_change(
+        "appointments", "updated", [updates[i].id for i in updated],
+        [current[updates[i].id]["room_id"] for i in updated] + [updates[i].room_id for i in updated],
+        [current[updates[i].id]["user_id"] for i in updated] + [updates[i].user_id for i in updated],
+    )
+    return batch_response(results, atomic)
 
 @app.get("/appointments")
-def get_all_appointments():
-    connection = dbconnect()
-    if connection:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT * FROM appointments")
-            appointments = cursor.fetchall()
-        connection.close()
-        return appointments
+async def get_all_appointments(
+    request: Request,
+    response: Response,
+    after_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1),
+    room_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    status: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    db=Depends(get_db),
+):
+    expand = parse_expand(expand)
+    columns = expand_columns(select_columns(fields, APPOINTMENT_COLUMNS), expand)
+    # start/end select appointments overlapping the [start, end) window
+    filters = [
+        ("room_id = %s", room_id),
+        ("user_id = %s", user_id),
+        ("status = %s", status),
+        ("end_time > %s", start),
+        ("start_time < %s", end),
+    ]
+    rows = await fetch_page(db, response, "appointments", columns, filters, after_id, limit)
+    # With a bounded window the first page also lists recurring occurrences
+    if start is not None and end is not None and after_id is None:
+        rows += await expand_occurrences(db, response, columns, room_id, user_id, status, start, end, limit)
+    await expand_related(db, rows, expand)
+    return negotiated(request, rows, response)
+
+# Function to expand the occurrences of matching series inside [start, end),
+# merged in start order and cut off at limit. They carry id None plus the
+# series_id and occurrence_start needed to edit them.
+async def expand_occurrences(db, response, columns, room_id, user_id, status, start, end, limit):
+    start, end = naive(start), naive(end)
+    where = ["start_time < %s", "(series_end IS NULL OR series_end > %s)"]
+    args = [end, start]
+    for condition, value in (("room_id = %s", room_id), ("user_id = %s", user_id), ("status = %s", status)):
+        if value is not None:
+            where.append(condition)
+            args.append(value)
+    if status is None:
+        where.append("status <> 'cancelled'")
+    series_list = await load_series(db, " AND ".join(where), args)
+    merged = heapq.merge(
+        *[((o_start, o_end, slot, series) for o_start, o_end, slot in series.occurrences(start, end))
+          for series in series_list],
+        key=lambda occurrence: occurrence[0],
+    )
+    limit = min(limit, MAX_PAGE_SIZE)
+    occurrences = list(islice(merged, limit + 1))
+    if len(occurrences) > limit:
+        response.headers["X-Occurrences-Truncated"] = "true"
+        occurrences = occurrences[:limit]
+    results = []
+    for o_start, o_end, slot, series in occurrences:
+        record = {
+            "id": None, "user_id": series.user_id, "room_id": series.room_id, "start_time": o_start,
+            "end_time": o_end, "purpose": series.purpose_at(slot), "status": series.status,
+        }
+        results.append({
+            **{column: record[column] for column in columns},
+            "series_id": series.id, "occurrence_start": slot,
+        })
+    return results
+
+# Export formats by name and media type
+EXPORT_FORMATS = {"ndjson": formats.NDJSON, "csv": formats.CSV, "msgpack": formats.MSGPACK}
+
+# Function to encode one batch of rows for the export stream. ndjson and msgpack
+# write one record per row: an object, or in columnar shape an array of values.
+def encode_export_rows(rows, fmt, columnar=False):
+    if fmt in ("ndjson", "msgpack"):
+        records = [list(row.values()) for row in rows] if columnar else rows
+        if fmt == "msgpack":
+            return b"".join(formats.dumps_msgpack(record) for record in records)
+        return b"".join(formats.dumps_json(record) + b"\n" for record in records)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([v.isoformat() if isinstance(v, (datetime, date)) else v for v in row.values()])
+    return buffer.getvalue().encode()
+
+# Generator behind the export response. It owns the session and releases it
+# however the stream ends, including a client disconnecting half way.
+async def export_chunks(session, fmt, columnar, sql, args):
+    try:
+        if fmt == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerow(APPOINTMENT_COLUMNS)
+            yield buffer.getvalue().encode()
+        elif columnar:
+            # The columnar shape starts with one record naming the columns
+            yield encode_export_rows([dict(zip(APPOINTMENT_COLUMNS, APPOINTMENT_COLUMNS))], fmt, True)
+        else:
+            yield b""
+        async for rows in session.stream(sql, args, EXPORT_BATCH_SIZE):
+            yield encode_export_rows(rows, fmt, columnar)
+    finally:
+        await release_session(session)
+
+async def prepend_chunk(first, rest):
+    yield first
+    async for chunk in rest:
+        yield chunk
+
+# Export appointments without buffering the table: rows come off an unbuffered
+# server-side cursor and are written out batch by batch
+@app.get("/appointments/export")
+async def export_appointments(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv|msgpack)$"),
+    since: Optional[datetime] = None,
+):
+    # ?format= wins over the Accept header; without either ndjson is sent
+    if format is None:
+        media_type, columnar = response_format(request, tuple(EXPORT_FORMATS.values()))
+        format = next(name for name, m in EXPORT_FORMATS.items() if m == media_type)
+    else:
+        if format == "msgpack" and formats.msgpack is None:
+            raise HTTPException(status_code=406, detail="MessagePack is not available on this server")
+        media_type, columnar = formats.negotiate(request.headers.get("accept"), (EXPORT_FORMATS[format],)) or (
+            EXPORT_FORMATS[format], False
+        )
+    sql = f"SELECT {', '.join(APPOINTMENT_COLUMNS)} FROM appointments"
+    args = []
+    if since is not None:
+        sql += " WHERE start_time >= %s"
+        args.append(since)
+    sql += " ORDER BY id"
+
+    # The session is acquired here rather than through get_db: it has to stay
+    # checked out until the last chunk is sent, after the handler has returned
+    session = await acquire_session(read=True, min_version=read_min_version(request))
+
+    chunks = export_chunks(session, format, columnar, sql, args)
+    # Enter the generator now so its finally clause runs even if the response is never iterated
+    first = await chunks.__anext__()
+    headers = {"Content-Disposition": f'attachment; filename="appointments.{format}"'}
+    return StreamingResponse(prepend_chunk(first, chunks), media_type=media_type, headers=headers)
+
+# RECURRING APPOINTMENTS
+# A series is stored as one rule row; occurrences are expanded on demand. Moved
+# and cancelled occurrences are rows in recurrence_exceptions keyed by their slot
+# (the start time the rule gives them).
+
+# Function to load one series with its exceptions or fail with 404
+async def get_series(db, series_id, lock=""):
+    series_list = await load_series(db, "id = %s", (series_id,), lock)
+    if not series_list:
+        raise HTTPException(status_code=404, detail="Recurring appointment not found")
+    return series_list[0]
+
+def check_slot(series, occurrence_start):
+    slot = naive(occurrence_start)
+    if not series.has_slot(slot):
+        raise HTTPException(status_code=404, detail=f"No occurrence starts at {slot.isoformat()} in this series")
+    return slot
+
+# Create a recurring appointment. Its occurrences are checked against single
+# appointments and other series up to its end, or RECURRENCE_CHECK_DAYS ahead
+# for an open-ended series; later clashes are caught when the other booking is made.
+@app.post("/appointments/recurring")
+async def create_recurring_appointment(appointment: RecurringAppointment, db=Depends(get_db)):
+    start, end = booking_window(appointment)
+    room_id = appointment.room_id
+    try:
+        series = Series(
+            None, room_id, appointment.user_id, start, end, appointment.purpose,
+            appointment.freq, appointment.interval, appointment.until, appointment.count,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    for exdate in appointment.exdates:
+        slot = naive(exdate)
+        # Bad input here, unlike the 404 of the per-occurrence endpoints
+        if not series.has_slot(slot):
+            raise HTTPException(status_code=400, detail=f"exdate {slot.isoformat()} is not an occurrence of this series")
+        series.exceptions[slot] = None
+    series_end = series.series_end
+    check_end = series_end or start + timedelta(days=RECURRENCE_CHECK_DAYS)
+
+    async with interval_index.lock(room_id):
+        await db.begin()
+        await lock_rooms(db, [room_id])
+        booked = RoomIntervals()
+        rows = await db.fetchall(
+            """
+            SELECT id, start_time, end_time FROM appointments
+            WHERE room_id = %s AND start_time < %s AND end_time > %s AND status <> 'cancelled'
+            LOCK IN SHARE MODE
+            """,
+            (room_id, check_end, start),
+        )
+        for row in rows:
+            booked.add(row["id"], row["start_time"], row["end_time"])
+        others = await room_series(db, room_id, start, check_end, " LOCK IN SHARE MODE")
+        for occurrence_start, occurrence_end, _ in series.occurrences(start, check_end):
+            hit = booked.find_conflict(occurrence_start, occurrence_end)
+            if hit is not None:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Occurrence at {occurrence_start.isoformat()} clashes with appointment {hit}",
+                )
+            hit = series_conflict(others, occurrence_start, occurrence_end)
+            if hit is not None:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Occurrence at {occurrence_start.isoformat()} clashes with recurring "
+                           f"appointment {hit[0]} at {hit[1].isoformat()}",
+                )
+        sql = """
+            INSERT INTO recurring_appointments
+                (user_id, room_id, start_time, end_time, purpose, freq, interval_count, until_time,
+                 occurrence_count, series_end)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """
+        result = await db.execute(sql, (
+            appointment.user_id, room_id, start, end, appointment.purpose, series.freq,
+            series.interval, series.until, series.count, series_end,
+        ))
+        series.id = result.lastrowid
+        if series.exceptions:
+            await db.executemany(
+                "INSERT INTO recurrence_exceptions (series_id, occurrence_start, cancelled) VALUES (%s, %s, TRUE)",
+                [(series.id, slot) for slot in series.exceptions],
+            )
+        await stamp_versions(db, "recurring_appointments", [series.id])
+        await db.commit()
+    series_index.put(series)
+    invalidate_utilization(start, series_end)
+    publish_change("recurring_appointments", "created", [series.id], [room_id], [appointment.user_id])
+    return {"message": "Recurring appointment created successfully", "id": series.id, "series_end": series_end}
+
+@app.get("/appointments/recurring")
+async def get_all_recurring_appointments(
+    request: Request,
+    response: Response,
+    after_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1),
+    room_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    db=Depends(get_db),
+):
+    filters = [("room_id = %s", room_id), ("user_id = %s", user_id)]
+    rows = await fetch_page(db, response, "recurring_appointments", RECURRING_COLUMNS, filters, after_id, limit)
+    return negotiated(request, rows, response)
+
+@app.get("/appointments/recurring/{series_id}")
+async def get_recurring_appointment(series_id: int, db=Depends(get_db)):
+    series = await db.fetchone(
+        f"SELECT {', '.join(RECURRING_COLUMNS)} FROM recurring_appointments WHERE id = %s", (series_id,)
+    )
+    if not series:
+        raise HTTPException(status_code=404, detail="Recurring appointment not found")
+    series["exceptions"] = await db.fetchall(
+        """
+        SELECT occurrence_start, cancelled, start_time, end_time, purpose
+        FROM recurrence_exceptions WHERE series_id = %s ORDER BY occurrence_start
+        """,
+        (series_id,),
+    )
+    return series
+
+@app.delete("/appointments/recurring/{series_id}")
+async def delete_recurring_appointment(series_id: int, db=Depends(get_db)):
+    await db.begin()
+    current = await db.fetchone(
+        "SELECT room_id, user_id, start_time, series_end FROM recurring_appointments WHERE id = %s FOR UPDATE",
+        (series_id,),
+    )
+    if not current:
+        raise HTTPException(status_code=404, detail="Recurring appointment not found")
+    await db.execute("DELETE FROM recurring_appointments WHERE id = %s", (series_id,))
+    await record_deletes(db, "recurring_appointments", [series_id])
+    await db.commit()
+    series_index.discard(series_id)
+    invalidate_utilization(current["start_time"], current["series_end"])
+    publish_change("recurring_appointments", "deleted", [series_id], [current["room_id"]], [current["user_id"]])
+    return {"message": "Recurring appointment deleted"}
+
+# Move or edit a single occurrence, identified by the start the rule gives it.
+# Also restores a cancelled occurrence.
+@app.put("/appointments/recurring/{series_id}/occurrences/{occurrence_start}")
+async def update_occurrence(series_id: int, occurrence_start: datetime, override: OccurrenceOverride, db=Depends(get_db)):
+    start, end = booking_window(override)
+    current = await db.fetchone("SELECT room_id FROM recurring_appointments WHERE id = %s", (series_id,))
+    if not current:
+        raise HTTPException(status_code=404, detail="Recurring appointment not found")
+    room_id = current["room_id"]
+    async with interval_index.lock(room_id):
+        await check_index(db, room_id, start, end)
+        await db.begin()
+        await lock_rooms(db, [room_id])
+        series = await get_series(db, series_id, " FOR UPDATE")
+        slot = check_slot(series, occurrence_start)
+        await check_database(db, room_id, start, end, ignore_slot=(series_id, slot))
+        sql = """
+            INSERT INTO recurrence_exceptions (series_id, occurrence_start, cancelled, start_time, end_time, purpose)
+            VALUES (%s, %s, FALSE, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE cancelled = FALSE, start_time = VALUES(start_time),
+                end_time = VALUES(end_time), purpose = VALUES(purpose)
+        """
+        await db.execute(sql, (series_id, slot, start, end, override.purpose))
+        series.exceptions[slot] = (start, end, override.purpose)
+        # A moved last occurrence can push the end of the series out
+        await db.execute(
+            "UPDATE recurring_appointments SET series_end = %s WHERE id = %s", (series.series_end, series_id)
+        )
+        await stamp_versions(db, "recurring_appointments", [series_id])
+        await db.commit()
+    series_index.put(series)
+    invalidate_utilization(slot, slot + series.duration)
+    invalidate_utilization(start, end)
+    publish_change("recurring_appointments", "updated", [series_id], [room_id], [series.user_id])
+    return {"message": "Occurrence updated successfully"}
+
+@app.delete("/appointments/recurring/{series_id}/occurrences/{occurrence_start}")
+async def cancel_occurrence(series_id: int, occurrence_start: datetime, db=Depends(get_db)):
+    await db.begin()
+    series = await get_series(db, series_id, " FOR UPDATE")
+    slot = check_slot(series, occurrence_start)
+    sql = """
+        INSERT INTO recurrence_exceptions (series_id, occurrence_start, cancelled)
+        VALUES (%s, %s, TRUE)
+        ON DUPLICATE KEY UPDATE cancelled = TRUE, start_time = NULL, end_time = NULL, purpose = NULL
+    """
+    await db.execute(sql, (series_id, slot))
+    series.exceptions[slot] = None
+    await stamp_versions(db, "recurring_appointments", [series_id])
+    await db.commit()
+    series_index.put(series)
+    invalidate_utilization(slot, slot + series.duration)
+    publish_change("recurring_appointments", "updated", [series_id], [series.room_id], [series.user_id])
+    return {"message": "Occurrence cancelled"}
 
 @app.get("/appointments/{appointment_id}")
-def get_appointment_by_id(appointment_id: int):
-    connection = dbconnect()
-    if connection:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT * FROM appointments WHERE id = %s", (appointment_id,))
-            appointment = cursor.fetchone()
-        connection.close()
-        if not appointment:
-            raise HTTPException(status_code=404, detail="Appointment not found")
-        return appointment
+async def get_appointment_by_id(appointment_id: int, expand: Optional[str] = None, db=Depends(get_db)):
+    expand = parse_expand(expand)
+    appointment = await db.fetchone(
+        f"SELECT {', '.join(APPOINTMENT_COLUMNS)} FROM appointments WHERE id = %s", (appointment_id,)
+    )
+    if not appointment:
+        raise HTTPException(status_code=404, detail="Appointment not found")
+    await expand_related(db, [appointment], expand)
+    return appointment
 
 @app.put("/appointments/{appointment_id}")
-def update_appointment(appointment_id: int, appointment: Appointment):
-    connection = dbconnect()
-    if connection:
-        with connection.cursor() as cursor:
-            sql = """
-                UPDATE appointments 
-                SET user_id = %s, room_id = %s, start_time = %s, end_time = %s, purpose = %s 
-                WHERE id = %s
-            """
-            cursor.execute(sql, (appointment.user_id, appointment.room_id, appointment.start_time, appointment.end_time, appointment.purpose, appointment_id))
-            connection.commit()
-        connection.close()
-    return {"message": "Appointment updated successfully"}
+async def update_appointment(appointment_id: int, appointment: Appointment):
+    return await submit_write(AppointmentWrite("update", appointment_id, appointment))
 
 @app.delete("/appointments/{appointment_id}")
-def cancel_appointment(appointment_id: int):
-    connection = dbconnect()
-    if connection:
-        with connection.cursor() as cursor:
-            cursor.execute("DELETE FROM appointments WHERE id = %s", (appointment_id,))
-            connection.commit()
-        connection.close()
-    return {"message": "Appointment cancelled"}
+async def cancel_appointment(appointment_id: int):
+    return await submit_write(AppointmentWrite("delete", appointment_id))
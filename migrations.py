@@ -0,0 +1,257 @@
+# Versioned schema migrations.
+#
+# Each migration is (version, description, steps); a step is either an SQL
+# string or a function taking a cursor. MySQL commits DDL implicitly, so steps
+# must be safe to re-run in case a migration is interrupted half way.
+#
+# Run manually with:  python migrations.py [status]
+import sys
+
+import pymysql
+from pymysql.constants import ER
+
+MIGRATION_LOCK = "room_scheduler_migrations"
+MIGRATION_LOCK_TIMEOUT = 60
+
+
+# Raised when another process held the migration lock for MIGRATION_LOCK_TIMEOUT seconds
+class MigrationLockTimeout(RuntimeError):
+    pass
+
+
+# Function to add an index unless it already exists (MySQL has no CREATE INDEX IF NOT EXISTS)
+def add_index(table, index_name, columns, kind="INDEX"):
+    def step(cursor):
+        cursor.execute(
+            "SELECT 1 FROM information_schema.statistics "
+            "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1",
+            (table, index_name),
+        )
+        if not cursor.fetchone():
+            cursor.execute(f"ALTER TABLE {table} ADD {kind} {index_name} ({columns})")
+    step.__name__ = f"add_index_{index_name}"
+    return step
+
+
+# Function to add a column unless it already exists
+def add_column(table, column, definition):
+    def step(cursor):
+        cursor.execute(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s LIMIT 1",
+            (table, column),
+        )
+        if not cursor.fetchone():
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    step.__name__ = f"add_column_{table}_{column}"
+    return step
+
+
+MIGRATIONS = [
+    (1, "Create rooms, users and appointments tables", [
+        """
+        CREATE TABLE IF NOT EXISTS rooms (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            location VARCHAR(255),
+            capacity INT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            email VARCHAR(255)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS appointments (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            room_id INT,
+            start_time DATETIME,
+            end_time DATETIME,
+            purpose VARCHAR(255),
+            status VARCHAR(50) DEFAULT 'scheduled',
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (room_id) REFERENCES rooms(id)
+        )
+        """,
+    ]),
+    (2, "Indexes for booking checks, time windows and list filters", [
+        # Overlap checks and per-room time windows
+        add_index("appointments", "idx_room_time", "room_id, start_time, end_time"),
+        # ?start=&end= windows and exports with ?since=
+        add_index("appointments", "idx_start_time", "start_time"),
+        add_index("appointments", "idx_user_time", "user_id, start_time"),
+        add_index("appointments", "idx_status", "status"),
+        add_index("rooms", "idx_capacity", "capacity"),
+        add_index("rooms", "idx_location", "location"),
+    ]),
+    (3, "Change tracking for GET /changes: row versions, tombstones and the version sequence", [
+        *[
+            step
+            for table in ("users", "rooms", "appointments")
+            for step in (
+                add_column(table, "version", "BIGINT NOT NULL DEFAULT 0"),
+                add_column(
+                    table, "updated_at",
+                    "DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)",
+                ),
+                add_index(table, "idx_version", "version"),
+                # Existing rows get distinct versions so the first sync can page through them
+                f"UPDATE {table} SET version = id WHERE version = 0",
+            )
+        ],
+        """
+        CREATE TABLE IF NOT EXISTS tombstones (
+            version BIGINT PRIMARY KEY,
+            entity VARCHAR(32) NOT NULL,
+            entity_id INT NOT NULL,
+            deleted_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS change_seq (
+            id TINYINT PRIMARY KEY,
+            version BIGINT NOT NULL
+        )
+        """,
+        """
+        INSERT IGNORE INTO change_seq (id, version)
+        SELECT 1, GREATEST(
+            (SELECT COALESCE(MAX(id), 0) FROM users),
+            (SELECT COALESCE(MAX(id), 0) FROM rooms),
+            (SELECT COALESCE(MAX(id), 0) FROM appointments)
+        )
+        """,
+    ]),
+    (4, "Recurring appointments stored as rules with per-occurrence exceptions", [
+        # series_end is the end of the last occurrence (NULL when open-ended),
+        # so window queries can skip series that are already over
+        """
+        CREATE TABLE IF NOT EXISTS recurring_appointments (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            room_id INT,
+            start_time DATETIME NOT NULL,
+            end_time DATETIME NOT NULL,
+            purpose VARCHAR(255),
+            freq VARCHAR(10) NOT NULL,
+            interval_count INT NOT NULL DEFAULT 1,
+            until_time DATETIME NULL,
+            occurrence_count INT NULL,
+            series_end DATETIME NULL,
+            status VARCHAR(50) DEFAULT 'scheduled',
+            version BIGINT NOT NULL DEFAULT 0,
+            updated_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+            INDEX idx_room_span (room_id, start_time, series_end),
+            INDEX idx_user (user_id),
+            INDEX idx_version (version),
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (room_id) REFERENCES rooms(id)
+        )
+        """,
+        # One row per cancelled or overridden occurrence, keyed by the start the rule gives it
+        """
+        CREATE TABLE IF NOT EXISTS recurrence_exceptions (
+            series_id INT NOT NULL,
+            occurrence_start DATETIME NOT NULL,
+            cancelled BOOLEAN NOT NULL DEFAULT TRUE,
+            start_time DATETIME NULL,
+            end_time DATETIME NULL,
+            purpose VARCHAR(255) NULL,
+            PRIMARY KEY (series_id, occurrence_start),
+            FOREIGN KEY (series_id) REFERENCES recurring_appointments(id) ON DELETE CASCADE
+        )
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# Function returning the applied schema version, or None if the schema_version
+# table does not exist yet. This is the one query startup needs when up to date.
+def current_version(cursor):
+    try:
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+    except pymysql.err.ProgrammingError as e:
+        if e.args[0] == ER.NO_SUCH_TABLE:
+            return None
+        raise
+    return cursor.fetchone()[0] or 0
+
+
+def apply_pending(connection, log=print):
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        version = current_version(cursor)
+        for number, description, steps in MIGRATIONS:
+            if number <= version:
+                continue
+            log(f"Applying migration {number}: {description}")
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                (number, description),
+            )
+            connection.commit()
+
+
+# Bring the database up to LATEST_VERSION.
+#
+# With an up-to-date schema this is a single SELECT. Otherwise a named lock
+# makes sure only one of several workers booting together runs the DDL; the
+# others wait for it and then see the new version.
+def migrate(host, user, password, database, log=print):
+    try:
+        connection = pymysql.connect(host=host, user=user, password=password, database=database)
+    except pymysql.err.OperationalError as e:
+        if e.args[0] != ER.BAD_DB_ERROR:
+            raise
+        server = pymysql.connect(host=host, user=user, password=password)
+        try:
+            with server.cursor() as cursor:
+                cursor.execute(f"CREATE DATABASE IF NOT EXISTS {database}")
+        finally:
+            server.close()
+        connection = pymysql.connect(host=host, user=user, password=password, database=database)
+
+    try:
+        with connection.cursor() as cursor:
+            if current_version(cursor) == LATEST_VERSION:
+                return LATEST_VERSION
+            cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK, MIGRATION_LOCK_TIMEOUT))
+            if cursor.fetchone()[0] != 1:
+                raise MigrationLockTimeout("Timed out waiting for another process to finish migrations")
+        try:
+            apply_pending(connection, log)
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+        return LATEST_VERSION
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    from main import DB_HOST, DB_USER, DB_PASSWORD, DB_NAME
+
+    if sys.argv[1:] == ["status"]:
+        connection = pymysql.connect(host=DB_HOST, user=DB_USER, password=DB_PASSWORD, database=DB_NAME)
+        with connection.cursor() as cursor:
+            print(f"Schema version {current_version(cursor)}, latest {LATEST_VERSION}")
+        connection.close()
+    else:
+        print(f"Schema at version {migrate(DB_HOST, DB_USER, DB_PASSWORD, DB_NAME)}")
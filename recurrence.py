@@ -0,0 +1,189 @@
+import calendar
+import heapq
+import time
+from datetime import timedelta
+
+from interval_index import naive
+
+FREQUENCIES = ("daily", "weekly", "monthly")
+
+
+# Function to move a datetime by a number of months, clamping the day to the
+# length of the target month (Jan 31 + 1 month = Feb 28/29)
+def add_months(value, months):
+    month_index = value.month - 1 + months
+    year, month = value.year + month_index // 12, month_index % 12 + 1
+    day = min(value.day, calendar.monthrange(year, month)[1])
+    return value.replace(year=year, month=month, day=day)
+
+
+# A recurring appointment: its rule plus per-occurrence exceptions.
+#
+# Occurrences are never stored. occurrences(start, end) expands only the part
+# of the series overlapping a window and jumps straight to the first candidate,
+# so a years-long daily series costs no more to check than a one-week one.
+#
+# An occurrence is identified by its slot, the start the rule gives it.
+# exceptions maps a slot to None when that occurrence is cancelled, or to a
+# (start, end, purpose) override when it was moved or edited.
+class Series:
+    def __init__(self, id, room_id, user_id, start, end, purpose, freq, interval=1,
+                 until=None, count=None, status="scheduled", exceptions=None):
+        if freq not in FREQUENCIES:
+            raise ValueError(f"freq must be one of {', '.join(FREQUENCIES)}")
+        if interval < 1:
+            raise ValueError("interval must be at least 1")
+        if count is not None and count < 1:
+            raise ValueError("count must be at least 1")
+        if until is not None and naive(until) < naive(start):
+            raise ValueError("until must not be before start_time")
+        self.id = id
+        self.room_id = room_id
+        self.user_id = user_id
+        self.start = naive(start)
+        self.duration = naive(end) - self.start
+        if self.duration <= timedelta(0):
+            raise ValueError("end_time must be after start_time")
+        self.purpose = purpose
+        self.freq = freq
+        self.interval = interval
+        self.until = naive(until) if until is not None else None
+        self.count = count
+        self.status = status
+        self.exceptions = exceptions if exceptions is not None else {}
+        if freq == "daily":
+            self._step = timedelta(days=interval)
+        elif freq == "weekly":
+            self._step = timedelta(weeks=interval)
+        else:
+            self._step = None
+
+    def slot(self, n):
+        if self._step is not None:
+            return self.start + n * self._step
+        return add_months(self.start, n * self.interval)
+
+    def _index_at_or_before(self, value):
+        if value < self.start:
+            return -1
+        if self._step is not None:
+            return (value - self.start) // self._step
+        months = (value.year - self.start.year) * 12 + value.month - self.start.month
+        n = months // self.interval
+        return n if self.slot(n) <= value else n - 1
+
+    # Start of the last occurrence, or None for an open-ended series
+    @property
+    def last_slot(self):
+        last = None
+        if self.count is not None:
+            last = self.count - 1
+        if self.until is not None:
+            n = self._index_at_or_before(self.until)
+            last = n if last is None else min(last, n)
+        return None if last is None else self.slot(last)
+
+    # End of the series including moved occurrences, or None when open-ended
+    @property
+    def series_end(self):
+        last = self.last_slot
+        if last is None:
+            return None
+        ends = [last + self.duration]
+        ends.extend(o[1] for o in self.exceptions.values() if o is not None)
+        return max(ends)
+
+    # Rule slots whose occurrence overlaps [window_start, window_end), in order
+    def _slots(self, window_start, window_end):
+        n = max(0, self._index_at_or_before(window_start - self.duration))
+        while self.count is None or n < self.count:
+            slot = self.slot(n)
+            if slot >= window_end or (self.until is not None and slot > self.until):
+                return
+            if slot + self.duration > window_start:
+                yield slot
+            n += 1
+
+    def has_slot(self, slot):
+        return any(s == slot for s in self._slots(slot, slot + self.duration))
+
+    # Lazily yield (start, end, slot) for every occurrence overlapping
+    # [window_start, window_end), ordered by start
+    def occurrences(self, window_start, window_end):
+        window_start, window_end = naive(window_start), naive(window_end)
+        regular = (
+            (slot, slot + self.duration, slot)
+            for slot in self._slots(window_start, window_end)
+            if slot not in self.exceptions
+        )
+        moved = sorted(
+            (o[0], o[1], slot) for slot, o in self.exceptions.items()
+            if o is not None and o[0] < window_end and o[1] > window_start
+        )
+        return heapq.merge(regular, moved)
+
+    def purpose_at(self, slot):
+        override = self.exceptions.get(slot)
+        return override[2] if override is not None and override[2] is not None else self.purpose
+
+
+# Return (series id, occurrence start) of the first occurrence of any series
+# overlapping [start, end), or None. ignore is a (series id, slot) pair for
+# the occurrence being moved.
+def series_conflict(series_list, start, end, ignore=None):
+    for series in series_list:
+        for occurrence_start, _, slot in series.occurrences(start, end):
+            if ignore != (series.id, slot):
+                return series.id, occurrence_start
+    return None
+
+
+# Active series per room for the availability search. Like RoomCatalog it is
+# reloaded as a whole in the background and updated in place for writes made
+# by this worker, with writes made between start_reload() and load() applied
+# again on top of the loaded series.
+class SeriesIndex:
+    def __init__(self):
+        self.by_id = {}
+        self.by_room = {}
+        self.loaded_at = None
+        self._pending = None
+
+    def start_reload(self):
+        self._pending = []
+
+    def load(self, series_list):
+        pending, self._pending = self._pending or [], None
+        self.by_id = {}
+        self.by_room = {}
+        self.loaded_at = time.monotonic()
+        for series in series_list:
+            self.put(series)
+        for change, arg in pending:
+            change(arg)
+
+    def put(self, series):
+        if self._pending is not None:
+            self._pending.append((self.put, series))
+        if self.loaded_at is None:
+            return
+        self._remove(series.id)
+        self.by_id[series.id] = series
+        self.by_room.setdefault(series.room_id, []).append(series)
+
+    def discard(self, series_id):
+        if self._pending is not None:
+            self._pending.append((self.discard, series_id))
+        self._remove(series_id)
+
+    def _remove(self, series_id):
+        series = self.by_id.pop(series_id, None)
+        if series is not None:
+            room = self.by_room[series.room_id]
+            room.remove(series)
+            if not room:
+                del self.by_room[series.room_id]
+
+    def conflict(self, room_id, start, end):
+        series_list = self.by_room.get(room_id)
+        return series_conflict(series_list, start, end) if series_list else None
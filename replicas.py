@@ -0,0 +1,191 @@
+import asyncio
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import pymysql
+
+from db_pool import PoolExhausted, PoolConnectError
+
+# Highest change version written while handling the current request, as a
+# one-element list so writes made anywhere below the middleware are seen by it
+_written_version = ContextVar("written_version", default=None)
+
+
+# Function for the write path to record the change version it committed
+def note_write(version):
+    holder = _written_version.get()
+    if holder is not None and version > holder[0]:
+        holder[0] = version
+
+
+# Context manager collecting the highest change version written inside it,
+# as [version], for writes made outside a request's own task (the group
+# committer's flush task); the request then passes it on to note_write
+@contextmanager
+def capture_writes():
+    holder = [0]
+    token = _written_version.set(holder)
+    try:
+        yield holder
+    finally:
+        _written_version.reset(token)
+
+
+# One read replica with its own pool and the state of its last health check
+class Replica:
+    def __init__(self, name, database):
+        self.name = name
+        self.database = database
+        # Out of rotation until the first health check passes
+        self.healthy = False
+        # change_seq version the replica had applied at the last check
+        self.version = 0
+        self.lag = None
+        self.last_error = None
+        self.checked_at = None
+        self.failures = 0
+        self.reads = 0
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "version": self.version,
+            "lag_seconds": self.lag,
+            "failures": self.failures,
+            "reads": self.reads,
+            "last_error": self.last_error,
+            "pool": self.database.stats(),
+        }
+
+
+# Read replicas served round robin, with health checks in the background.
+#
+# Every check_interval seconds each replica is asked for its replication lag
+# (SHOW REPLICA STATUS) and for the change_seq version it has applied. A
+# replica that cannot be reached, whose replication is stopped or that lags
+# more than max_lag seconds is taken out of rotation until a check passes
+# again. The applied version is what read-your-writes routing compares against.
+class ReplicaSet:
+    def __init__(self, replicas, max_lag=5.0, check_interval=2.0):
+        self.replicas = list(replicas)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._next = itertools.count()
+        self._task = None
+
+    async def start(self):
+        for replica in self.replicas:
+            try:
+                await replica.database.start()
+            except PoolConnectError as e:
+                # Out of rotation for now; health checks keep trying, and both
+                # pool kinds connect on demand once the replica is reachable
+                self.mark_failed(replica, e)
+        await self.check_all()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        for replica in self.replicas:
+            await replica.database.close()
+
+    # Next healthy replica that has applied min_version, or None for the primary
+    def choose(self, min_version=0):
+        candidates = [r for r in self.replicas if r.healthy and r.version >= min_version]
+        if not candidates:
+            return None
+        replica = candidates[next(self._next) % len(candidates)]
+        replica.reads += 1
+        return replica
+
+    def mark_failed(self, replica, error):
+        replica.healthy = False
+        replica.failures += 1
+        replica.last_error = str(error)
+
+    async def check(self, replica):
+        try:
+            async with replica.database.session() as session:
+                row = await session.fetchone("SELECT version FROM change_seq WHERE id = 1")
+                status = await replication_status(session)
+        except (pymysql.MySQLError, PoolExhausted, PoolConnectError, OSError) as e:
+            self.mark_failed(replica, e)
+            return
+        replica.checked_at = time.monotonic()
+        replica.version = row["version"] if row else 0
+        if status is None:
+            # Not a replica or no privilege to ask; routed on version alone
+            replica.lag = None
+        else:
+            replica.lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+            if replica.lag is None:
+                self.mark_failed(replica, "Replication is not running")
+                return
+            if replica.lag > self.max_lag:
+                self.mark_failed(replica, f"Replication lag {replica.lag}s exceeds {self.max_lag}s")
+                return
+        replica.healthy = True
+        replica.last_error = None
+
+    async def check_all(self):
+        await asyncio.gather(*[
+            asyncio.wait_for(self.check(replica), self.check_interval + 1) for replica in self.replicas
+        ], return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.check_all()
+            except Exception as e:
+                print(f"Replica health check failed: {e}")
+
+    def stats(self):
+        return [replica.stats() for replica in self.replicas]
+
+
+# SHOW REPLICA STATUS exists from MySQL 8.0.22; older servers only know the SLAVE form
+async def replication_status(session):
+    for sql in ("SHOW REPLICA STATUS", "SHOW SLAVE STATUS"):
+        try:
+            return await session.fetchone(sql)
+        except pymysql.err.ProgrammingError:
+            continue
+        except pymysql.err.OperationalError as e:
+            # Missing REPLICATION CLIENT privilege
+            if e.args and e.args[0] in (1227, 1045):
+                return None
+            raise
+    return None
+
+
+# ASGI middleware giving clients that wrote a cookie with the change version
+# they wrote, valid for window seconds. While it is present, their reads go to
+# a replica that has applied that version, or to the primary.
+class ReadYourWritesMiddleware:
+    def __init__(self, app, cookie="ryw_version", window=10.0):
+        self.app = app
+        self.cookie = cookie
+        self.window = window
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        holder = [0]
+        token = _written_version.set(holder)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and holder[0] and message["status"] < 400:
+                cookie = f"{self.cookie}={holder[0]}; Max-Age={int(self.window)}; Path=/; HttpOnly; SameSite=Lax"
+                message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", cookie.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _written_version.reset(token)
@@ -0,0 +1,261 @@
+import heapq
+import re
+import time
+import unicodedata
+from bisect import bisect_left, bisect_right
+
+WORD_PATTERN = re.compile(r"\w+")
+# Sorts after every normalized string with the same prefix
+PREFIX_END = "\U0010ffff"
+
+
+# Function to fold case and accents so "José" is found by "jose"
+def normalize(text):
+    text = unicodedata.normalize("NFKD", str(text or "")).casefold()
+    if text.isascii():
+        return text
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# (text, id) pairs kept as two parallel lists sorted by text then id, so the
+# ids of every text starting with a prefix are one slice
+class SortedKeys:
+    __slots__ = ("keys", "ids")
+
+    def __init__(self, pairs=()):
+        pairs = sorted(set(pairs))
+        self.keys = [key for key, _ in pairs]
+        self.ids = [record_id for _, record_id in pairs]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _find(self, key, record_id):
+        i = bisect_left(self.keys, key)
+        hi = bisect_right(self.keys, key, i)
+        return bisect_left(self.ids, record_id, i, hi), hi
+
+    def add(self, key, record_id):
+        i, hi = self._find(key, record_id)
+        if i == hi or self.ids[i] != record_id:
+            self.keys.insert(i, key)
+            self.ids.insert(i, record_id)
+
+    def remove(self, key, record_id):
+        i, hi = self._find(key, record_id)
+        if i < hi and self.ids[i] == record_id:
+            del self.keys[i]
+            del self.ids[i]
+
+    def equal(self, key):
+        return self.ids[bisect_left(self.keys, key):bisect_right(self.keys, key)]
+
+    def prefixed(self, prefix):
+        return self.ids[bisect_left(self.keys, prefix):bisect_left(self.keys, prefix + PREFIX_END)]
+
+
+# In-memory text index over a few fields of one table, for type-ahead search.
+#
+# Every field is normalized and indexed three ways:
+#   - its whole text, sorted, for exact and prefix matches of the field
+#   - its words, sorted, for word prefix matches; all a one or two character
+#     term can match
+#   - a trigram posting list (trigram -> ids) shared by the fields, for
+#     substring matches of longer terms: candidates are the ids holding every
+#     trigram of the term, checked with `in` afterwards
+# Each term of a query has to match one of the fields. Results are ranked by
+# how well the terms match (whole field, start of the field, start of a word,
+# anywhere), then by which field matched (earlier fields first), then by the
+# length of the first field, then by id.
+#
+# A single term is answered tier by tier from the sorted lists, stopping as
+# soon as limit results are in hand, so a term most records share ("com" in
+# email addresses) does not mean scoring every record. Multi-term queries
+# intersect the candidates of their terms first and score what is left.
+#
+# Records are kept as loaded, so results are served without the database.
+# version is the change version (see GET /changes) the index has caught up to.
+class TextIndex:
+    EXACT, FIELD_PREFIX, WORD_PREFIX, SUBSTRING = range(4)
+
+    def __init__(self, fields, records=(), version=0):
+        self.fields = tuple(fields)
+        self.records = {}
+        # id -> (normalized field texts, words per field)
+        self._docs = {}
+        # id -> length of the first field, then id, packed into one int: the
+        # tie-break within a tier
+        self._order = {}
+        postings = {}
+        texts = [[] for _ in self.fields]
+        words = [[] for _ in self.fields]
+        for record in records:
+            record_id = record["id"]
+            doc = self._store(record)
+            for field, (text, field_words) in enumerate(zip(*doc)):
+                texts[field].append((text, record_id))
+                words[field].extend((word, record_id) for word in field_words)
+            for gram in set().union(*map(trigrams, doc[0])):
+                postings.setdefault(gram, []).append(record_id)
+        self._grams = {gram: set(ids) for gram, ids in postings.items()}
+        self._texts = [SortedKeys(pairs) for pairs in texts]
+        self._words = [SortedKeys(pairs) for pairs in words]
+        self.version = version
+        self.synced_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.records)
+
+    def _store(self, record):
+        record_id = record["id"]
+        texts = tuple(normalize(record.get(field)) for field in self.fields)
+        doc = (texts, tuple(tuple(dict.fromkeys(WORD_PATTERN.findall(text))) for text in texts))
+        self.records[record_id] = record
+        self._docs[record_id] = doc
+        self._order[record_id] = (len(texts[0]) << 40) | record_id
+        return doc
+
+    def put(self, record):
+        record_id = record["id"]
+        self.discard(record_id)
+        texts, words = self._store(record)
+        for field, text in enumerate(texts):
+            self._texts[field].add(text, record_id)
+            for word in words[field]:
+                self._words[field].add(word, record_id)
+            for gram in trigrams(text):
+                self._grams.setdefault(gram, set()).add(record_id)
+
+    # Apply a batch of changed records and deleted ids, in that order
+    def update(self, records=(), deleted=()):
+        for record in records:
+            self.put(record)
+        for record_id in deleted:
+            self.discard(record_id)
+
+    def discard(self, record_id):
+        doc = self._docs.pop(record_id, None)
+        if doc is None:
+            return
+        del self.records[record_id]
+        del self._order[record_id]
+        texts, words = doc
+        for field, text in enumerate(texts):
+            self._texts[field].remove(text, record_id)
+            for word in words[field]:
+                self._words[field].remove(word, record_id)
+            for gram in trigrams(text):
+                ids = self._grams.get(gram)
+                if ids is not None:
+                    ids.discard(record_id)
+                    if not ids:
+                        del self._grams[gram]
+
+    # Ids that may match term: a superset for long terms, exact for short ones.
+    # Short terms match the start of a field or of a word, as in _tiers, so
+    # one with punctuation ("o'") is found through the field prefix.
+    def _candidates(self, term):
+        if len(term) >= 3:
+            postings = sorted((self._grams.get(g, ()) for g in trigrams(term)), key=len)
+            if not postings[0]:
+                return set()
+            return set(postings[0]).intersection(*postings[1:])
+        ids = set()
+        for texts in self._texts:
+            ids.update(texts.prefixed(term))
+        for words in self._words:
+            ids.update(words.prefixed(term))
+        return ids
+
+    # (tier, field) of the best match of term in a document, or None
+    def _match(self, term, doc):
+        texts, words = doc
+        best = None
+        for field, text in enumerate(texts):
+            if text == term:
+                tier = self.EXACT
+            elif text.startswith(term):
+                tier = self.FIELD_PREFIX
+            elif any(word.startswith(term) for word in words[field]):
+                tier = self.WORD_PREFIX
+            elif len(term) >= 3 and term in text:
+                tier = self.SUBSTRING
+            else:
+                continue
+            if best is None or (tier, field) < best:
+                best = (tier, field)
+        return best
+
+    # Ids matching term, a tier and field at a time, best first
+    def _tiers(self, term):
+        for field in range(len(self.fields)):
+            yield self._texts[field].equal(term)
+        for field in range(len(self.fields)):
+            yield self._texts[field].prefixed(term)
+        for field in range(len(self.fields)):
+            yield self._words[field].prefixed(term)
+        if len(term) >= 3:
+            candidates = self._candidates(term)
+            yield [i for i in candidates if any(term in text for text in self._docs[i][0])]
+
+    def _search_term(self, term, limit, where):
+        found = []
+        seen = set()
+        for ids in self._tiers(term):
+            ids = set(ids)
+            ids.difference_update(seen)
+            seen |= ids
+            if where is not None:
+                ids = [i for i in ids if where(self.records[i])]
+            found.extend(heapq.nsmallest(limit - len(found), ids, key=self._order.__getitem__))
+            if len(found) >= limit:
+                break
+        return found
+
+    def _search_terms(self, terms, limit, where):
+        # Most selective (longest) terms first, so the intersection shrinks fast
+        candidates = None
+        for term in sorted(terms, key=len, reverse=True):
+            ids = self._candidates(term)
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return []
+        ranked = []
+        for record_id in candidates:
+            if where is not None and not where(self.records[record_id]):
+                continue
+            doc = self._docs[record_id]
+            tiers = 0
+            first_field = len(self.fields)
+            for term in terms:
+                match = self._match(term, doc)
+                if match is None:
+                    break
+                tiers += match[0]
+                first_field = min(first_field, match[1])
+            else:
+                ranked.append((tiers, first_field, self._order[record_id], record_id))
+        return [record_id for *_, record_id in heapq.nsmallest(limit, ranked)]
+
+    # Best `limit` records matching query; where(record) filters further
+    def search(self, query, limit=20, where=None):
+        terms = list(dict.fromkeys(normalize(query).split()))
+        if not terms:
+            return []
+        if len(terms) == 1:
+            ids = self._search_term(terms[0], limit, where)
+        else:
+            ids = self._search_terms(terms, limit, where)
+        return [self.records[record_id] for record_id in ids]
+
+    def stats(self):
+        return {
+            "records": len(self.records),
+            "trigrams": len(self._grams),
+            "words": sum(len(words) for words in self._words),
+            "version": self.version,
+        }
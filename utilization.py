@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Bucket sizes accepted by GET /rooms/utilization, in seconds
+BUCKETS = {"15m": 900, "30m": 1800, "1h": 3600, "1d": 86400}
+
+HOURS_PER_WEEK = 7 * 24
+
+
+# Function to move a window start down to a bucket boundary counted from
+# midnight, so buckets line up with the clock (and 1h buckets with hours)
+def align(value, bucket):
+    midnight = datetime.combine(value.date(), datetime.min.time())
+    offset = int((value - midnight).total_seconds()) // bucket * bucket
+    return midnight + timedelta(seconds=offset)
+
+
+def bucket_count(span, bucket):
+    return -(-span // bucket)
+
+
+# Seconds covered by the intervals [starts, ends) in each bucket of each group.
+#
+# Every interval is split into its two edges: +1 at the start and -1 at the end.
+# An edge at x contributes (bucket end - x) to its own bucket and a whole bucket
+# to every later one, so both parts are summed with np.bincount and the second
+# one is carried forward with a cumulative sum. No Python loop over intervals.
+# starts and ends are seconds from the grid origin and must lie in [0, nbuckets * bucket].
+def covered_seconds(groups, ngroups, starts, ends, nbuckets, bucket):
+    width = nbuckets + 2
+    x = np.concatenate((starts, ends))
+    sign = np.concatenate((np.ones(len(starts)), -np.ones(len(ends))))
+    b = x // bucket
+    flat = np.concatenate((groups, groups)) * width + b
+    partial = np.bincount(flat, weights=sign * ((b + 1) * bucket - x), minlength=ngroups * width)
+    carried = np.bincount(flat + 1, weights=sign * bucket, minlength=ngroups * width)
+    total = partial.reshape(ngroups, width) + np.cumsum(carried.reshape(ngroups, width), axis=1)
+    return total[:, :nbuckets]
+
+
+# Highest number of intervals open at the same time, and when it was first reached
+def peak_concurrency(starts, ends):
+    if not len(starts):
+        return 0, None
+    # Edges packed into one sortable key: time * 2, plus 1 for a start. Intervals
+    # are half-open, so at equal times ends sort before starts.
+    keys = np.sort(np.concatenate((starts * 2 + 1, ends * 2)))
+    open_count = np.cumsum((keys & 1) * 2 - 1)
+    i = int(np.argmax(open_count))
+    return int(open_count[i]), int(keys[i] >> 1)
+
+
+# Utilization report for rooms over [window_start, window_end).
+#
+# room_ids is every room to report, booked or not. booking_rooms, starts and
+# ends describe the bookings as arrays; starts and ends are seconds from
+# window_start (they may reach outside the window and are clipped here).
+# window_start is expected to be aligned to the bucket.
+def room_utilization(room_ids, booking_rooms, starts, ends, window_start, window_end, bucket):
+    rooms = np.unique(np.asarray(room_ids, dtype=np.int64))
+    span = int((window_end - window_start).total_seconds())
+    nbuckets = bucket_count(span, bucket)
+
+    booking_rooms = np.asarray(booking_rooms, dtype=np.int64)
+    starts = np.clip(np.asarray(starts, dtype=np.int64), 0, span)
+    ends = np.clip(np.asarray(ends, dtype=np.int64), 0, span)
+    # Room id -> row number through a lookup table; ids are dense auto-increment
+    # values, and bookings of rooms not reported map to -1 and are dropped
+    lookup = np.full(max(rooms.max(initial=0), booking_rooms.max(initial=0)) + 1, -1, dtype=np.int64)
+    lookup[rooms] = np.arange(len(rooms))
+    groups = lookup[booking_rooms]
+    keep = (ends > starts) & (groups >= 0)
+    groups, starts, ends = groups[keep], starts[keep], ends[keep]
+
+    zero = np.zeros(1, dtype=np.int64)
+    capacity = covered_seconds(zero, 1, zero, np.array([span]), nbuckets, bucket)[0]
+    booked = covered_seconds(groups, len(rooms), starts, ends, nbuckets, bucket)
+    occupancy = booked / capacity
+
+    # Weekday x hour of day over all rooms, on an hourly grid starting at the
+    # hour window_start falls in
+    shift = window_start.minute * 60 + window_start.second
+    hours = bucket_count(span + shift, 3600)
+    hourly_capacity = covered_seconds(zero, 1, np.array([shift]), np.array([span + shift]), hours, 3600)[0]
+    hourly_booked = covered_seconds(np.zeros(len(starts), dtype=np.int64), 1, starts + shift, ends + shift, hours, 3600)[0]
+    hour_of_week = (window_start.weekday() * 24 + window_start.hour + np.arange(hours)) % HOURS_PER_WEEK
+    week_booked = np.bincount(hour_of_week, weights=hourly_booked, minlength=HOURS_PER_WEEK)
+    week_capacity = np.bincount(hour_of_week, weights=hourly_capacity, minlength=HOURS_PER_WEEK) * len(rooms)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        by_weekday_hour = np.where(week_capacity > 0, week_booked / week_capacity, np.nan).reshape(7, 24)
+
+    rooms_in_use = (booked > 0).sum(axis=0)
+    peak_bucket = int(np.argmax(rooms_in_use)) if nbuckets else 0
+    peak_rooms, peak_at = peak_concurrency(starts, ends)
+    total_capacity = span * len(rooms)
+
+    return {
+        "from": window_start,
+        "to": window_end,
+        "bucket_seconds": bucket,
+        "buckets": nbuckets,
+        "utilization": round(float(booked.sum()) / total_capacity, 4) if total_capacity else 0.0,
+        # Monday first; null where the window does not cover that hour
+        "by_weekday_hour": [[None if np.isnan(v) else round(float(v), 4) for v in row] for row in by_weekday_hour],
+        "peak": {
+            "rooms_in_use": peak_rooms,
+            "at": window_start + timedelta(seconds=peak_at) if peak_at is not None else None,
+            "busiest_bucket": window_start + timedelta(seconds=peak_bucket * bucket),
+            "busiest_bucket_rooms": int(rooms_in_use[peak_bucket]) if nbuckets else 0,
+        },
+        "rooms": [
+            {
+                "room_id": room_id,
+                "booked_seconds": int(round(booked[i].sum())),
+                "utilization": round(float(booked[i].sum()) / span, 4) if span else 0.0,
+                "occupancy": row,
+            }
+            for i, (room_id, row) in enumerate(zip(rooms.tolist(), np.round(occupancy, 4).tolist()))
+        ],
+    }